@@ -1,5 +1,5 @@
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, send_file, stream_with_context
 from flask_cors import CORS
 import sys
 import os
@@ -8,14 +8,15 @@ import os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
-from src.auth import authenticate_user, generate_token, create_default_admin
-from src.database import init_db
-from src.data_manager import DataManager
+from src.auth import authenticate_user, generate_token, create_default_admin, user_cache
+from src.storage_backends import get_backend
+from src.data_manager import DataManager, profile_cache
 from src.kms_api import KMS
 from src.hybrid_crypto import HybridCrypto
 from src.error_handling.error_handler import set_error_visualizer
 from src.error_handling.error_visualizer import ErrorVisualizer
 import base64
+import json
 from src.api_versioning import create_api_blueprint
 from src.input_validation import validate_string, sanitize_string, validate_email, validate_password
 from src.logging_tracing import CentralizedLogger, DistributedTracer
@@ -125,6 +126,65 @@ def retrieve_encrypted_data(data_id):
         return jsonify(data)
     return jsonify({'message': 'Data not found'}), 404
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+@app.route('/api/data/<data_id>/content', methods=['GET'])
+def retrieve_encrypted_content(data_id):
+    # In a real app, you'd add authentication/authorization here
+    # The raw ciphertext, without base64. Spilled blobs are sent as files, which WSGI
+    # servers with wsgi.file_wrapper (e.g. gunicorn) hand to os.sendfile.
+    try:
+        location = data_manager.locate_encrypted_content(data_id)
+    except FileNotFoundError as e:
+        return jsonify({'message': str(e)}), 500
+    if location is None:
+        return jsonify({'message': 'Data not found'}), 404
+    content, blob_path = location
+    if blob_path is not None:
+        return send_file(blob_path, mimetype='application/octet-stream', conditional=True)
+    return Response(content, mimetype='application/octet-stream')
+
+@app.route('/api/data/stream', methods=['POST'])
+def store_encrypted_stream():
+    # In a real app, you'd add authentication/authorization here
+    # The raw request body (application/octet-stream) is read, encrypted and stored chunk by chunk.
+    user_id = request.args.get('user_id', type=int)
+    data_type = request.args.get('data_type')
+    kms_key_id = request.args.get('kms_key_id')
+    if not all([user_id, data_type, kms_key_id]):
+        return jsonify({'message': 'Missing user_id, data_type or kms_key_id'}), 400
+
+    body_chunks = iter(lambda: request.stream.read(STREAM_CHUNK_SIZE), b'')
+    try:
+        wrapped_dek, encrypted_chunks = kms.encrypt_stream(kms_key_id, body_chunks)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    encryption_metadata = {
+        'format': 'stream',
+        'kms_key_id': kms_key_id,
+        'wrapped_dek': base64.b64encode(wrapped_dek).decode('utf-8'),
+        'chunk_size': STREAM_CHUNK_SIZE,
+    }
+    data_id = data_manager.store_encrypted_chunks(user_id, data_type, encrypted_chunks, encryption_metadata)
+    if data_id:
+        return jsonify({'message': 'Data stored successfully', 'data_id': data_id}), 201
+    return jsonify({'message': 'Failed to store data'}), 500
+
+@app.route('/api/data/<data_id>/stream', methods=['GET'])
+def retrieve_decrypted_stream(data_id):
+    # In a real app, you'd add authentication/authorization here
+    data = data_manager.retrieve_encrypted_data(data_id)
+    if not data:
+        return jsonify({'message': 'Data not found'}), 404
+    metadata = data['encryption_metadata']
+    if metadata.get('format') != 'stream':
+        return jsonify({'message': 'Data was not stored as a stream'}), 400
+
+    wrapped_dek = base64.b64decode(metadata['wrapped_dek'])
+    plaintext_chunks = kms.decrypt_stream(metadata['kms_key_id'], wrapped_dek,
+                                          data_manager.iter_encrypted_chunks(data_id))
+    return Response(stream_with_context(plaintext_chunks), mimetype='application/octet-stream')
+
 @app.route('/api/data/<data_id>', methods=['DELETE'])
 def delete_encrypted_data(data_id):
     # In a real app, you'd add authentication/authorization here
@@ -133,12 +193,28 @@ def delete_encrypted_data(data_id):
         return jsonify({'message': 'Data deleted successfully'})
     return jsonify({'message': 'Failed to delete data or data not found'}), 404
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
 @app.route('/api/data/user/<int:user_id>', methods=['GET'])
 def list_encrypted_data_by_user(user_id):
     # In a real app, you'd add authentication/authorization here
+    # Results are paginated: pass the returned next_cursor as ?cursor= to get the next page.
     data_type = request.args.get('data_type')
-    data_list = data_manager.list_encrypted_data_by_user(user_id, data_type)
-    return jsonify({'data_list': data_list})
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'message': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+    try:
+        page = data_manager.list_encrypted_data_page(user_id, data_type, limit=limit,
+                                                     cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'data_list': page['items'], 'next_cursor': page['next_cursor']})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    # Authentication/Authorization would be added here
+    return jsonify({cache.name: cache.get_stats() for cache in (user_cache, profile_cache)})
 
 # --- KMS Endpoints ---
 
@@ -175,6 +251,29 @@ def generate_symmetric_key():
     except Exception as e:
         return jsonify({'message': f'Error generating symmetric key: {e}'}), 500
 
+@app.route('/api/kms/generate_bulk', methods=['POST'])
+def generate_keys_bulk():
+    # Authentication/Authorization would be added here
+    data = request.get_json()
+    specs = data.get('keys') if data else None
+
+    if not specs or not isinstance(specs, list):
+        return jsonify({'message': 'Missing keys'}), 400
+
+    try:
+        key_ids = kms.generate_keys_bulk(specs)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'message': f'Error generating keys: {e}'}), 500
+
+    # Stream one JSON line per key so large tenants don't need one huge response body.
+    def generate():
+        for key_id in key_ids:
+            yield json.dumps({'key_id': key_id}) + '\n'
+
+    return Response(stream_with_context(generate()), status=201, mimetype='application/x-ndjson')
+
 
 @app.route('/api/kms/rotate_key/<string:key_id>', methods=['POST'])
 def rotate_key(key_id):
@@ -191,13 +290,23 @@ def rotate_key(key_id):
 def revoke_key(key_id):
     # Authentication/Authorization would be added here
     try:
-        kms.revoke_key(key_id)
+        kms.revoke_key(key_id, version=request.args.get('version', type=int))
         return jsonify({'message': f'Key {key_id} revoked successfully.'}), 200
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'message': f'Error revoking key: {e}'}), 500
 
+@app.route('/api/kms/usage/<string:key_id>', methods=['GET'])
+def get_key_usage(key_id):
+    # Authentication/Authorization would be added here
+    try:
+        return jsonify({'key_id': key_id, 'usage': kms.get_key_usage(key_id)}), 200
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 404
+    except Exception as e:
+        return jsonify({'message': f'Error reading key usage: {e}'}), 500
+
 # --- Hybrid Crypto Endpoints ---
 
 @app.route('/api/hybrid_crypto/key_exchange', methods=['POST'])
@@ -326,7 +435,7 @@ def hybrid_verify():
 
 if __name__ == '__main__':
     try:
-        init_db()
+        get_backend().init_schema()
         create_default_admin()
         logger.info("Starting API server...")
         app.run(debug=True, port=5000)
@@ -0,0 +1,486 @@
+"""
+This module provides an asyncio data-access layer with the same operations as
+DataManager and the user functions of auth, for use from ASGI front ends. It is built
+on asyncpg and its own connection pool, so slow queries suspend a coroutine instead of
+pinning a worker thread. bcrypt hashing and checking run in worker threads.
+
+    data = await AsyncDataManager.connect()
+    profile = await data.get_user_profile(user_id)
+    ...
+    await data.close()
+"""
+import asyncio
+import itertools
+import json
+import re
+import uuid
+from itertools import islice
+from src.auth import hash_password, check_password, user_cache
+from src.blob_store import BlobStore
+from src.config import Config
+from src.data_manager import DataManager, profile_cache
+from src.storage_backends import PostgresBackend
+
+try:
+    import asyncpg
+except ImportError:  # optional dependency, only needed for AsyncDataManager.connect()
+    asyncpg = None
+
+_DRIVER_ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError) if asyncpg is not None else ()
+
+
+def _load_json(value):
+    # asyncpg returns json/jsonb columns as text unless a type codec is registered.
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _numbered_placeholders(query: str) -> str:
+    # Storage backends build conditions with DB-API %s placeholders; asyncpg takes $1, $2, ...
+    counter = itertools.count(1)
+    return re.sub(r"%s", lambda _: f"${next(counter)}", query)
+
+
+class AsyncDataManager:
+    """
+    Async counterpart of DataManager (plus user lookup and authentication).
+
+    Args:
+        pool: An asyncpg pool, or any pool whose `acquire()` yields connections with
+              asyncpg's fetch/fetchrow/fetchval/execute/executemany/transaction/cursor API.
+        errors (tuple): Driver exception types that are reported and turned into the
+              DataManager-style failure return values (asyncpg's errors by default).
+        blob_store (BlobStore): Where large ciphertexts are spilled, as in DataManager
+              (Config.BLOB_STORE_PATH by default). Blobs of deleted rows are left to
+              DataManager.collect_blob_garbage.
+        kms: The KMS holding the blind index key; only needed for searchable fields.
+        blind_index_key_id (str): The blind index key (Config.BLIND_INDEX_KEY_ID by default).
+        backend: The storage backend whose SQL conditions (metadata_condition) match the
+              pool's database (PostgresBackend by default).
+
+    Writes invalidate the process-wide user and profile caches used by the synchronous
+    layer, so both layers can serve the same application.
+    """
+
+    def __init__(self, pool, errors: tuple = None, blob_store: BlobStore = None, blob_threshold: int = None,
+                 kms=None, blind_index_key_id: str = None, backend=None):
+        self.pool = pool
+        self.errors = errors if errors is not None else _DRIVER_ERRORS
+        self.backend = backend if backend is not None else PostgresBackend()
+        self.kms = kms
+        self.blind_index_key_id = blind_index_key_id or Config.BLIND_INDEX_KEY_ID
+        if blob_store is None and Config.BLOB_STORE_PATH:
+            blob_store = BlobStore(Config.BLOB_STORE_PATH)
+        self.blob_store = blob_store
+        self.blob_threshold = Config.BLOB_SPILL_THRESHOLD_KB * 1024 if blob_threshold is None else blob_threshold
+
+    @classmethod
+    async def connect(cls, dsn: str = None, min_size: int = None, max_size: int = None, **kwargs):
+        """
+        Creates an asyncpg pool (sized like the synchronous pool by default) and returns
+        a manager using it. Other keyword arguments are passed to the constructor.
+        """
+        if asyncpg is None:
+            raise ImportError("AsyncDataManager.connect() requires the 'asyncpg' package.")
+        pool = await asyncpg.create_pool(
+            dsn or Config.DATABASE_URL,
+            min_size=Config.DB_POOL_MIN_CONN if min_size is None else min_size,
+            max_size=Config.DB_POOL_MAX_CONN if max_size is None else max_size,
+            max_inactive_connection_lifetime=Config.DB_POOL_MAX_LIFETIME,
+        )
+        return cls(pool, **kwargs)
+
+    async def close(self):
+        await self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    # --- Users ---
+
+    async def create_user(self, username: str, password: str, role: str = 'user'):
+        try:
+            hashed_password = await asyncio.to_thread(hash_password, password)
+            async with self.pool.acquire() as conn:
+                user_id = await conn.fetchval(
+                    "INSERT INTO users (username, password_hash, role) VALUES ($1, $2, $3) RETURNING id",
+                    username, hashed_password, role
+                )
+            user_cache.invalidate(username)
+        except self.errors as e:
+            print(f"Error creating user: {e}")
+            return None
+        if not await self.create_user_profile(user_id, username):
+            print(f"Warning: Failed to create profile for user {username}")
+        return user_id
+
+    async def get_user_by_username(self, username: str):
+        # Served from the same user_cache as auth.get_user_by_username.
+        try:
+            user = await user_cache.get_async(username, lambda: self._load_user_by_username(username))
+            return dict(user) if user else None
+        except self.errors as e:
+            print(f"Error getting user by username: {e}")
+            return None
+
+    async def _load_user_by_username(self, username: str):
+        async with self.pool.acquire() as conn:
+            user = await conn.fetchrow(
+                "SELECT id, username, password_hash, role FROM users WHERE username = $1", username)
+        if user:
+            return {'id': user[0], 'username': user[1], 'password_hash': user[2], 'role': user[3]}
+        return None
+
+    async def authenticate_user(self, username: str, password: str):
+        user = await self.get_user_by_username(username)
+        if user and await asyncio.to_thread(check_password, password, user['password_hash']):
+            return user
+        return None
+
+    # --- User Profile Management ---
+
+    async def create_user_profile(self, user_id: int, display_name: str, profile_picture_url: str = None,
+                                  preferences: dict = None):
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(
+                    "INSERT INTO user_profiles (user_id, display_name, profile_picture_url, preferences) VALUES ($1, $2, $3, $4)",
+                    user_id, display_name, profile_picture_url, json.dumps(preferences) if preferences else None
+                )
+            profile_cache.invalidate(user_id)
+            return True
+        except self.errors as e:
+            print(f"Error creating user profile: {e}")
+            return False
+
+    async def get_user_profile(self, user_id: int):
+        # Served from the same profile_cache as DataManager.get_user_profile.
+        try:
+            profile = await profile_cache.get_async(user_id, lambda: self._load_user_profile(user_id))
+            return dict(profile) if profile else None
+        except self.errors as e:
+            print(f"Error getting user profile: {e}")
+            return None
+
+    async def _load_user_profile(self, user_id: int):
+        async with self.pool.acquire() as conn:
+            profile = await conn.fetchrow(
+                "SELECT user_id, display_name, profile_picture_url, preferences, created_at, updated_at FROM user_profiles WHERE user_id = $1",
+                user_id)
+        if profile:
+            return {
+                "user_id": profile[0],
+                "display_name": profile[1],
+                "profile_picture_url": profile[2],
+                "preferences": _load_json(profile[3]) if profile[3] else None,
+                "created_at": profile[4],
+                "updated_at": profile[5]
+            }
+        return None
+
+    async def update_user_profile(self, user_id: int, display_name: str = None, profile_picture_url: str = None,
+                                  preferences: dict = None):
+        updates = []
+        params = []
+        for column, value in (("display_name", display_name), ("profile_picture_url", profile_picture_url),
+                              ("preferences", json.dumps(preferences) if preferences is not None else None)):
+            if value is not None:
+                params.append(value)
+                updates.append(f"{column} = ${len(params)}")
+        if not updates:
+            return False # No updates to perform
+
+        params.append(user_id)
+        try:
+            async with self.pool.acquire() as conn:
+                updated = await conn.fetch(
+                    f"UPDATE user_profiles SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE user_id = ${len(params)} RETURNING user_id",
+                    *params
+                )
+            profile_cache.invalidate(user_id)
+            return len(updated) > 0
+        except self.errors as e:
+            print(f"Error updating user profile: {e}")
+            return False
+
+    async def delete_user_profile(self, user_id: int):
+        try:
+            async with self.pool.acquire() as conn:
+                deleted = await conn.fetch("DELETE FROM user_profiles WHERE user_id = $1 RETURNING user_id", user_id)
+            profile_cache.invalidate(user_id)
+            return len(deleted) > 0
+        except self.errors as e:
+            print(f"Error deleting user profile: {e}")
+            return False
+
+    # --- Encrypted Data Store Management ---
+    # data_ids are generated client-side, which also lets batches return their IDs
+    # without RETURNING (executemany and COPY cannot return rows).
+
+    _ENCRYPTED_DATA_COLUMNS = ["data_id", "user_id", "data_type", "encrypted_content", "encryption_metadata",
+                               "blind_indexes"]
+    _INSERT_ENCRYPTED_DATA = (f"INSERT INTO encrypted_data_store ({', '.join(_ENCRYPTED_DATA_COLUMNS)}) "
+                              "VALUES ($1, $2, $3, $4, $5, $6)")
+
+    async def store_encrypted_data(self, user_id: int, data_type: str, encrypted_content: bytes, encryption_metadata: dict,
+                                   searchable_fields: dict = None):
+        """
+        Stores an encrypted payload and returns its data_id, or None on failure. Large
+        payloads and `searchable_fields` are handled as in DataManager.store_encrypted_data.
+        """
+        record = (await asyncio.to_thread(
+            self._to_records, [(user_id, data_type, encrypted_content, encryption_metadata, searchable_fields)]))[0]
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(self._INSERT_ENCRYPTED_DATA, *record)
+            return record[0]
+        except self.errors as e:
+            print(f"Error storing encrypted data: {e}")
+            return None
+
+    def _spill(self, encrypted_content: bytes, encryption_metadata: dict):
+        if self.blob_store is None:
+            return encrypted_content, encryption_metadata
+        return self.blob_store.spill(encrypted_content, encryption_metadata, self.blob_threshold)
+
+    def _blind_indexes(self, user_id: int, fields: dict) -> list:
+        if self.kms is None:
+            raise ValueError("Searchable fields require an AsyncDataManager with a KMS for the blind index key.")
+        return [self.kms.compute_blind_index(self.blind_index_key_id, field, value, scope=str(user_id))
+                for field, value in fields.items()]
+
+    def _to_records(self, rows) -> list:
+        # Blocking (blob writes, blind index derivation), so callers run it in a worker thread.
+        records = []
+        for row in rows:
+            user_id, data_type, encrypted_content, encryption_metadata = row[:4]
+            searchable_fields = row[4] if len(row) > 4 else None
+            blind_indexes = self._blind_indexes(user_id, searchable_fields) if searchable_fields else None
+            encrypted_content, encryption_metadata = self._spill(encrypted_content, encryption_metadata)
+            records.append((str(uuid.uuid4()), user_id, data_type, encrypted_content, json.dumps(encryption_metadata),
+                            blind_indexes))
+        return records
+
+    async def store_encrypted_data_many(self, rows):
+        """
+        Inserts many (user_id, data_type, encrypted_content, encryption_metadata) rows in a
+        single transaction, spilling large payloads as store_encrypted_data does. A row may
+        carry a fifth element, its searchable_fields.
+        Returns the new data_ids in input order, or None on failure.
+        """
+        records = await asyncio.to_thread(self._to_records, rows)
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany(self._INSERT_ENCRYPTED_DATA, records)
+            return [record[0] for record in records]
+        except self.errors as e:
+            print(f"Error storing encrypted data batch: {e}")
+            return None
+
+    async def copy_encrypted_data(self, rows, chunk_size: int = 10000):
+        """
+        Bulk-loads rows with COPY (asyncpg's binary copy_records_to_table), `chunk_size`
+        rows at a time, in one transaction. Rows are as in store_encrypted_data_many.
+        Returns the new data_ids, or None on failure.
+        """
+        rows = iter(rows)
+        data_ids = []
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    while True:
+                        chunk = list(islice(rows, chunk_size))
+                        if not chunk:
+                            break
+                        records = await asyncio.to_thread(self._to_records, chunk)
+                        await conn.copy_records_to_table("encrypted_data_store", records=records,
+                                                         columns=self._ENCRYPTED_DATA_COLUMNS)
+                        data_ids.extend(record[0] for record in records)
+            return data_ids
+        except self.errors as e:
+            print(f"Error copying encrypted data: {e}")
+            return None
+
+    async def retrieve_encrypted_data(self, data_id: str):
+        try:
+            async with self.pool.acquire() as conn:
+                data = await conn.fetchrow(
+                    "SELECT data_id, user_id, data_type, encrypted_content, encryption_metadata, created_at, updated_at FROM encrypted_data_store WHERE data_id = $1",
+                    data_id)
+            if data:
+                metadata = _load_json(data[4])
+                encrypted_content = bytes(data[3])
+                if metadata.get("storage") == "blob":
+                    if self.blob_store is None:
+                        raise FileNotFoundError("Encrypted content is in the blob store, but no blob store is configured.")
+                    encrypted_content = await asyncio.to_thread(self.blob_store.read, metadata["blob_digest"])
+                return {
+                    "data_id": str(data[0]),
+                    "user_id": data[1],
+                    "data_type": data[2],
+                    "encrypted_content": encrypted_content,
+                    "encryption_metadata": metadata,
+                    "created_at": data[5],
+                    "updated_at": data[6]
+                }
+            return None
+        except (*self.errors, OSError) as e:
+            print(f"Error retrieving encrypted data: {e}")
+            return None
+
+    async def delete_encrypted_data(self, data_id: str):
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("DELETE FROM encrypted_data_chunks WHERE data_id = $1", data_id)
+                    deleted = await conn.fetch("DELETE FROM encrypted_data_store WHERE data_id = $1 RETURNING data_id", data_id)
+            return len(deleted) > 0
+        except self.errors as e:
+            print(f"Error deleting encrypted data: {e}")
+            return False
+
+    @staticmethod
+    def _user_items_query(user_id: int, data_type: str = None):
+        query = "SELECT data_id, data_type, created_at FROM encrypted_data_store WHERE user_id = $1"
+        params = [user_id]
+        if data_type:
+            params.append(data_type)
+            query += f" AND data_type = ${len(params)}"
+        return query, params
+
+    async def list_encrypted_data_by_user(self, user_id: int, data_type: str = None):
+        try:
+            return [item async for item in self.iter_encrypted_data_by_user(user_id, data_type)]
+        except self.errors as e:
+            print(f"Error listing encrypted data: {e}")
+            return []
+
+    async def iter_encrypted_data_by_user(self, user_id: int, data_type: str = None, fetch_size: int = 1000):
+        """
+        Async generator over all of a user's items (oldest first), streamed from a
+        server-side cursor `fetch_size` rows at a time.
+        """
+        query, params = self._user_items_query(user_id, data_type)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(query + " ORDER BY created_at, data_id", *params, prefetch=fetch_size):
+                    yield {"data_id": str(row[0]), "data_type": row[1], "created_at": row[2]}
+
+    async def list_encrypted_data_page(self, user_id: int, data_type: str = None, limit: int = 100, cursor: str = None):
+        """
+        Keyset-paginated listing; see DataManager.list_encrypted_data_page (the cursors
+        of both layers are interchangeable).
+        """
+        query, params = self._user_items_query(user_id, data_type)
+        if cursor:
+            created_at, data_id = DataManager._decode_page_cursor(cursor)
+            params += [created_at, data_id]
+            query += f" AND (created_at, data_id) > (${len(params) - 1}, ${len(params)})"
+        params.append(limit + 1)
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(query + f" ORDER BY created_at, data_id LIMIT ${len(params)}", *params)
+        except self.errors as e:
+            print(f"Error listing encrypted data: {e}")
+            return {"items": [], "next_cursor": None}
+        items = [{"data_id": str(row[0]), "data_type": row[1], "created_at": row[2]} for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = DataManager._encode_page_cursor(items[-1]["created_at"], items[-1]["data_id"])
+        return {"items": items, "next_cursor": next_cursor}
+
+    async def query_by_metadata(self, filters: dict, cursor: str = None, limit: int = 100, user_id: int = None,
+                                data_type: str = None, include_content: bool = False):
+        """
+        Returns one page of records whose encryption_metadata contains `filters`; see
+        DataManager.query_by_metadata (the cursors of both layers are interchangeable).
+        """
+        if not filters:
+            raise ValueError("query_by_metadata requires at least one metadata filter.")
+        condition, params = self.backend.metadata_condition(filters)
+        columns = "data_id, user_id, data_type, encryption_metadata, created_at"
+        if include_content:
+            columns += ", encrypted_content"
+        query = f"SELECT {columns} FROM encrypted_data_store WHERE {condition}"
+        if user_id is not None:
+            query += " AND user_id = %s"
+            params.append(user_id)
+        if data_type:
+            query += " AND data_type = %s"
+            params.append(data_type)
+        if cursor:
+            created_at, data_id = DataManager._decode_page_cursor(cursor)
+            query += " AND (created_at, data_id) > (%s, %s)"
+            params += [created_at, data_id]
+        params.append(limit + 1)
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(_numbered_placeholders(query + " ORDER BY created_at, data_id LIMIT %s"), *params)
+        except self.errors as e:
+            print(f"Error querying encrypted data by metadata: {e}")
+            return {"items": [], "next_cursor": None}
+        items = []
+        for row in rows[:limit]:
+            item = {"data_id": str(row[0]), "user_id": row[1], "data_type": row[2],
+                    "encryption_metadata": _load_json(row[3]), "created_at": row[4]}
+            if include_content:
+                item["encrypted_content"] = bytes(row[5])
+            items.append(item)
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = DataManager._encode_page_cursor(items[-1]["created_at"], items[-1]["data_id"])
+        return {"items": items, "next_cursor": next_cursor}
+
+    # --- Chunked storage for large objects ---
+
+    async def store_encrypted_chunks(self, user_id: int, data_type: str, chunks, encryption_metadata: dict,
+                                     page_size: int = 16):
+        """
+        Stores a large object as encrypted chunks (see DataManager.store_encrypted_chunks).
+        `chunks` may be a regular or an async iterable. Returns the data_id, or None on failure.
+        """
+        data_id = str(uuid.uuid4())
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(self._INSERT_ENCRYPTED_DATA, data_id, user_id, data_type, b"",
+                                       json.dumps(dict(encryption_metadata, storage="chunked")), None)
+                    seq, page = 0, []
+                    async for chunk in self._aiter(chunks):
+                        page.append((data_id, seq, chunk))
+                        seq += 1
+                        if len(page) == page_size:
+                            await conn.executemany("INSERT INTO encrypted_data_chunks (data_id, seq, chunk) VALUES ($1, $2, $3)", page)
+                            page = []
+                    if page:
+                        await conn.executemany("INSERT INTO encrypted_data_chunks (data_id, seq, chunk) VALUES ($1, $2, $3)", page)
+                    metadata = dict(encryption_metadata, storage="chunked", chunk_count=seq)
+                    await conn.execute("UPDATE encrypted_data_store SET encryption_metadata = $1 WHERE data_id = $2",
+                                       json.dumps(metadata), data_id)
+            return data_id
+        except self.errors as e:
+            print(f"Error storing encrypted chunks: {e}")
+            return None
+
+    async def iter_encrypted_chunks(self, data_id: str, fetch_size: int = 8):
+        """
+        Async generator yielding the stored chunks of an object in order, streamed from a
+        server-side cursor.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor("SELECT chunk FROM encrypted_data_chunks WHERE data_id = $1 ORDER BY seq",
+                                             data_id, prefetch=fetch_size):
+                    yield bytes(row[0])
+
+    @staticmethod
+    async def _aiter(iterable):
+        if hasattr(iterable, "__aiter__"):
+            async for item in iterable:
+                yield item
+        else:
+            for item in iterable:
+                yield item
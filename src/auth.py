@@ -2,11 +2,14 @@
 import bcrypt
 import jwt
 import datetime
+from src.cache import ReadThroughCache
 from src.config import Config
-from src.database import get_db_connection
+from src.storage_backends import get_backend
 from src.data_manager import DataManager
 
 data_manager = DataManager()
+user_cache = ReadThroughCache("users_by_username", ttl=Config.CACHE_TTL, negative_ttl=Config.CACHE_NEGATIVE_TTL,
+                              max_entries=Config.CACHE_MAX_ENTRIES)
 
 def hash_password(password):
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -15,20 +18,21 @@ def check_password(password, hashed_password):
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def create_user(username, password, role='user'):
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        hashed_password = hash_password(password)
-        cur.execute(
-            "INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s) RETURNING id;",
-            (username, hashed_password, role)
-        )
-        user_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
+        with get_backend().connection() as conn:
+            cur = conn.cursor()
+            hashed_password = hash_password(password)
+            cur.execute(
+                "INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s) RETURNING id;",
+                (username, hashed_password, role)
+            )
+            user_id = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
+        # Drop a cached "not found" for this username.
+        user_cache.invalidate(username)
 
-        # Create a default user profile for the new user
+        # Create a default user profile for the new user (after the connection is back in the pool)
         default_display_name = username  # Use username as default display name
         profile_created = data_manager.create_user_profile(user_id, default_display_name)
         if not profile_created:
@@ -38,14 +42,17 @@ def create_user(username, password, role='user'):
     except Exception as e:
         print(f"Error creating user: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
 def get_user_by_username(username):
-    conn = None
     try:
-        conn = get_db_connection()
+        user = user_cache.get(username, lambda: _load_user_by_username(username))
+        return dict(user) if user else None
+    except Exception as e:
+        print(f"Error getting user by username: {e}")
+        return None
+
+def _load_user_by_username(username):
+    with get_backend().connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT id, username, password_hash, role FROM users WHERE username = %s;", (username,))
         user = cur.fetchone()
@@ -53,12 +60,6 @@ def get_user_by_username(username):
         if user:
             return {'id': user[0], 'username': user[1], 'password_hash': user[2], 'role': user[3]}
         return None
-    except Exception as e:
-        print(f"Error getting user by username: {e}")
-        return None
-    finally:
-        if conn:
-            conn.close()
 
 def authenticate_user(username, password):
     print(f"Attempting to authenticate user: {username}")
@@ -113,20 +114,17 @@ def create_default_admin():
             print(f"Failed to create default admin user '{admin_username}'.")
     else:
         # If admin user exists, update their password to the default
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            hashed_password = hash_password(admin_password)
-            cur.execute(
-                "UPDATE users SET password_hash = %s WHERE username = %s;",
-                (hashed_password, admin_username)
-            )
-            conn.commit()
-            print(f"Default admin user '{admin_username}' password updated.")
+            with get_backend().connection() as conn:
+                cur = conn.cursor()
+                hashed_password = hash_password(admin_password)
+                cur.execute(
+                    "UPDATE users SET password_hash = %s WHERE username = %s;",
+                    (hashed_password, admin_username)
+                )
+                conn.commit()
+                user_cache.invalidate(admin_username)
+                print(f"Default admin user '{admin_username}' password updated.")
         except Exception as e:
             print(f"Error updating admin password: {e}")
-        finally:
-            if conn:
-                conn.close()
 
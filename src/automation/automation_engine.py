@@ -149,6 +149,23 @@ class AutomationEngine:
             return task["status"]
         return "not_found"
 
+    def update_task_progress(self, task_id, progress: dict):
+        """
+        Records progress information reported by a long-running task.
+        """
+        task = self.all_tasks.get(task_id)
+        if task:
+            task["progress"] = dict(progress)
+
+    def get_task_progress(self, task_id):
+        """
+        Retrieves the last progress reported by a task, or None if none was reported.
+        """
+        task = self.all_tasks.get(task_id)
+        if task:
+            return task.get("progress")
+        return None
+
     def get_all_tasks(self):
         """
         Returns a dictionary of all tasks managed by the engine.
@@ -66,6 +66,28 @@ def automated_key_generation(key_type: str, key_id: str = None):
         logging.error(f"Error during automated key generation for type {key_type}, id {key_id}: {e}")
         return {"status": "error", "key_type": key_type, "key_id": key_id, "reason": str(e)}
 
+def automated_rotation_sweep(max_age_seconds: float, key_type: str = None, algorithm: str = None):
+    """
+    Rotates every active key that has not been rotated for `max_age_seconds`.
+    Due keys are found through the KMS metadata indexes in O(log n + c) (plus sorting
+    when the status/type index is walked), where c is the number of candidates in the
+    narrowest index, without decrypting the key store. Each of the k rotations then
+    updates the rotation-time index, which costs O(n) in the worst case (see
+    KeyMetadataIndex), so the sweep as a whole is O(log n + c + k*n) at worst.
+    """
+    logging.info(f"Starting rotation sweep for keys older than {max_age_seconds}s (type: {key_type}, algorithm: {algorithm})")
+    try:
+        due_key_ids = kms_instance.get_keys_due_for_rotation(max_age_seconds, key_type=key_type, algorithm=algorithm)
+    except Exception as e:
+        logging.error(f"Error finding keys due for rotation: {e}")
+        return {"status": "error", "reason": str(e)}
+
+    results = [automated_key_rotation(key_id) for key_id in due_key_ids]
+    rotated = [r["key_id"] for r in results if r["status"] == "success"]
+    failed = [r["key_id"] for r in results if r["status"] != "success"]
+    logging.info(f"Rotation sweep complete. Rotated: {len(rotated)}, failed: {len(failed)}")
+    return {"status": "success" if not failed else "partial", "rotated": rotated, "failed": failed}
+
 # Example of how these tasks could be registered (conceptual)
 if __name__ == "__main__":
     # This part would typically be done by the AutomationEngine or API interface
@@ -0,0 +1,83 @@
+"""
+partition_manager.py
+
+This module defines a periodic task that maintains the partitions of
+`encrypted_data_store`: it pre-creates the monthly partitions for the coming months and
+removes the partitions that have passed the retention period (see
+DataManager.expire_encrypted_data), together with the spilled blobs they referenced.
+Runs are submitted to the AutomationEngine.
+"""
+
+import logging
+import threading
+from src.config import Config
+from src.data_manager import DataManager
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class PartitionManager:
+    """
+    Runs partition maintenance every `interval` seconds (daily by default). Partitions
+    are created `months_ahead` months in advance, so a missed run does not block inserts.
+    """
+
+    def __init__(self, automation_engine, data_manager: DataManager = None, months_ahead: int = None,
+                 retention_days: int = None, detach_only: bool = False, interval: float = 24 * 3600):
+        self.automation_engine = automation_engine
+        self.data_manager = data_manager or DataManager()
+        self.months_ahead = Config.PARTITION_PREMAKE_MONTHS if months_ahead is None else months_ahead
+        self.retention_days = Config.DATA_RETENTION_DAYS if retention_days is None else retention_days
+        self.detach_only = detach_only
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> dict:
+        """
+        Creates upcoming partitions and expires old ones. Returns a summary.
+        """
+        try:
+            created = self.data_manager.backend.ensure_partitions(self.months_ahead)
+            expired = self.data_manager.expire_encrypted_data(self.retention_days, self.detach_only)
+            # Detached partitions still reference their blobs.
+            blobs_removed = [] if self.detach_only else self.data_manager.collect_blob_garbage()
+        except Exception as e:
+            logging.error(f"Partition maintenance failed: {e}")
+            return {"status": "error", "reason": str(e)}
+        if expired is None:
+            return {"status": "error", "created": created, "reason": "Expiring encrypted data failed"}
+        logging.info(f"Partition maintenance complete. Created: {created}, removed: {expired['partitions']}, "
+                     f"deleted rows: {expired['deleted_rows']}, blobs removed: {len(blobs_removed)}")
+        return {"status": "success", "created": created, "removed": expired["partitions"],
+                "deleted_rows": expired["deleted_rows"], "blobs_removed": blobs_removed}
+
+    def submit(self) -> str:
+        """
+        Queues one maintenance run on the AutomationEngine and returns its task ID.
+        """
+        return self.automation_engine.add_task(self.run_once)
+
+    def _run(self) -> None:
+        while True:
+            self.submit()
+            if self._stop_event.wait(self.interval):
+                return
+
+    def start(self) -> None:
+        """
+        Starts submitting a maintenance run immediately and then every `interval` seconds.
+        """
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="PartitionManager")
+        self._thread.start()
+        logging.info("PartitionManager started.")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        logging.info("PartitionManager stopped.")
@@ -0,0 +1,279 @@
+"""
+reencryption_job.py
+
+This module defines a bulk re-encryption job that migrates rows of
+`encrypted_data_store` to the current version of a KMS key after rotation.
+
+Rows are selected by the `kms_key_id` field of their `encryption_metadata`. Their
+`encrypted_content` is either `nonce (12) + tag (16) + ciphertext` as produced by
+`KMS.encrypt_data_with_kms_key`, or an envelope from `KMS.encrypt_envelope` when the
+metadata has `"format": "envelope"` (only the wrapped DEK is re-wrapped in that case).
+Chunked streams (`"format": "stream"`) keep their wrapped DEK in the metadata, which is
+re-wrapped while the chunks stay as they are. Rows spilled to the blob store
+(`"storage": "blob"`) are re-encrypted from the blob and point at a new blob afterwards;
+the old one is left to DataManager.collect_blob_garbage.
+"""
+
+import base64
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_batch
+from src.blob_store import BlobStore
+from src.config import Config
+from src.database import get_db_connection
+from src.storage_backends import PostgresBackend
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class ReencryptionJob:
+    """
+    Streams the IDs of rows encrypted under a KMS key through a server-side cursor,
+    fetches each batch's content, re-encrypts it on a worker pool and writes it back in
+    batched transactions.
+
+    After every committed batch the last processed data_id is checkpointed to disk,
+    so a job that is restarted with the same checkpoint file resumes where it stopped.
+    Rows that fail to re-encrypt are kept in the checkpoint ("failed_data_ids") and
+    retried first on the next run; a run that leaves failed rows ends with status
+    "completed_with_failures". Throughput is capped at `max_rows_per_second` to
+    protect production latency.
+    """
+
+    def __init__(self, kms, key_id: str, checkpoint_path: str = None, batch_size: int = 500,
+                 workers: int = 4, max_rows_per_second: float = None, blob_store: BlobStore = None):
+        self.kms = kms
+        self.key_id = key_id
+        self.checkpoint_path = checkpoint_path or f"./reencryption_{key_id}.checkpoint.json"
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_rows_per_second = max_rows_per_second
+        if blob_store is None and Config.BLOB_STORE_PATH:
+            blob_store = BlobStore(Config.BLOB_STORE_PATH)
+        self.blob_store = blob_store
+        self.progress = {
+            "key_id": key_id,
+            "status": "pending",
+            "processed": 0,
+            "reencrypted": 0,
+            "skipped": 0,
+            "failed": 0,
+            "failed_data_ids": [],
+            "last_data_id": None,
+            "rows_per_second": 0.0,
+        }
+        self._engine = None
+        self._task_id = None
+
+    # --- Checkpointing ---
+
+    def _load_checkpoint(self) -> None:
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("key_id") == self.key_id:
+            self.progress.update(checkpoint)
+            logging.info(f"Resuming re-encryption of '{self.key_id}' after data_id {self.progress['last_data_id']}")
+
+    def _save_checkpoint(self) -> None:
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.progress, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # --- Progress reporting ---
+
+    def submit(self, engine) -> str:
+        """
+        Queues the job on an AutomationEngine as a long-running task and returns its task ID.
+        Progress and throughput are published through `engine.update_task_progress`.
+        """
+        self._engine = engine
+        self._task_id = engine.add_task(self.run)
+        self._report_progress()
+        return self._task_id
+
+    def _report_progress(self) -> None:
+        if self._engine is not None and self._task_id is not None:
+            self._engine.update_task_progress(self._task_id, self.progress)
+
+    # --- Re-encryption ---
+
+    def _reencrypt_row(self, row, current_version: int):
+        """
+        Returns (data_id, new_content, new_metadata), or None if the row is already
+        encrypted under the current key version.
+        """
+        data_id, encrypted_content, metadata = row
+        content = bytes(encrypted_content)
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        spilled = metadata.get("storage") == "blob"
+        if spilled:
+            if self.blob_store is None:
+                raise FileNotFoundError("Encrypted content is in the blob store, but no blob store is configured.")
+            content = self.blob_store.read(metadata["blob_digest"])
+
+        if metadata.get("format") == "stream":
+            # Chunked objects: only the DEK in the metadata is re-wrapped; the chunks are untouched.
+            wrapped_dek = base64.b64decode(metadata["wrapped_dek"])
+            if self.kms.ciphertext_key_version(wrapped_dek[28:]) == current_version:
+                return None
+            metadata["wrapped_dek"] = base64.b64encode(self.kms.rewrap_data_key(self.key_id, wrapped_dek)).decode('utf-8')
+            new_content = content
+        elif metadata.get("format") == "envelope":
+            wrapped_dek = self.kms._split_envelope(content)[0]
+            if self.kms.ciphertext_key_version(wrapped_dek[28:]) == current_version:
+                return None
+            new_content = self.kms.rewrap_envelope(self.key_id, content)
+        else:
+            nonce, tag, ciphertext = content[:12], content[12:28], content[28:]
+            if self.kms.ciphertext_key_version(ciphertext) == current_version:
+                return None
+            plaintext = self.kms.decrypt_data_with_kms_key(self.key_id, ciphertext, nonce, tag)
+            new_ciphertext, new_nonce, new_tag = self.kms.encrypt_data_with_kms_key(self.key_id, plaintext)
+            new_content = new_nonce + new_tag + new_ciphertext
+
+        if spilled:
+            # Other rows may share the old blob (identical ciphertexts), so it is not deleted here.
+            metadata["blob_digest"] = self.blob_store.put(new_content)
+            metadata["blob_size"] = len(new_content)
+            new_content = b""
+        metadata["key_version"] = current_version
+        return data_id, new_content, metadata
+
+    def _key_condition(self) -> tuple[str, list]:
+        # A containment match, so rows are found through the GIN index on encryption_metadata.
+        return PostgresBackend().metadata_condition({"kms_key_id": self.key_id})
+
+    def _fetch_rows(self, write_conn, data_ids: list) -> list:
+        condition, params = self._key_condition()
+        cur = write_conn.cursor()
+        cur.execute("SELECT data_id, encrypted_content, encryption_metadata FROM encrypted_data_store "
+                    f"WHERE data_id = ANY(%s::uuid[]) AND {condition}", [list(data_ids)] + params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    def _process_batch(self, executor, write_conn, data_ids: list, current_version: int, retry: bool = False) -> None:
+        """
+        Re-encrypts the rows with the given IDs (rows deleted or re-keyed meanwhile are
+        skipped). With `retry` the IDs are earlier failures rather than the next keyset batch.
+        """
+        rows = self._fetch_rows(write_conn, data_ids)
+        results, failed_ids = [], []
+        for row, result in zip(rows, executor.map(lambda r: self._safe_reencrypt(r, current_version), rows)):
+            if result is False:
+                failed_ids.append(str(row[0]))
+            elif result is None:
+                self.progress["skipped"] += 1
+            else:
+                results.append(result)
+
+        cur = write_conn.cursor()
+        execute_batch(
+            cur,
+            "UPDATE encrypted_data_store SET encrypted_content = %s, encryption_metadata = %s, "
+            "updated_at = CURRENT_TIMESTAMP WHERE data_id = %s",
+            [(content, json.dumps(metadata), data_id) for data_id, content, metadata in results],
+            page_size=self.batch_size,
+        )
+        write_conn.commit()
+        cur.close()
+
+        self.progress["reencrypted"] += len(results)
+        failed = set(self.progress["failed_data_ids"])
+        if retry:
+            failed.difference_update(str(data_id) for data_id in data_ids)
+        else:
+            self.progress["processed"] += len(data_ids)
+            self.progress["last_data_id"] = str(data_ids[-1])
+        failed.update(failed_ids)
+        self.progress["failed_data_ids"] = sorted(failed)
+        self.progress["failed"] = len(failed)
+        self._save_checkpoint()
+
+    def _safe_reencrypt(self, row, current_version: int):
+        try:
+            return self._reencrypt_row(row, current_version)
+        except Exception as e:
+            logging.error(f"Failed to re-encrypt data_id {row[0]}: {e}")
+            return False
+
+    def _throttle(self, started_at: float, processed_this_run: int) -> None:
+        elapsed = time.monotonic() - started_at
+        if self.max_rows_per_second:
+            minimum_elapsed = processed_this_run / self.max_rows_per_second
+            if minimum_elapsed > elapsed:
+                time.sleep(minimum_elapsed - elapsed)
+                elapsed = minimum_elapsed
+        self.progress["rows_per_second"] = processed_this_run / elapsed if elapsed > 0 else 0.0
+
+    def run(self) -> dict:
+        """
+        Runs (or resumes) the job to completion and returns the final progress.
+        """
+        self._load_checkpoint()
+        current_version = len(self.kms.get_key_versions(self.key_id))
+        self.progress["status"] = "running"
+        self._report_progress()
+
+        read_conn = None
+        write_conn = None
+        started_at = time.monotonic()
+        processed_at_start = self.progress["processed"]
+        try:
+            read_conn = get_db_connection()
+            write_conn = get_db_connection()
+            # A named cursor is a server-side cursor: rows are streamed in chunks of itersize.
+            read_cur = read_conn.cursor(name=f"reencrypt_{self.key_id}")
+            read_cur.itersize = self.batch_size
+            # Only the keys are streamed; each batch's content is fetched when it is processed.
+            condition, params = self._key_condition()
+            query = f"SELECT data_id FROM encrypted_data_store WHERE {condition}"
+            if self.progress["last_data_id"]:
+                query += " AND data_id > %s"
+                params.append(self.progress["last_data_id"])
+            read_cur.execute(query + " ORDER BY data_id", params)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                retry_ids = list(self.progress["failed_data_ids"])
+                for i in range(0, len(retry_ids), self.batch_size):
+                    self._process_batch(executor, write_conn, retry_ids[i:i + self.batch_size], current_version,
+                                        retry=True)
+                    self._report_progress()
+                while True:
+                    rows = read_cur.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    self._process_batch(executor, write_conn, [row[0] for row in rows], current_version)
+                    self._throttle(started_at, self.progress["processed"] - processed_at_start)
+                    self._report_progress()
+            read_cur.close()
+            if self.progress["failed_data_ids"]:
+                self.progress["status"] = "completed_with_failures"
+                logging.warning(f"Re-encryption of '{self.key_id}' left {self.progress['failed']} failed rows; "
+                                f"they are retried on the next run: {self.progress}")
+            else:
+                self.progress["status"] = "completed"
+                logging.info(f"Re-encryption of '{self.key_id}' completed: {self.progress}")
+        except Exception as e:
+            if write_conn:
+                write_conn.rollback()
+            self.progress["status"] = "failed"
+            self.progress["error"] = str(e)
+            logging.error(f"Re-encryption of '{self.key_id}' failed: {e}")
+        finally:
+            if read_conn:
+                read_conn.close()
+            if write_conn:
+                write_conn.close()
+            self._save_checkpoint()
+            self._report_progress()
+        return self.progress
@@ -0,0 +1,255 @@
+"""
+rotation_scheduler.py
+
+This module defines a scheduler that rotates KMS keys when they come due.
+Each active key is kept in a min-heap keyed on its due time (`last_rotated_at` plus
+its rotation interval). The scheduler thread sleeps until the earliest key is due,
+then submits the due keys to the AutomationEngine in batches. Scheduling or
+rescheduling a key costs O(log n); there are no periodic scans of the key store.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class RotationScheduler:
+    """
+    Rotates keys according to a default interval and optional per-key intervals.
+
+    Heap entries are invalidated lazily: rescheduling a key pushes a new entry and
+    bumps the key's generation, and stale entries are discarded when they surface.
+    Entries can also go stale outside the scheduler (a key rotated or revoked through
+    the API or by another worker); rotate_batch checks each key against the KMS first.
+    """
+
+    def __init__(self, kms, automation_engine, default_interval: float = 90 * 24 * 3600,
+                 max_batch_size: int = 100, retry_delay: float = 300.0):
+        self.kms = kms
+        self.automation_engine = automation_engine
+        self.default_interval = default_interval
+        self.max_batch_size = max_batch_size
+        self.retry_delay = retry_delay
+        self._heap = []  # (due_at, generation, key_id)
+        self._entries = {}  # key_id -> generation of its live heap entry
+        self._intervals = {}  # key_id -> per-key rotation interval
+        self._generation = 0
+        self._condition = threading.Condition()
+        self._is_running = False
+        self._thread = None
+        # Keys that reach their usage limits are rotated early.
+        kms.usage.threshold_listeners.append(self._on_usage_threshold)
+
+    # --- Scheduling ---
+
+    def set_rotation_interval(self, key_id: str, interval: float, last_rotated_at: float = None) -> None:
+        """
+        Sets a per-key rotation interval (in seconds) and reschedules the key.
+        """
+        with self._condition:
+            self._intervals[key_id] = interval
+        if last_rotated_at is None:
+            key_info = self.kms.get_key(key_id)
+            last_rotated_at = key_info.get("last_rotated_at", key_info["created_at"]) if key_info else time.time()
+        self.schedule(key_id, last_rotated_at)
+
+    def schedule(self, key_id: str, last_rotated_at: float) -> float:
+        """
+        Schedules (or reschedules) a key for rotation and returns its due time.
+        """
+        with self._condition:
+            due_at = last_rotated_at + self._intervals.get(key_id, self.default_interval)
+            self._push(key_id, due_at)
+            # Wake the scheduler thread so it can shorten its sleep if this key is due earlier.
+            self._condition.notify()
+            return due_at
+
+    def request_rotation(self, key_id: str) -> None:
+        """
+        Makes a key due for rotation immediately, regardless of its interval.
+        """
+        with self._condition:
+            self._push(key_id, time.time())
+            self._condition.notify()
+
+    def _on_usage_threshold(self, key_id: str, usage: dict) -> None:
+        # Superseded versions keep counting decryptions; rotating then would retire the
+        # current version early.
+        try:
+            current_key_id = self.kms.get_current_key_id(key_id)
+        except ValueError:
+            return
+        if current_key_id != key_id:
+            logging.info(f"Key {key_id} reached its usage limit but is no longer the current version "
+                         f"({current_key_id}); not rotating.")
+            return
+        logging.info(f"Key {key_id} reached its usage limit ({usage['operations']} operations, "
+                     f"{usage['bytes']} bytes); scheduling rotation.")
+        self.request_rotation(key_id)
+
+    def unschedule(self, key_id: str) -> None:
+        """
+        Stops tracking a key, e.g. after it has been revoked.
+        """
+        with self._condition:
+            self._entries.pop(key_id, None)
+            self._intervals.pop(key_id, None)
+
+    def load_from_kms(self) -> int:
+        """
+        Schedules every active key in the KMS. Called once at startup; afterwards the
+        heap is maintained incrementally. Returns the number of keys scheduled.
+        """
+        records = self.kms.find_keys(status="active")
+        with self._condition:
+            for record in records:
+                due_at = record["last_rotated_at"] + self._intervals.get(record["key_id"], self.default_interval)
+                self._push(record["key_id"], due_at)
+            self._condition.notify()
+        logging.info(f"RotationScheduler loaded {len(records)} active keys.")
+        return len(records)
+
+    def next_due_at(self) -> float | None:
+        """
+        Returns the due time of the earliest scheduled key, or None if nothing is scheduled.
+        """
+        with self._condition:
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._entries)
+
+    def _push(self, key_id: str, due_at: float) -> None:
+        self._generation += 1
+        self._entries[key_id] = self._generation
+        heapq.heappush(self._heap, (due_at, self._generation, key_id))
+
+    def _discard_stale(self) -> None:
+        while self._heap and self._entries.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: float) -> list[str]:
+        due = []
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now and len(due) < self.max_batch_size:
+            _, _, key_id = heapq.heappop(self._heap)
+            del self._entries[key_id]
+            due.append(key_id)
+            self._discard_stale()
+        return due
+
+    # --- Rotation ---
+
+    def tick(self, now: float = None) -> list[str]:
+        """
+        Submits all keys due at `now` to the AutomationEngine, one task per batch of
+        at most `max_batch_size` keys. Returns the IDs of the submitted tasks.
+        """
+        now = time.time() if now is None else now
+        task_ids = []
+        while True:
+            with self._condition:
+                due_key_ids = self._pop_due(now)
+            if not due_key_ids:
+                return task_ids
+            task_ids.append(self.automation_engine.add_task(self.rotate_batch, due_key_ids))
+            logging.info(f"RotationScheduler submitted {len(due_key_ids)} keys for rotation.")
+
+    def rotate_batch(self, key_ids: list[str]) -> dict:
+        """
+        Rotates a batch of keys in a single key store commit and schedules the new
+        versions. Keys that fail to rotate are retried after `retry_delay` seconds.
+
+        Keys that are no longer the current version of their chain (rotated elsewhere
+        since they were scheduled) or that have been revoked are skipped; a superseded
+        key's current version is scheduled in its place.
+        """
+        rotated, failed, skipped = {}, [], {}
+        with self.kms.bulk():
+            for key_id in key_ids:
+                try:
+                    key_info = self.kms.get_key(key_id)
+                    if key_info is not None and key_info["status"] == "revoked":
+                        logging.info(f"Key {key_id} was revoked since it was scheduled; not rotating.")
+                        skipped[key_id] = None
+                        continue
+                    current_key_id = self.kms.get_current_key_id(key_id) if key_info is not None else key_id
+                    if current_key_id != key_id:
+                        logging.info(f"Key {key_id} was rotated to {current_key_id} since it was scheduled; "
+                                     f"not rotating.")
+                        current_info = self.kms.get_key(current_key_id)
+                        skipped[key_id] = (current_key_id,
+                                           current_info.get("last_rotated_at", current_info["created_at"]))
+                        continue
+                    rotated[key_id] = self.kms.rotate_key(key_id)
+                except Exception as e:
+                    logging.error(f"Scheduled rotation of key {key_id} failed: {e}")
+                    failed.append(key_id)
+
+        now = time.time()
+        with self._condition:
+            for key_id, new_key_id in rotated.items():
+                if key_id in self._intervals:
+                    self._intervals[new_key_id] = self._intervals.pop(key_id)
+                self._push(new_key_id, now + self._intervals.get(new_key_id, self.default_interval))
+            for key_id, current in skipped.items():
+                interval = self._intervals.pop(key_id, None)
+                if current is None:
+                    continue
+                current_key_id, last_rotated_at = current
+                if interval is not None:
+                    self._intervals.setdefault(current_key_id, interval)
+                if current_key_id not in self._entries:
+                    self._push(current_key_id,
+                               last_rotated_at + self._intervals.get(current_key_id, self.default_interval))
+            for key_id in failed:
+                self._push(key_id, now + self.retry_delay)
+            self._condition.notify()
+        logging.info(f"Scheduled rotation batch complete. Rotated: {len(rotated)}, skipped: {len(skipped)}, "
+                     f"failed: {len(failed)}")
+        return {"status": "success" if not failed else "partial", "rotated": rotated, "skipped": list(skipped),
+                "failed": failed}
+
+    # --- Scheduler thread ---
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._is_running:
+                    return
+                self._discard_stale()
+                timeout = None if not self._heap else self._heap[0][0] - time.time()
+                if timeout is None or timeout > 0:
+                    # Sleep until the earliest key is due, or until an earlier key is scheduled.
+                    self._condition.wait(timeout)
+                    continue
+            self.tick()
+
+    def start(self) -> None:
+        """
+        Starts the scheduler thread.
+        """
+        with self._condition:
+            if self._is_running:
+                return
+            self._is_running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="RotationScheduler")
+        self._thread.start()
+        logging.info("RotationScheduler started.")
+
+    def stop(self) -> None:
+        """
+        Stops the scheduler thread. Scheduled keys are kept.
+        """
+        with self._condition:
+            self._is_running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        logging.info("RotationScheduler stopped.")
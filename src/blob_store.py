@@ -0,0 +1,201 @@
+"""
+This module provides a content-addressed blob store on the local filesystem. DataManager
+spills large ciphertexts to it so that only a pointer and digest stay in the database row.
+
+Blobs are named by the SHA-256 of their content and sharded into nested directories
+(root/ab/cd/abcd...) so no directory grows too large. Writes go to a temporary file in
+the same filesystem, are fsynced and then renamed into place, so a blob is either
+absent or complete. Reads are served from a memory map or with os.sendfile, without
+copying the blob into Python memory.
+"""
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobStore:
+    """
+    Args:
+        root (str): Directory holding the blobs (created if missing).
+        shard_depth (int): Number of directory levels below the root.
+        shard_width (int): Hex digits of the digest used per directory level.
+    """
+
+    def __init__(self, root: str, shard_depth: int = 2, shard_width: int = 2):
+        self.root = root
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        """
+        Returns the file path of a blob. Raises ValueError for malformed digests.
+        """
+        if not _DIGEST_RE.match(digest):
+            raise ValueError(f"Invalid blob digest '{digest}'.")
+        shards = [digest[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, digest)
+
+    def put(self, data: bytes) -> str:
+        """
+        Stores `data` and returns its digest. Storing content that is already present is a no-op.
+        """
+        return self.put_stream([data])[0]
+
+    def put_stream(self, chunks) -> tuple[str, int]:
+        """
+        Stores the concatenation of `chunks` (any iterable of bytes), hashing while
+        writing, and returns (digest, size).
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            digest = hasher.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                # A fresh mtime keeps garbage collection (see iter_digests) off the reused blob.
+                os.utime(path)
+                return digest, size
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            self._fsync_dir(os.path.dirname(path))
+            return digest, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def spill(self, encrypted_content: bytes, encryption_metadata: dict, threshold: int):
+        """
+        Stores `encrypted_content` as a blob if it is larger than `threshold` bytes and returns
+        the (encrypted_content, encryption_metadata) to put in the row: an empty content and
+        metadata marked `"storage": "blob"` with the blob's digest and size, or the inputs
+        unchanged for smaller payloads.
+        """
+        if len(encrypted_content) <= threshold:
+            return encrypted_content, encryption_metadata
+        digest = self.put(bytes(encrypted_content))
+        return b"", dict(encryption_metadata, storage="blob", blob_digest=digest, blob_size=len(encrypted_content))
+
+    @staticmethod
+    def _fsync_dir(path: str) -> None:
+        # Makes the rename durable; not supported on every platform.
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def size(self, digest: str) -> int:
+        return os.path.getsize(self.path(digest))
+
+    @contextmanager
+    def open_mmap(self, digest: str):
+        """
+        Context manager yielding a read-only memoryview of the blob, backed by a memory
+        map. The view must not be used after the block exits.
+        """
+        with open(self.path(digest), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield memoryview(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def read(self, digest: str) -> bytes:
+        """
+        Returns the content of a blob. Raises FileNotFoundError if it does not exist.
+        """
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    def iter_chunks(self, digest: str, chunk_size: int = 1024 * 1024):
+        """
+        Generator yielding the blob in `chunk_size` pieces sliced from a memory map.
+        """
+        with self.open_mmap(digest) as view:
+            for offset in range(0, len(view), chunk_size):
+                yield bytes(view[offset:offset + chunk_size])
+
+    def sendfile(self, digest: str, out_fd: int, offset: int = 0, count: int = None) -> int:
+        """
+        Copies the blob (or `count` bytes of it from `offset`) to a file descriptor such
+        as a socket, using os.sendfile where available so the data stays in the kernel.
+        Returns the number of bytes sent.
+        """
+        with open(self.path(digest), "rb") as f:
+            remaining = os.fstat(f.fileno()).st_size - offset if count is None else count
+            sent = 0
+            while remaining > 0:
+                if hasattr(os, "sendfile"):
+                    n = os.sendfile(out_fd, f.fileno(), offset + sent, remaining)
+                else:
+                    f.seek(offset + sent)
+                    n = os.write(out_fd, f.read(min(remaining, 1024 * 1024)))
+                if n == 0:
+                    break
+                sent += n
+                remaining -= n
+            return sent
+
+    def verify(self, digest: str) -> bool:
+        """
+        Returns True if the blob exists and its content still hashes to its digest.
+        """
+        hasher = hashlib.sha256()
+        try:
+            for chunk in self.iter_chunks(digest):
+                hasher.update(chunk)
+        except FileNotFoundError:
+            return False
+        return hasher.hexdigest() == digest
+
+    def delete(self, digest: str) -> bool:
+        """
+        Removes a blob. Returns False if it did not exist.
+        """
+        try:
+            os.remove(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def iter_digests(self, min_age: float = 0.0):
+        """
+        Generator yielding the digests of stored blobs last modified at least `min_age` seconds ago.
+        """
+        cutoff = time.time() - min_age
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if d != "tmp"]
+            for filename in filenames:
+                if _DIGEST_RE.match(filename) and os.path.getmtime(os.path.join(dirpath, filename)) <= cutoff:
+                    yield filename
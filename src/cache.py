@@ -0,0 +1,245 @@
+"""
+This module provides a read-through cache for hot database lookups (users by username,
+user profiles). Entries are bounded by size and TTL, lookups of missing rows are cached
+for a shorter negative TTL, and concurrent misses on the same key are coalesced into a
+single load. The storage backend is pluggable: the default keeps entries in process
+memory, and RedisCacheBackend lets several worker processes share one cache.
+"""
+import asyncio
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class InMemoryCacheBackend:
+    """
+    A thread-safe LRU store with per-entry expiry, local to one process.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, entry)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, entry: dict, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _encode_json(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+
+def _decode_json(obj):
+    if "__datetime__" in obj and len(obj) == 1:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class RedisCacheBackend:
+    """
+    Stores entries in Redis so that all processes share one cache (and one invalidation).
+    Takes an existing client (e.g. `redis.Redis(...)`); values are stored as JSON with
+    a native Redis expiry.
+    """
+
+    def __init__(self, client, prefix: str = "qcache:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> dict | None:
+        data = self.client.get(self.prefix + key)
+        return None if data is None else json.loads(data, object_hook=_decode_json)
+
+    def set(self, key: str, entry: dict, ttl: float) -> None:
+        self.client.set(self.prefix + key, json.dumps(entry, default=_encode_json), px=max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+
+class _Flight:
+    """
+    A load in progress; callers that miss on the same key wait for its result.
+    """
+    __slots__ = ("done", "value", "error", "stale")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class ReadThroughCache:
+    """
+    A read-through cache in front of a loader function.
+
+    Args:
+        name (str): Namespace for this cache's keys in a shared backend.
+        ttl (float): Seconds a loaded value is cached.
+        negative_ttl (float): Seconds a "not found" (None) result is cached.
+        max_entries (int): Size bound of the default in-memory backend.
+        backend: Storage backend (InMemoryCacheBackend by default).
+    """
+
+    def __init__(self, name: str, ttl: float = 60.0, negative_ttl: float = 5.0, max_entries: int = 10000,
+                 backend=None):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.backend = backend if backend is not None else InMemoryCacheBackend(max_entries)
+        self._flights = {}
+        self._lock = threading.Lock()
+        # Orders backend writes against invalidations: a loaded value is stored only if no
+        # invalidation has happened since the load started, checked and written atomically.
+        self._write_lock = threading.Lock()
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0}
+
+    def _key(self, key) -> str:
+        return f"{self.name}:{key}"
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def get(self, key, loader):
+        """
+        Returns the cached value for `key`, calling `loader()` on a miss. A None result is
+        cached as "not found" for `negative_ttl` seconds. Exceptions from the loader are
+        propagated to every waiting caller and nothing is cached.
+        """
+        cache_key = self._key(key)
+        entry = self._lookup(cache_key)
+        if entry is not None:
+            return entry["value"]
+        flight, leader = self._join_flight(cache_key)
+        if not leader:
+            flight.done.wait()
+            return self._flight_result(flight)
+        try:
+            return self._store(cache_key, flight, loader())
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._end_flight(cache_key, flight)
+
+    async def get_async(self, key, loader):
+        """
+        Coroutine variant of get: `loader` is a coroutine function. Misses are coalesced
+        with concurrent get and get_async calls. Hits are served from the backend
+        directly, so the backend should answer quickly (as the in-memory one does).
+        """
+        cache_key = self._key(key)
+        entry = self._lookup(cache_key)
+        if entry is not None:
+            return entry["value"]
+        flight, leader = self._join_flight(cache_key)
+        if not leader:
+            await asyncio.to_thread(flight.done.wait)
+            return self._flight_result(flight)
+        try:
+            return self._store(cache_key, flight, await loader())
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._end_flight(cache_key, flight)
+
+    def _lookup(self, cache_key: str) -> dict | None:
+        entry = self.backend.get(cache_key)
+        if entry is not None:
+            self._count("hits" if entry["value"] is not None else "negative_hits")
+        return entry
+
+    def _join_flight(self, cache_key: str) -> tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(cache_key)
+            if flight is None:
+                flight = self._flights[cache_key] = _Flight()
+                self._stats["misses"] += 1
+                return flight, True
+            self._stats["coalesced"] += 1
+            return flight, False
+
+    @staticmethod
+    def _flight_result(flight: _Flight):
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _store(self, cache_key: str, flight: _Flight, value):
+        flight.value = value
+        with self._write_lock:
+            with self._lock:
+                stale = flight.stale
+            if not stale:
+                ttl = self.ttl if value is not None else self.negative_ttl
+                self.backend.set(cache_key, {"value": value}, ttl)
+        return value
+
+    def _end_flight(self, cache_key: str, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(cache_key) is flight:
+                del self._flights[cache_key]
+        flight.done.set()
+
+    def invalidate(self, key) -> None:
+        """
+        Drops the cached value for `key`. A load already in progress for the key is not
+        cached when it completes, so it cannot reinstate the old value.
+        """
+        cache_key = self._key(key)
+        with self._write_lock:
+            with self._lock:
+                flight = self._flights.pop(cache_key, None)
+                if flight is not None:
+                    flight.stale = True
+                self._stats["invalidations"] += 1
+            self.backend.delete(cache_key)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Returns hit/miss counters and the hit ratio (hits, including negative hits, over
+        all lookups). Coalesced lookups waited for another caller's load.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["negative_hits"] + stats["misses"] + stats["coalesced"]
+        stats["lookups"] = lookups
+        stats["hit_ratio"] = (stats["hits"] + stats["negative_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -1,26 +1,38 @@
 """This module provides the command-line interface for the quantum encryption project."""
 import argparse
-from src.hybrid_qkd_api import encrypt_data_hybrid, decrypt_data_hybrid
+from src.compression import CODECS
+from src.hybrid_qkd_api import (encrypt_data_hybrid, decrypt_data_hybrid, compress_and_encrypt_hybrid,
+                                decrypt_and_decompress_hybrid)
 from src.error_handling.error_handler import ErrorHandler, QuantumError
 
+# Files encrypted with compression start with this magic and a codec byte.
+COMPRESSED_FILE_MAGIC = b"QCZ1"
 
-def encrypt_file(input_filepath: str, output_filepath: str) -> None:
+
+def encrypt_file(input_filepath: str, output_filepath: str, compression: str = "none", level: int = None) -> None:
     """Encrypts a file using the hybrid encryption scheme.
 
     Args:
         input_filepath (str): The path to the input file.
         output_filepath (str): The path to the output file.
+        compression (str): Compress before encrypting: "none", "auto", "zlib" or "lzma".
+        level (int): Compression level for zlib/lzma.
     """
     with open(input_filepath, "rb") as f:
         plaintext = f.read()
     # For demonstration, we'll use a placeholder session key.
     # In a real scenario, this would be derived from a key exchange.
     session_key = b'\x00' * 32  # Dummy 32-byte key
-    ciphertext, nonce, tag = encrypt_data_hybrid(plaintext, session_key)
+    if compression == "none":
+        ciphertext, nonce, tag = encrypt_data_hybrid(plaintext, session_key)
+        header = b""
+    else:
+        ciphertext, nonce, tag, codec = compress_and_encrypt_hybrid(plaintext, session_key, compression, level)
+        header = COMPRESSED_FILE_MAGIC + bytes([CODECS.index(codec)])
     # In a real scenario, nonce and tag would also need to be stored/transmitted
     # along with the ciphertext for decryption.
     # For now, we'll concatenate them for simplicity.
-    ciphertext = nonce + tag + ciphertext
+    ciphertext = header + nonce + tag + ciphertext
     with open(output_filepath, "wb") as f:
         f.write(ciphertext)
     print(f"File '{input_filepath}' encrypted to '{output_filepath}'.")
@@ -39,12 +51,25 @@ def decrypt_file(input_filepath: str, output_filepath: str) -> None:
     with open(input_filepath, "rb") as f:
         encrypted_data = f.read()
     
+    codec = None
+    if encrypted_data.startswith(COMPRESSED_FILE_MAGIC):
+        header_size = len(COMPRESSED_FILE_MAGIC) + 1
+        if len(encrypted_data) < header_size or encrypted_data[header_size - 1] >= len(CODECS):
+            raise ValueError(f"'{input_filepath}' has a corrupt compression header.")
+        codec = CODECS[encrypted_data[header_size - 1]]
+        encrypted_data = encrypted_data[header_size:]
+    if len(encrypted_data) < 28:
+        raise ValueError(f"'{input_filepath}' is too short to be an encrypted file.")
+
     # Assuming nonce (12 bytes) and tag (16 bytes) are prepended to the ciphertext
     nonce = encrypted_data[:12]
     tag = bytes(encrypted_data[12:28])
     ciphertext = encrypted_data[28:]
     
-    plaintext = decrypt_data_hybrid(ciphertext, nonce, tag, session_key)
+    if codec is None:
+        plaintext = decrypt_data_hybrid(ciphertext, nonce, tag, session_key)
+    else:
+        plaintext = decrypt_and_decompress_hybrid(ciphertext, nonce, tag, session_key, codec)
     with open(output_filepath, "wb") as f:
         f.write(plaintext)
     print(f"File '{input_filepath}' decrypted to '{output_filepath}'.")
@@ -62,14 +87,24 @@ def main():
     )
     parser.add_argument("input", help="Input file path.")
     parser.add_argument("output", help="Output file path.")
+    parser.add_argument(
+        "--compression",
+        choices=["none", "auto", "zlib", "lzma"],
+        default="none",
+        help="Compress the file before encrypting it (encrypt only; 'auto' skips incompressible data).",
+    )
+    parser.add_argument("--level", type=int, choices=range(10), help="Compression level (0-9).")
 
     args = parser.parse_args()
 
     try:
         if args.action == "encrypt":
-            encrypt_file(args.input, args.output)
+            encrypt_file(args.input, args.output, args.compression, args.level)
         elif args.action == "decrypt":
             decrypt_file(args.input, args.output)
+    except ValueError as e:
+        # Malformed input files are reported like bad arguments (exit status 2).
+        parser.error(str(e))
     except QuantumEncryptionError as e:
         ErrorHandler.handle_error(e)
     except Exception as e:
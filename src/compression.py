@@ -0,0 +1,74 @@
+"""
+This module provides the compression stage applied to payloads before they are
+encrypted. Ciphertext is incompressible, so compression has to happen on the plaintext.
+The "auto" mode compresses a sample first and stores incompressible data (media,
+archives, already-encrypted content) as-is.
+"""
+import lzma
+import zlib
+
+CODECS = ("none", "zlib", "lzma")
+
+# Payloads smaller than this are not worth the codec overhead.
+MIN_COMPRESS_SIZE = 128
+# "auto" compresses this much of the payload to estimate how well it compresses...
+AUTO_SAMPLE_SIZE = 64 * 1024
+# ...and only compresses the whole payload if the sample shrinks to at most this ratio.
+AUTO_MAX_RATIO = 0.9
+
+_DEFAULT_LEVELS = {"zlib": 6, "lzma": 6}
+
+
+def compress(data: bytes, codec: str = "auto", level: int = None) -> tuple[bytes, str]:
+    """
+    Compresses data with the given codec ("none", "zlib", "lzma" or "auto").
+
+    In "auto" mode small and incompressible payloads are left uncompressed and the rest
+    is compressed with zlib. Any codec falls back to "none" when compression would not
+    make the payload smaller.
+
+    Returns:
+        tuple: (payload, codec) where codec names the codec actually applied.
+    """
+    if codec not in CODECS + ("auto",):
+        raise ValueError(f"Unsupported compression codec '{codec}'. Choose from: {', '.join(CODECS + ('auto',))}.")
+    if codec == "none" or not data:
+        return data, "none"
+    if codec == "auto":
+        if len(data) < MIN_COMPRESS_SIZE:
+            return data, "none"
+        sample = data[:AUTO_SAMPLE_SIZE]
+        if len(zlib.compress(sample, 1)) > len(sample) * AUTO_MAX_RATIO:
+            return data, "none"
+        codec = "zlib"
+
+    level = _DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "zlib":
+        compressed = zlib.compress(data, level)
+    else:
+        compressed = lzma.compress(data, preset=level)
+    if len(compressed) >= len(data):
+        return data, "none"
+    return compressed, codec
+
+
+def decompress(data: bytes, codec: str, max_size: int = None) -> bytes:
+    """
+    Reverses compress(). If `max_size` is given, output beyond it raises ValueError
+    instead of being materialized (protection against decompression bombs).
+    """
+    if codec == "none":
+        return data
+    if codec == "zlib":
+        decompressor = zlib.decompressobj()
+        output = decompressor.decompress(data, max_size + 1 if max_size is not None else 0)
+        truncated = bool(decompressor.unconsumed_tail)
+    elif codec == "lzma":
+        decompressor = lzma.LZMADecompressor()
+        output = decompressor.decompress(data, max_size + 1 if max_size is not None else -1)
+        truncated = not decompressor.eof
+    else:
+        raise ValueError(f"Unsupported compression codec '{codec}'.")
+    if max_size is not None and (len(output) > max_size or truncated):
+        raise ValueError(f"Decompressed payload exceeds {max_size} bytes.")
+    return output
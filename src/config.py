@@ -3,4 +3,18 @@ import os
 
 class Config:
     DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://postgres:@localhost:5432/quantum_encryption')
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'postgresql') # 'postgresql' or 'sqlite'
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', './quantum_encryption.db')
     SECRET_KEY = os.environ.get('SECRET_KEY', 'super-secret-key') # Change this in production!
+    DB_POOL_MIN_CONN = int(os.environ.get('DB_POOL_MIN_CONN', 1))
+    DB_POOL_MAX_CONN = int(os.environ.get('DB_POOL_MAX_CONN', 20))
+    DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)) # seconds
+    DB_POOL_CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', 30)) # seconds
+    CACHE_TTL = float(os.environ.get('CACHE_TTL', 60)) # seconds
+    CACHE_NEGATIVE_TTL = float(os.environ.get('CACHE_NEGATIVE_TTL', 5)) # seconds
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    PARTITION_PREMAKE_MONTHS = int(os.environ.get('PARTITION_PREMAKE_MONTHS', 3))
+    DATA_RETENTION_DAYS = int(os.environ.get('DATA_RETENTION_DAYS', 0)) # 0 keeps data forever
+    BLIND_INDEX_KEY_ID = os.environ.get('BLIND_INDEX_KEY_ID', 'blind_index_key') # KMS symmetric key for blind indexes
+    BLOB_STORE_PATH = os.environ.get('BLOB_STORE_PATH', '') # empty keeps all ciphertexts inline
+    BLOB_SPILL_THRESHOLD_KB = int(os.environ.get('BLOB_SPILL_THRESHOLD_KB', 256))
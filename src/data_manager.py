@@ -1,36 +1,74 @@
-import psycopg2
+import base64
+import datetime
+import io
 import json
-from src.database import get_db_connection
+import struct
+import uuid
+from itertools import islice
+from cryptography.exceptions import InvalidTag
+from src.blob_store import BlobStore
+from src.cache import ReadThroughCache
+from src.config import Config
+from src.hybrid_qkd_api import compress_and_encrypt_hybrid, decrypt_and_decompress_hybrid
+from src.storage_backends import get_backend
+
+# Binary COPY framing (see "COPY ... FORMAT binary" in the PostgreSQL docs).
+_COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_BINARY_TRAILER = struct.pack("!h", -1)
+_JSONB_BINARY_VERSION = b"\x01"
+
+# Shared by all DataManager instances so writes through any of them invalidate it.
+profile_cache = ReadThroughCache("user_profiles", ttl=Config.CACHE_TTL, negative_ttl=Config.CACHE_NEGATIVE_TTL,
+                                 max_entries=Config.CACHE_MAX_ENTRIES)
 
 class DataManager:
-    def __init__(self):
-        pass
+    def __init__(self, backend=None, kms=None, blind_index_key_id: str = None, blob_store: BlobStore = None,
+                 blob_threshold: int = None):
+        self._backend = backend
+        # The KMS holding the blind index key; only needed for searchable fields.
+        self.kms = kms
+        self.blind_index_key_id = blind_index_key_id or Config.BLIND_INDEX_KEY_ID
+        # Ciphertexts larger than blob_threshold bytes are spilled to the blob store.
+        if blob_store is None and Config.BLOB_STORE_PATH:
+            blob_store = BlobStore(Config.BLOB_STORE_PATH)
+        self.blob_store = blob_store
+        self.blob_threshold = Config.BLOB_SPILL_THRESHOLD_KB * 1024 if blob_threshold is None else blob_threshold
+
+    @property
+    def backend(self):
+        """
+        The storage backend (see src.storage_backends); the process-wide one by default.
+        """
+        return self._backend if self._backend is not None else get_backend()
 
     # --- User Profile Management ---
 
     def create_user_profile(self, user_id: int, display_name: str, profile_picture_url: str = None, preferences: dict = None):
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO user_profiles (user_id, display_name, profile_picture_url, preferences) VALUES (%s, %s, %s, %s)",
-                (user_id, display_name, profile_picture_url, json.dumps(preferences) if preferences else None)
-            )
-            conn.commit()
-            cur.close()
-            return True
-        except psycopg2.Error as e:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "INSERT INTO user_profiles (user_id, display_name, profile_picture_url, preferences) VALUES (%s, %s, %s, %s)",
+                    (user_id, display_name, profile_picture_url, json.dumps(preferences) if preferences else None)
+                )
+                conn.commit()
+                cur.close()
+                profile_cache.invalidate(user_id)
+                return True
+        except self.backend.errors as e:
             print(f"Error creating user profile: {e}")
-            if conn: conn.rollback()
             return False
-        finally:
-            if conn: conn.close()
 
     def get_user_profile(self, user_id: int):
-        conn = None
         try:
-            conn = get_db_connection()
+            profile = profile_cache.get(user_id, lambda: self._load_user_profile(user_id))
+            return dict(profile) if profile else None
+        except self.backend.errors as e:
+            print(f"Error getting user profile: {e}")
+            return None
+
+    def _load_user_profile(self, user_id: int):
+        with self.backend.connection() as conn:
             cur = conn.cursor()
             cur.execute("SELECT user_id, display_name, profile_picture_url, preferences, created_at, updated_at FROM user_profiles WHERE user_id = %s", (user_id,))
             profile = cur.fetchone()
@@ -45,143 +83,592 @@ class DataManager:
                     "updated_at": profile[5]
                 }
             return None
-        except psycopg2.Error as e:
-            print(f"Error getting user profile: {e}")
-            return None
-        finally:
-            if conn: conn.close()
 
     def update_user_profile(self, user_id: int, display_name: str = None, profile_picture_url: str = None, preferences: dict = None):
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            updates = []
-            params = []
-            if display_name is not None:
-                updates.append("display_name = %s")
-                params.append(display_name)
-            if profile_picture_url is not None:
-                updates.append("profile_picture_url = %s")
-                params.append(profile_picture_url)
-            if preferences is not None:
-                updates.append("preferences = %s")
-                params.append(json.dumps(preferences))
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                updates = []
+                params = []
+                if display_name is not None:
+                    updates.append("display_name = %s")
+                    params.append(display_name)
+                if profile_picture_url is not None:
+                    updates.append("profile_picture_url = %s")
+                    params.append(profile_picture_url)
+                if preferences is not None:
+                    updates.append("preferences = %s")
+                    params.append(json.dumps(preferences))
             
-            if not updates:
-                return False # No updates to perform
+                if not updates:
+                    return False # No updates to perform
 
-            params.append(user_id)
-            cur.execute(
-                f"UPDATE user_profiles SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s",
-                params
-            )
-            conn.commit()
-            cur.close()
-            return cur.rowcount > 0
-        except psycopg2.Error as e:
+                params.append(user_id)
+                cur.execute(
+                    f"UPDATE user_profiles SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s",
+                    params
+                )
+                conn.commit()
+                cur.close()
+                profile_cache.invalidate(user_id)
+                return cur.rowcount > 0
+        except self.backend.errors as e:
             print(f"Error updating user profile: {e}")
-            if conn: conn.rollback()
             return False
-        finally:
-            if conn: conn.close()
 
     def delete_user_profile(self, user_id: int):
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("DELETE FROM user_profiles WHERE user_id = %s", (user_id,))
-            conn.commit()
-            cur.close()
-            return cur.rowcount > 0
-        except psycopg2.Error as e:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("DELETE FROM user_profiles WHERE user_id = %s", (user_id,))
+                conn.commit()
+                cur.close()
+                profile_cache.invalidate(user_id)
+                return cur.rowcount > 0
+        except self.backend.errors as e:
             print(f"Error deleting user profile: {e}")
-            if conn: conn.rollback()
             return False
-        finally:
-            if conn: conn.close()
 
     # --- Encrypted Data Store Management ---
 
-    def store_encrypted_data(self, user_id: int, data_type: str, encrypted_content: bytes, encryption_metadata: dict):
-        conn = None
+    def store_encrypted_data(self, user_id: int, data_type: str, encrypted_content: bytes, encryption_metadata: dict,
+                             searchable_fields: dict = None):
+        """
+        Stores an encrypted payload and returns its data_id, or None on failure.
+        `searchable_fields` maps field names to plaintext values that should be findable
+        with find_encrypted_data; only their blind index tokens are stored.
+
+        Payloads larger than `blob_threshold` are written to the blob store (when one is
+        configured) and the row keeps an empty encrypted_content with metadata marked
+        `"storage": "blob"` plus the blob's digest and size.
+        """
+        blind_indexes = self._blind_indexes(user_id, searchable_fields) if searchable_fields else None
+        encrypted_content, encryption_metadata = self._spill(encrypted_content, encryption_metadata)
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO encrypted_data_store (user_id, data_type, encrypted_content, encryption_metadata) VALUES (%s, %s, %s, %s) RETURNING data_id",
-                (user_id, data_type, encrypted_content, json.dumps(encryption_metadata))
-            )
-            data_id = cur.fetchone()[0]
-            conn.commit()
-            cur.close()
-            return str(data_id)
-        except psycopg2.Error as e:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "INSERT INTO encrypted_data_store (user_id, data_type, encrypted_content, encryption_metadata, blind_indexes) VALUES (%s, %s, %s, %s, %s) RETURNING data_id",
+                    (user_id, data_type, encrypted_content, json.dumps(encryption_metadata), blind_indexes)
+                )
+                data_id = cur.fetchone()[0]
+                conn.commit()
+                cur.close()
+                return str(data_id)
+        except self.backend.errors as e:
             print(f"Error storing encrypted data: {e}")
-            if conn: conn.rollback()
             return None
-        finally:
-            if conn: conn.close()
+
+    def _spill(self, encrypted_content: bytes, encryption_metadata: dict):
+        if self.blob_store is None:
+            return encrypted_content, encryption_metadata
+        return self.blob_store.spill(encrypted_content, encryption_metadata, self.blob_threshold)
+
+    def _encode_row(self, encrypted_content: bytes, encryption_metadata: dict):
+        encrypted_content, encryption_metadata = self._spill(encrypted_content, encryption_metadata)
+        return encrypted_content, json.dumps(encryption_metadata)
+
+    def _require_kms(self):
+        if self.kms is None:
+            raise ValueError("Searchable fields require a DataManager with a KMS for the blind index key.")
+        return self.kms
+
+    def _blind_indexes(self, user_id: int, fields: dict) -> list:
+        kms = self._require_kms()
+        return [kms.compute_blind_index(self.blind_index_key_id, field, value, scope=str(user_id))
+                for field, value in fields.items()]
+
+    def find_encrypted_data(self, user_id: int, field: str, value, data_type: str = None):
+        """
+        Returns the user's records (as retrieve_encrypted_data does) whose searchable
+        `field` equals `value`, oldest first. The value is matched by its blind index
+        tokens, so nothing is decrypted and the database never sees the plaintext.
+        """
+        tokens = self._require_kms().blind_index_candidates(self.blind_index_key_id, field, value, scope=str(user_id))
+        if not tokens:
+            return []
+        condition, condition_params = self.backend.blind_index_condition(tokens)
+        query = ("SELECT data_id, user_id, data_type, encrypted_content, encryption_metadata, created_at, updated_at "
+                 "FROM encrypted_data_store WHERE user_id = %s")
+        params = [user_id]
+        if data_type:
+            query += " AND data_type = %s"
+            params.append(data_type)
+        query += f" AND {condition} ORDER BY created_at, data_id"
+        try:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(query, params + condition_params)
+                rows = cur.fetchall()
+                cur.close()
+                return [{
+                    "data_id": str(row[0]),
+                    "user_id": row[1],
+                    "data_type": row[2],
+                    "encrypted_content": row[3],
+                    "encryption_metadata": row[4],
+                    "created_at": row[5],
+                    "updated_at": row[6]
+                } for row in rows]
+        except self.backend.errors as e:
+            print(f"Error finding encrypted data: {e}")
+            return []
+
+    def query_by_metadata(self, filters: dict, cursor: str = None, limit: int = 100, user_id: int = None,
+                          data_type: str = None, include_content: bool = False):
+        """
+        Returns one page of records whose encryption_metadata contains `filters` (e.g.
+        {"recipient_username": "bob"} or {"kms_key_id": "k1"}), across all users unless
+        `user_id` is given. On PostgreSQL the match is a GIN index lookup (@>). Pages are
+        ordered by (created_at, data_id) and paginated as in list_encrypted_data_page.
+
+        Returns:
+            dict: {"items": [...], "next_cursor": str or None}. Items have data_id, user_id,
+                  data_type, encryption_metadata and created_at, plus encrypted_content if
+                  `include_content` is set.
+        Raises:
+            ValueError: If `filters` is empty or `cursor` is invalid.
+        """
+        if not filters:
+            raise ValueError("query_by_metadata requires at least one metadata filter.")
+        condition, params = self.backend.metadata_condition(filters)
+        columns = "data_id, user_id, data_type, encryption_metadata, created_at"
+        if include_content:
+            columns += ", encrypted_content"
+        query = f"SELECT {columns} FROM encrypted_data_store WHERE {condition}"
+        if user_id is not None:
+            query += " AND user_id = %s"
+            params.append(user_id)
+        if data_type:
+            query += " AND data_type = %s"
+            params.append(data_type)
+        if cursor:
+            created_at, data_id = self._decode_page_cursor(cursor)
+            query += " AND (created_at, data_id) > (%s, %s)"
+            params += [created_at, data_id]
+        try:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(query + " ORDER BY created_at, data_id LIMIT %s", params + [limit + 1])
+                rows = cur.fetchall()
+                cur.close()
+        except self.backend.errors as e:
+            print(f"Error querying encrypted data by metadata: {e}")
+            return {"items": [], "next_cursor": None}
+        items = []
+        for row in rows[:limit]:
+            item = {"data_id": str(row[0]), "user_id": row[1], "data_type": row[2],
+                    "encryption_metadata": row[3], "created_at": row[4]}
+            if include_content:
+                item["encrypted_content"] = row[5]
+            items.append(item)
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = self._encode_page_cursor(items[-1]["created_at"], items[-1]["data_id"])
+        return {"items": items, "next_cursor": next_cursor}
+
+    def encrypt_and_store_data(self, user_id: int, data_type: str, plaintext: bytes, session_key: bytes,
+                               encryption_metadata: dict = None, compression: str = "none", level: int = None,
+                               searchable_fields: dict = None):
+        """
+        Optionally compresses (see src.compression), encrypts with AES-256-GCM and stores a
+        payload. Compression is opt-in: the ciphertext length of compressed data depends on
+        its content, which leaks information when attacker-influenced data is mixed with
+        secrets, so only pass compression="auto"/"zlib"/"lzma" for data where that is safe.
+        encrypted_content holds nonce + tag + ciphertext; the codec actually applied and
+        the original size are recorded in encryption_metadata ("compression",
+        "original_size"). Returns the data_id, or None on failure.
+        """
+        ciphertext, nonce, tag, codec = compress_and_encrypt_hybrid(plaintext, session_key, compression, level)
+        metadata = dict(encryption_metadata or {}, compression=codec, original_size=len(plaintext))
+        return self.store_encrypted_data(user_id, data_type, nonce + tag + ciphertext, metadata, searchable_fields)
+
+    def retrieve_and_decrypt_data(self, data_id: str, session_key: bytes):
+        """
+        Retrieves a payload stored by encrypt_and_store_data and returns its plaintext, or
+        None if it does not exist. Raises ValueError if the payload fails authentication or
+        decompresses beyond its recorded size.
+        """
+        record = self.retrieve_encrypted_data(data_id)
+        if record is None:
+            return None
+        content = bytes(record["encrypted_content"])
+        metadata = record["encryption_metadata"]
+        try:
+            return decrypt_and_decompress_hybrid(content[28:], content[:12], content[12:28], session_key,
+                                                 metadata.get("compression", "none"), metadata.get("original_size"))
+        except InvalidTag:
+            raise ValueError(f"Encrypted data {data_id} failed authentication.")
+
+    def store_encrypted_data_many(self, rows, page_size: int = 1000):
+        """
+        Inserts many (user_id, data_type, encrypted_content, encryption_metadata) rows in a
+        single transaction using multi-row INSERTs of `page_size` rows each. Large payloads
+        are spilled to the blob store as in store_encrypted_data.
+        Returns the new data_ids in input order, or None if the batch failed.
+        """
+        try:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                inserted = self.backend.execute_values(
+                    cur,
+                    "INSERT INTO encrypted_data_store (user_id, data_type, encrypted_content, encryption_metadata) VALUES %s RETURNING data_id",
+                    [(user_id, data_type, *self._encode_row(encrypted_content, encryption_metadata))
+                     for user_id, data_type, encrypted_content, encryption_metadata in rows],
+                    page_size=page_size,
+                    fetch=True,
+                )
+                conn.commit()
+                cur.close()
+                return [str(row[0]) for row in inserted]
+        except self.backend.errors as e:
+            print(f"Error storing encrypted data batch: {e}")
+            return None
+
+    def copy_encrypted_data(self, rows, chunk_size: int = 10000):
+        """
+        Bulk-loads (user_id, data_type, encrypted_content, encryption_metadata) rows with
+        binary COPY, for ingests too large for store_encrypted_data_many. `rows` may be any
+        iterable (e.g. a generator); it is consumed `chunk_size` rows at a time so memory
+        stays bounded. All chunks are loaded in one transaction.
+        COPY cannot return generated keys, so data_ids are generated client-side. Backends
+        without COPY (SQLite) insert the chunks with executemany instead. Large payloads
+        are spilled to the blob store as in store_encrypted_data.
+        Returns the new data_ids in input order, or None if the load failed.
+        """
+        rows = iter(rows)
+        data_ids = []
+        try:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                while True:
+                    chunk = [(user_id, data_type, *self._spill(encrypted_content, encryption_metadata))
+                             for user_id, data_type, encrypted_content, encryption_metadata in islice(rows, chunk_size)]
+                    if not chunk:
+                        break
+                    chunk_ids = [uuid.uuid4() for _ in chunk]
+                    if self.backend.supports_copy:
+                        cur.copy_expert(
+                            "COPY encrypted_data_store (data_id, user_id, data_type, encrypted_content, encryption_metadata) FROM STDIN WITH (FORMAT binary)",
+                            self._encode_copy_binary(chunk_ids, chunk),
+                        )
+                    else:
+                        cur.executemany(
+                            "INSERT INTO encrypted_data_store (data_id, user_id, data_type, encrypted_content, encryption_metadata) VALUES (%s, %s, %s, %s, %s)",
+                            [(str(data_id), user_id, data_type, encrypted_content, json.dumps(encryption_metadata))
+                             for data_id, (user_id, data_type, encrypted_content, encryption_metadata) in zip(chunk_ids, chunk)],
+                        )
+                    data_ids.extend(str(data_id) for data_id in chunk_ids)
+                conn.commit()
+                cur.close()
+                return data_ids
+        except self.backend.errors as e:
+            print(f"Error copying encrypted data: {e}")
+            return None
+
+    # --- Chunked storage for large objects ---
+
+    def store_encrypted_chunks(self, user_id: int, data_type: str, chunks, encryption_metadata: dict,
+                               page_size: int = 16):
+        """
+        Stores a large object as a sequence of encrypted chunks in encrypted_data_chunks.
+        `chunks` may be any iterable (e.g. a generator over a request body); it is consumed
+        `page_size` chunks at a time, so memory stays bounded by page_size * chunk size.
+        The encrypted_data_store row gets an empty encrypted_content and metadata marked
+        `"storage": "chunked"` with the chunk count. Returns the data_id, or None on failure.
+        """
+        chunks = iter(chunks)
+        try:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "INSERT INTO encrypted_data_store (user_id, data_type, encrypted_content, encryption_metadata) VALUES (%s, %s, %s, %s) RETURNING data_id",
+                    (user_id, data_type, b"", json.dumps(dict(encryption_metadata, storage="chunked")))
+                )
+                data_id = cur.fetchone()[0]
+                seq = 0
+                while True:
+                    page = list(islice(chunks, page_size))
+                    if not page:
+                        break
+                    self.backend.execute_values(
+                        cur,
+                        "INSERT INTO encrypted_data_chunks (data_id, seq, chunk) VALUES %s",
+                        [(data_id, seq + i, chunk) for i, chunk in enumerate(page)],
+                        page_size=page_size,
+                    )
+                    seq += len(page)
+                metadata = dict(encryption_metadata, storage="chunked", chunk_count=seq)
+                cur.execute("UPDATE encrypted_data_store SET encryption_metadata = %s WHERE data_id = %s",
+                            (json.dumps(metadata), data_id))
+                conn.commit()
+                cur.close()
+                return str(data_id)
+        except self.backend.errors as e:
+            print(f"Error storing encrypted chunks: {e}")
+            return None
+
+    def iter_encrypted_chunks(self, data_id: str, fetch_size: int = 8):
+        """
+        Generator yielding the stored chunks of an object in order. Chunks are streamed
+        from a server-side cursor `fetch_size` at a time, so the object is never held in
+        memory as a whole. The pooled connection is held until the generator is exhausted
+        or closed.
+        """
+        with self.backend.connection() as conn:
+            cur = conn.cursor(name=f"chunks_{uuid.uuid4().hex}")
+            cur.itersize = fetch_size
+            cur.execute("SELECT chunk FROM encrypted_data_chunks WHERE data_id = %s ORDER BY seq", (data_id,))
+            try:
+                for (chunk,) in cur:
+                    yield bytes(chunk)
+            finally:
+                cur.close()
+
+    @staticmethod
+    def _encode_copy_binary(data_ids, rows):
+        """
+        Encodes rows of encrypted_data_store in PostgreSQL's binary COPY format.
+        """
+        buf = io.BytesIO()
+        buf.write(_COPY_BINARY_HEADER)
+        for data_id, (user_id, data_type, encrypted_content, encryption_metadata) in zip(data_ids, rows):
+            fields = (
+                data_id.bytes,
+                struct.pack("!i", user_id),
+                data_type.encode("utf-8"),
+                bytes(encrypted_content),
+                _JSONB_BINARY_VERSION + json.dumps(encryption_metadata).encode("utf-8"),
+            )
+            buf.write(struct.pack("!h", len(fields)))
+            for field in fields:
+                buf.write(struct.pack("!i", len(field)))
+                buf.write(field)
+        buf.write(_COPY_BINARY_TRAILER)
+        buf.seek(0)
+        return buf
 
     def retrieve_encrypted_data(self, data_id: str):
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT data_id, user_id, data_type, encrypted_content, encryption_metadata, created_at, updated_at FROM encrypted_data_store WHERE data_id = %s", (data_id,))
-            data = cur.fetchone()
-            cur.close()
-            if data:
-                return {
-                    "data_id": str(data[0]),
-                    "user_id": data[1],
-                    "data_type": data[2],
-                    "encrypted_content": data[3],
-                    "encryption_metadata": data[4],
-                    "created_at": data[5],
-                    "updated_at": data[6]
-                }
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT data_id, user_id, data_type, encrypted_content, encryption_metadata, created_at, updated_at FROM encrypted_data_store WHERE data_id = %s", (data_id,))
+                data = cur.fetchone()
+                cur.close()
+                if data:
+                    encrypted_content = data[3]
+                    if data[4].get("storage") == "blob":
+                        encrypted_content = self._require_blob_store().read(data[4]["blob_digest"])
+                    return {
+                        "data_id": str(data[0]),
+                        "user_id": data[1],
+                        "data_type": data[2],
+                        "encrypted_content": encrypted_content,
+                        "encryption_metadata": data[4],
+                        "created_at": data[5],
+                        "updated_at": data[6]
+                    }
+                return None
+        except (self.backend.errors, OSError) as e:
+            print(f"Error retrieving encrypted data: {e}")
             return None
-        except psycopg2.Error as e:
+
+    def _require_blob_store(self) -> BlobStore:
+        if self.blob_store is None:
+            raise FileNotFoundError("Encrypted content is in the blob store, but no blob store is configured.")
+        return self.blob_store
+
+    def _encrypted_content_row(self, data_id: str):
+        try:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT encrypted_content, encryption_metadata FROM encrypted_data_store WHERE data_id = %s",
+                            (data_id,))
+                row = cur.fetchone()
+                cur.close()
+                return row
+        except self.backend.errors as e:
             print(f"Error retrieving encrypted data: {e}")
             return None
-        finally:
-            if conn: conn.close()
+
+    def locate_encrypted_content(self, data_id: str):
+        """
+        Returns (encrypted_content, blob_path) for a record without reading spilled blobs:
+        (None, path) if the content is in the blob store, (content, None) if it is inline,
+        or None if the record does not exist. A blob path can be served with sendfile.
+        """
+        row = self._encrypted_content_row(data_id)
+        if row is None:
+            return None
+        if row[1].get("storage") == "blob":
+            return None, self._require_blob_store().path(row[1]["blob_digest"])
+        return bytes(row[0]), None
+
+    def iter_encrypted_content(self, data_id: str, chunk_size: int = 1024 * 1024):
+        """
+        Generator yielding the encrypted_content of a record in `chunk_size` pieces.
+        Spilled blobs are streamed from a memory map; to hand them to a socket without
+        copying, send the file at the path from locate_encrypted_content.
+        Yields nothing if the record does not exist.
+        """
+        row = self._encrypted_content_row(data_id)
+        if row is None:
+            return
+        if row[1].get("storage") == "blob":
+            yield from self._require_blob_store().iter_chunks(row[1]["blob_digest"], chunk_size)
+            return
+        content = memoryview(bytes(row[0]))
+        for offset in range(0, len(content), chunk_size):
+            yield bytes(content[offset:offset + chunk_size])
 
     def delete_encrypted_data(self, data_id: str):
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("DELETE FROM encrypted_data_store WHERE data_id = %s", (data_id,))
-            conn.commit()
-            cur.close()
-            return cur.rowcount > 0
-        except psycopg2.Error as e:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("DELETE FROM encrypted_data_chunks WHERE data_id = %s", (data_id,))
+                cur.execute("DELETE FROM encrypted_data_store WHERE data_id = %s RETURNING encryption_metadata", (data_id,))
+                deleted = cur.fetchall()
+                conn.commit()
+                cur.close()
+                # A spilled blob is not removed here: identical ciphertexts share it, and a
+                # concurrent insert may be about to reference it. collect_blob_garbage
+                # removes it once no row references it.
+                return len(deleted) > 0
+        except self.backend.errors as e:
             print(f"Error deleting encrypted data: {e}")
-            if conn: conn.rollback()
             return False
-        finally:
-            if conn: conn.close()
 
-    def list_encrypted_data_by_user(self, user_id: int, data_type: str = None):
-        conn = None
-        try:
-            conn = get_db_connection()
+    def _referenced_blobs(self) -> set:
+        """
+        Returns the digests of all blobs that rows point at, in one query.
+        """
+        condition, condition_params = self.backend.metadata_condition({"storage": "blob"})
+        digest, digest_params = self.backend.metadata_field("blob_digest")
+        with self.backend.connection() as conn:
             cur = conn.cursor()
-            if data_type:
-                cur.execute("SELECT data_id, data_type, created_at FROM encrypted_data_store WHERE user_id = %s AND data_type = %s", (user_id, data_type))
-            else:
-                cur.execute("SELECT data_id, data_type, created_at FROM encrypted_data_store WHERE user_id = %s", (user_id,))
-            
-            data_list = []
-            for row in cur.fetchall():
-                data_list.append({"data_id": str(row[0]), "data_type": row[1], "created_at": row[2]})
+            cur.execute(f"SELECT DISTINCT {digest} FROM encrypted_data_store WHERE {condition}",
+                        digest_params + condition_params)
+            referenced = {row[0] for row in cur.fetchall()}
             cur.close()
-            return data_list
-        except psycopg2.Error as e:
+            return referenced
+
+    def collect_blob_garbage(self, min_age: float = 3600.0) -> list:
+        """
+        Removes blobs that no row references any more, after deletes or after expired
+        partitions were dropped. Blobs modified within the last `min_age` seconds are
+        skipped, since their rows may not be committed yet (storing an existing blob
+        refreshes its mtime). Returns the removed digests.
+        """
+        if self.blob_store is None:
+            return []
+        try:
+            # Read the references before listing the blobs: a blob listed as older than
+            # min_age whose row commits after this query would mean an insert transaction
+            # running for longer than min_age.
+            referenced = self._referenced_blobs()
+        except self.backend.errors as e:
+            print(f"Error collecting blob garbage: {e}")
+            return []
+        removed = []
+        for digest in list(self.blob_store.iter_digests(min_age)):
+            if digest not in referenced and self.blob_store.delete(digest):
+                removed.append(digest)
+        return removed
+
+    def expire_encrypted_data(self, retention_days: int = None, detach_only: bool = False):
+        """
+        Removes encrypted data older than `retention_days` (Config.DATA_RETENTION_DAYS by
+        default; 0 keeps everything). On PostgreSQL whole monthly partitions are dropped
+        (or only detached), so data is removed at partition granularity. Returns
+        {"partitions": [...], "deleted_rows": n}, or None on failure.
+        """
+        retention_days = Config.DATA_RETENTION_DAYS if retention_days is None else retention_days
+        if retention_days <= 0:
+            return {"partitions": [], "deleted_rows": 0}
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
+        try:
+            return self.backend.expire_encrypted_data(cutoff, detach_only)
+        except self.backend.errors as e:
+            print(f"Error expiring encrypted data: {e}")
+            return None
+
+    def list_encrypted_data_by_user(self, user_id: int, data_type: str = None):
+        """
+        Returns all of a user's items (oldest first). For large collections use
+        list_encrypted_data_page, or iter_encrypted_data_by_user to stream them.
+        """
+        try:
+            return list(self.iter_encrypted_data_by_user(user_id, data_type))
+        except self.backend.errors as e:
             print(f"Error listing encrypted data: {e}")
             return []
-        finally:
-            if conn: conn.close()
+
+    def iter_encrypted_data_by_user(self, user_id: int, data_type: str = None, fetch_size: int = 1000):
+        """
+        Generator over all of a user's items (oldest first), read from a server-side cursor
+        `fetch_size` rows at a time instead of materializing the full result.
+        """
+        query, params = self._user_items_query(user_id, data_type)
+        with self.backend.connection() as conn:
+            cur = conn.cursor(name=f"user_items_{uuid.uuid4().hex}")
+            cur.itersize = fetch_size
+            cur.execute(query + " ORDER BY created_at, data_id", params)
+            try:
+                for row in cur:
+                    yield {"data_id": str(row[0]), "data_type": row[1], "created_at": row[2]}
+            finally:
+                cur.close()
+
+    def list_encrypted_data_page(self, user_id: int, data_type: str = None, limit: int = 100, cursor: str = None):
+        """
+        Returns one page of a user's items using keyset pagination on (created_at, data_id),
+        so the cost of a page does not depend on how deep into the collection it is.
+
+        Returns:
+            dict: {"items": [...], "next_cursor": str or None}. Pass next_cursor back to get
+                  the following page; it is None on the last page.
+        Raises:
+            ValueError: If `cursor` is not a cursor returned by this method.
+        """
+        query, params = self._user_items_query(user_id, data_type)
+        if cursor:
+            created_at, data_id = self._decode_page_cursor(cursor)
+            query += " AND (created_at, data_id) > (%s, %s)"
+            params += [created_at, data_id]
+        try:
+            with self.backend.connection() as conn:
+                cur = conn.cursor()
+                # Fetch one extra row to learn whether another page follows.
+                cur.execute(query + " ORDER BY created_at, data_id LIMIT %s", params + [limit + 1])
+                rows = cur.fetchall()
+                cur.close()
+        except self.backend.errors as e:
+            print(f"Error listing encrypted data: {e}")
+            return {"items": [], "next_cursor": None}
+        items = [{"data_id": str(row[0]), "data_type": row[1], "created_at": row[2]} for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = self._encode_page_cursor(items[-1]["created_at"], items[-1]["data_id"])
+        return {"items": items, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _user_items_query(user_id: int, data_type: str = None):
+        query = "SELECT data_id, data_type, created_at FROM encrypted_data_store WHERE user_id = %s"
+        params = [user_id]
+        if data_type:
+            query += " AND data_type = %s"
+            params.append(data_type)
+        return query, params
+
+    @staticmethod
+    def _encode_page_cursor(created_at, data_id: str) -> str:
+        raw = json.dumps([created_at.isoformat(), data_id]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_page_cursor(cursor: str):
+        try:
+            created_at, data_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return datetime.datetime.fromisoformat(created_at), str(uuid.UUID(data_id))
+        except (ValueError, TypeError, UnicodeError):
+            raise ValueError("Invalid pagination cursor.")
@@ -1,13 +1,250 @@
 
 import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
 from src.config import Config
+from collections import deque
+from contextlib import contextmanager
+import datetime
 import os
+import re
+import threading
+import time
 
 def get_db_connection():
+    """
+    Opens a new, unpooled connection. Use db_connection() for regular queries; this is
+    meant for long-lived dedicated connections (e.g. server-side cursors in batch jobs).
+    """
     conn = psycopg2.connect(Config.DATABASE_URL)
     return conn
 
+class PoolTimeoutError(psycopg2.OperationalError):
+    """
+    Raised when no pooled connection becomes available within the checkout timeout.
+    """
+
+class ConnectionPool:
+    """
+    A thread-safe PostgreSQL connection pool.
+
+    Checkouts wait (up to `checkout_timeout` seconds) when all `maxconn` connections are
+    in use. Connections are health-checked on checkout (closed or broken connections are
+    replaced; connections idle for more than `health_check_after` seconds are pinged) and
+    recycled once they are older than `max_lifetime` seconds. Wait-time and utilization
+    metrics are available from get_stats().
+    """
+    def __init__(self, dsn, minconn=1, maxconn=20, max_lifetime=1800.0, checkout_timeout=30.0,
+                 health_check_after=30.0):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self._idle = deque() # (conn, created_at, returned_at)
+        self._created_at = {} # id(conn) -> creation time, for checked-out connections
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._stats = {"checkouts": 0, "timeouts": 0, "connections_created": 0, "connections_closed": 0,
+                       "health_check_failures": 0, "total_wait_time": 0.0, "max_wait_time": 0.0}
+        for _ in range(minconn):
+            conn, created_at = self._connect()
+            self._idle.append((conn, created_at, time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        with self._condition:
+            self._size += 1
+            self._stats["connections_created"] += 1
+        return conn, time.monotonic()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._size -= 1
+            self._stats["connections_closed"] += 1
+            self._condition.notify()
+
+    def _is_healthy(self, conn, created_at, returned_at):
+        now = time.monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if now - returned_at > self.health_check_after:
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                conn.rollback()
+            except psycopg2.Error:
+                with self._condition:
+                    self._stats["health_check_failures"] += 1
+                return False
+        return True
+
+    def getconn(self):
+        """
+        Checks out a healthy connection, waiting for one to be returned if the pool is full.
+        """
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        while True:
+            with self._condition:
+                while not self._idle and self._size >= self.maxconn and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(f"No database connection available within {self.checkout_timeout}s.")
+                    self._condition.wait(remaining)
+                if self._closed:
+                    raise psycopg2.InterfaceError("Connection pool is closed.")
+                entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    self._size += 1 # reserve a slot before connecting outside the lock
+            if entry is None:
+                try:
+                    conn = psycopg2.connect(self.dsn)
+                except psycopg2.Error:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                created_at = time.monotonic()
+                with self._condition:
+                    self._stats["connections_created"] += 1
+            else:
+                conn, created_at, returned_at = entry
+                if not self._is_healthy(conn, created_at, returned_at):
+                    self._discard(conn)
+                    continue
+            waited = time.monotonic() - started
+            with self._condition:
+                self._created_at[id(conn)] = created_at
+                self._stats["checkouts"] += 1
+                self._stats["total_wait_time"] += waited
+                self._stats["max_wait_time"] = max(self._stats["max_wait_time"], waited)
+            return conn
+
+    def putconn(self, conn):
+        """
+        Returns a connection to the pool. Open transactions are rolled back first.
+        """
+        with self._condition:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+        if not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        if self._closed or conn.closed or time.monotonic() - created_at > self.max_lifetime:
+            self._discard(conn)
+            return
+        with self._condition:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks out a connection and always returns it to the pool.
+        If the block raises, the open transaction is rolled back.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            self.putconn(conn)
+
+    def get_stats(self):
+        """
+        Returns pool metrics: size, connections in use and idle, utilization (in use / maxconn),
+        checkout count, average and maximum checkout wait time (seconds) and timeouts.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            in_use = self._size - len(self._idle)
+            stats.update({
+                "size": self._size,
+                "in_use": in_use,
+                "idle": len(self._idle),
+                "max_size": self.maxconn,
+                "utilization": in_use / self.maxconn if self.maxconn else 0.0,
+                "avg_wait_time": stats["total_wait_time"] / stats["checkouts"] if stats["checkouts"] else 0.0,
+            })
+            return stats
+
+    def closeall(self):
+        """
+        Closes idle connections; checked-out connections are closed when they are returned.
+        """
+        with self._condition:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._condition.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the process-wide connection pool, creating it on first use (or when
+    Config.DATABASE_URL has changed since it was created).
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.dsn == Config.DATABASE_URL:
+        return pool
+    with _pool_lock:
+        if _pool is not None and _pool.dsn != Config.DATABASE_URL:
+            _pool.closeall()
+            _pool = None
+        if _pool is None:
+            _pool = ConnectionPool(Config.DATABASE_URL, minconn=Config.DB_POOL_MIN_CONN,
+                                   maxconn=Config.DB_POOL_MAX_CONN, max_lifetime=Config.DB_POOL_MAX_LIFETIME,
+                                   checkout_timeout=Config.DB_POOL_CHECKOUT_TIMEOUT)
+        return _pool
+
+def db_connection():
+    """
+    Context manager yielding a pooled connection:
+
+        with db_connection() as conn:
+            cur = conn.cursor()
+            ...
+            conn.commit()
+    """
+    return get_pool().connection()
+
+def get_pool_stats():
+    """
+    Returns the metrics of the process-wide connection pool (see ConnectionPool.get_stats).
+    """
+    return get_pool().get_stats()
+
+def close_pool():
+    """
+    Closes the process-wide connection pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
 def init_db():
     db_url = Config.DATABASE_URL
     db_name = db_url.split('/')[-1]
@@ -39,48 +276,266 @@ def init_db():
             conn_postgres.close()
 
     # Now connect to the newly created database to create tables
-    conn = None
     try:
-        conn = get_db_connection() # This uses Config.DATABASE_URL to connect to 'quantum_encryption'
-        cur = conn.cursor()
+        with db_connection() as conn: # This uses Config.DATABASE_URL to connect to 'quantum_encryption'
+            cur = conn.cursor()
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id SERIAL PRIMARY KEY,
+                    username VARCHAR(50) UNIQUE NOT NULL,
+                    password_hash VARCHAR(255) NOT NULL,
+                    role VARCHAR(50) NOT NULL DEFAULT 'user'
+                );
+
+                -- Enable uuid-ossp for UUID generation
+                CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+
+                CREATE TABLE IF NOT EXISTS user_profiles (
+                    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                    display_name VARCHAR(100) NOT NULL,
+                    profile_picture_url VARCHAR(255),
+                    preferences JSONB,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+            ''')
+            # Range-partitioned by month of created_at (see "Partitioning" below).
+            _create_encrypted_data_store(cur)
+            # Chunks of large objects stored with DataManager.store_encrypted_chunks. Rows are
+            # removed together with their encrypted_data_store row by delete_encrypted_data,
+            # and expire with it through the matching monthly partitions.
+            _create_encrypted_data_chunks(cur)
+            # Covering indexes for keyset pagination of a user's items (ordered by
+            # created_at, data_id), optionally filtered by data_type. The listed columns are
+            # all in the index, so pages are served by index-only scans.
+            cur.execute('''
+                CREATE INDEX IF NOT EXISTS idx_encrypted_data_user_created
+                    ON encrypted_data_store (user_id, created_at, data_id) INCLUDE (data_type);
+            ''')
+            cur.execute('''
+                CREATE INDEX IF NOT EXISTS idx_encrypted_data_user_type_created
+                    ON encrypted_data_store (user_id, data_type, created_at, data_id);
+            ''')
+            # Blind index tokens (keyed HMACs of plaintext fields, see
+            # DataManager.find_encrypted_data), matched with the array overlap operator.
+            cur.execute('''
+                ALTER TABLE encrypted_data_store ADD COLUMN IF NOT EXISTS blind_indexes TEXT[];
+                CREATE INDEX IF NOT EXISTS idx_encrypted_data_blind_indexes
+                    ON encrypted_data_store USING GIN (blind_indexes);
+            ''')
+            # Containment (@>) queries on encryption_metadata, e.g. by recipient_username or
+            # kms_key_id (see DataManager.query_by_metadata). jsonb_path_ops indexes are
+            # smaller and faster than the default opclass but only support @>.
+            cur.execute('''
+                CREATE INDEX IF NOT EXISTS idx_encrypted_data_metadata
+                    ON encrypted_data_store USING GIN (encryption_metadata jsonb_path_ops);
+            ''')
+            created = _ensure_partitions(cur, Config.PARTITION_PREMAKE_MONTHS)
+            conn.commit()
+            if created:
+                print(f"Created partitions: {', '.join(created)}")
+            print("Tables created successfully.")
+            cur.close()
+    except Exception as e:
+        print(f"Error initializing database tables: {e}")
+
+# --- Partitioning of encrypted_data_store ---
+#
+# encrypted_data_store is range-partitioned by created_at into monthly partitions named
+# encrypted_data_store_pYYYYMM. Expired data is removed by dropping (or detaching) whole
+# partitions, which costs the same regardless of the number of rows and leaves no dead
+# tuples behind. The primary key of a partitioned table must contain the partition key,
+# so it is (data_id, created_at); data_ids are random UUIDs and unique in practice.
+#
+# encrypted_data_chunks is partitioned the same way (encrypted_data_chunks_pYYYYMM) on
+# a created_at column that defaults to CURRENT_TIMESTAMP, i.e. the start of the
+# transaction. Chunks are inserted in the transaction that inserts their
+# encrypted_data_store row, so they share its created_at and its month, and their
+# partition is dropped together with the row's.
+
+_PARTITIONED_TABLES = ("encrypted_data_store", "encrypted_data_chunks")
+
+_PARTITION_BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def _month_start(moment: datetime.datetime, months: int = 0) -> datetime.datetime:
+    """
+    Returns the start (UTC midnight on the 1st) of the month `months` after the one containing `moment`.
+    """
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _parse_partition_bound(value: str):
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    # pg_get_expr renders e.g. '2026-10-01 00:00:00+00'; fromisoformat needs a full offset.
+    value = re.sub(r"([+-]\d\d)$", r"\1:00", value.strip("'"))
+    return datetime.datetime.fromisoformat(value)
+
+
+def _list_partitions(cur, parent: str = "encrypted_data_store"):
+    """
+    Returns (name, lower, upper) for each partition of `parent`, with None for
+    MINVALUE/MAXVALUE bounds, ordered by name.
+    """
+    cur.execute("SET LOCAL TimeZone = 'UTC'")
+    cur.execute('''
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    ''', (parent,))
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = _PARTITION_BOUND_RE.search(bound or "")
+        if match:
+            partitions.append((name, _parse_partition_bound(match.group(1)), _parse_partition_bound(match.group(2))))
+    return partitions
+
+
+def _create_encrypted_data_store(cur):
+    """
+    Creates the partitioned encrypted_data_store. An existing unpartitioned table (from
+    before partitioning was introduced) is kept as the partition for everything created
+    before the current month, so no rows are copied.
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('encrypted_data_store')")
+    row = cur.fetchone()
+    legacy = row is not None and row[0] == 'r'
+    if row is not None and not legacy:
+        return
+    if legacy:
+        cur.execute("ALTER TABLE encrypted_data_store RENAME TO encrypted_data_store_legacy")
+        cur.execute("ALTER TABLE encrypted_data_store_legacy DROP CONSTRAINT encrypted_data_store_pkey")
+        cur.execute("UPDATE encrypted_data_store_legacy SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+        cur.execute("ALTER TABLE encrypted_data_store_legacy ALTER COLUMN created_at SET NOT NULL")
+        cur.execute("ALTER INDEX IF EXISTS idx_encrypted_data_user_created RENAME TO idx_encrypted_data_legacy_user_created")
+        cur.execute("ALTER INDEX IF EXISTS idx_encrypted_data_user_type_created RENAME TO idx_encrypted_data_legacy_user_type_created")
+        # ATTACH PARTITION requires exactly the parent's columns; tables created before
+        # blind indexes were introduced lack blind_indexes.
+        cur.execute("ALTER TABLE encrypted_data_store_legacy ADD COLUMN IF NOT EXISTS blind_indexes TEXT[]")
+    cur.execute('''
+        CREATE TABLE encrypted_data_store (
+            data_id UUID NOT NULL DEFAULT uuid_generate_v4(),
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            data_type VARCHAR(50) NOT NULL,
+            encrypted_content BYTEA NOT NULL,
+            encryption_metadata JSONB NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            blind_indexes TEXT[],
+            PRIMARY KEY (data_id, created_at)
+        ) PARTITION BY RANGE (created_at);
+    ''')
+    if legacy:
+        # Rows created during the current month may already be in the legacy table, so
+        # it covers everything up to the start of next month.
+        upper = _month_start(datetime.datetime.now(datetime.timezone.utc), 1)
+        cur.execute(
+            "ALTER TABLE encrypted_data_store ATTACH PARTITION encrypted_data_store_legacy "
+            "FOR VALUES FROM (MINVALUE) TO (%s)", (upper,)
+        )
+
+
+def _create_encrypted_data_chunks(cur):
+    """
+    Creates the partitioned encrypted_data_chunks. An existing unpartitioned table is
+    kept as the partition for everything created before next month, with created_at
+    backfilled from the chunks' encrypted_data_store rows.
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('encrypted_data_chunks')")
+    row = cur.fetchone()
+    legacy = row is not None and row[0] == 'r'
+    if row is not None and not legacy:
+        return
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if legacy:
+        cur.execute("ALTER TABLE encrypted_data_chunks RENAME TO encrypted_data_chunks_legacy")
+        cur.execute("ALTER TABLE encrypted_data_chunks_legacy DROP CONSTRAINT encrypted_data_chunks_pkey")
+        cur.execute("ALTER TABLE encrypted_data_chunks_legacy ADD COLUMN created_at TIMESTAMP WITH TIME ZONE")
         cur.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                role VARCHAR(50) NOT NULL DEFAULT 'user'
-            );
-
-            -- Enable uuid-ossp for UUID generation
-            CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
-
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-                display_name VARCHAR(100) NOT NULL,
-                profile_picture_url VARCHAR(255),
-                preferences JSONB,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS encrypted_data_store (
-                data_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                data_type VARCHAR(50) NOT NULL,
-                encrypted_content BYTEA NOT NULL,
-                encryption_metadata JSONB NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            );
+            UPDATE encrypted_data_chunks_legacy c SET created_at = s.created_at
+            FROM encrypted_data_store s WHERE s.data_id = c.data_id
         ''')
+        # Chunks without a row are orphans; they expire with the legacy partition.
+        cur.execute("UPDATE encrypted_data_chunks_legacy SET created_at = %s WHERE created_at IS NULL", (now,))
+        cur.execute("ALTER TABLE encrypted_data_chunks_legacy ALTER COLUMN created_at SET NOT NULL")
+    cur.execute('''
+        CREATE TABLE encrypted_data_chunks (
+            data_id UUID NOT NULL,
+            seq INTEGER NOT NULL,
+            chunk BYTEA NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (data_id, created_at, seq)
+        ) PARTITION BY RANGE (created_at);
+    ''')
+    if legacy:
+        cur.execute(
+            "ALTER TABLE encrypted_data_chunks ATTACH PARTITION encrypted_data_chunks_legacy "
+            "FOR VALUES FROM (MINVALUE) TO (%s)", (_month_start(now, 1),)
+        )
+
+
+def _ensure_partitions(cur, months_ahead: int, now: datetime.datetime = None):
+    """
+    Creates the monthly partitions of encrypted_data_store and encrypted_data_chunks from
+    the current month through `months_ahead` months ahead that do not overlap an
+    existing partition. Returns the names created.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    created = []
+    for parent in _PARTITIONED_TABLES:
+        existing = _list_partitions(cur, parent)
+        for offset in range(months_ahead + 1):
+            lower, upper = _month_start(now, offset), _month_start(now, offset + 1)
+            if any((start is None or start < upper) and (end is None or end > lower) for _, start, end in existing):
+                continue
+            name = f"{parent}_p{lower:%Y%m}"
+            cur.execute(f"CREATE TABLE {name} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)",
+                        (lower, upper))
+            existing.append((name, lower, upper))
+            created.append(name)
+    return created
+
+
+def ensure_encrypted_data_partitions(months_ahead: int = None, now: datetime.datetime = None):
+    """
+    Pre-creates monthly partitions of encrypted_data_store through `months_ahead`
+    months ahead (Config.PARTITION_PREMAKE_MONTHS by default). Returns the names of the
+    partitions created. Rows whose created_at has no partition cannot be inserted, so
+    this must run (e.g. via the partition manager task) before the last partition fills up.
+    """
+    months_ahead = Config.PARTITION_PREMAKE_MONTHS if months_ahead is None else months_ahead
+    with db_connection() as conn:
+        cur = conn.cursor()
+        created = _ensure_partitions(cur, months_ahead, now)
         conn.commit()
-        print("Tables created successfully.")
         cur.close()
-    except Exception as e:
-        print(f"Error initializing database tables: {e}")
-    finally:
-        if conn:
-            conn.close()
+        return created
+
+
+def drop_encrypted_data_partitions_before(cutoff: datetime.datetime, detach_only: bool = False):
+    """
+    Removes the partitions of encrypted_data_store and encrypted_data_chunks whose rows
+    were all created before `cutoff`. Partitions are detached and then dropped; with
+    `detach_only` they are kept as standalone tables (e.g. for archiving). Returns the
+    removed partition names.
+    """
+    removed = []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        for parent in _PARTITIONED_TABLES:
+            for name, _, upper in _list_partitions(cur, parent):
+                if upper is None or upper > cutoff:
+                    continue
+                cur.execute(f"ALTER TABLE {parent} DETACH PARTITION {name}")
+                if not detach_only:
+                    cur.execute(f"DROP TABLE {name}")
+                removed.append(name)
+        conn.commit()
+        cur.close()
+    return removed
 
 if __name__ == '__main__':
     init_db()
@@ -11,6 +11,7 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
+from src.compression import compress, decompress
 import os
 
 class HybridCrypto:
@@ -63,13 +64,14 @@ class HybridCrypto:
 
         return qkd_shared_key, kyber_ciphertext, kyber_encapsulated_secret, kyber_public_key
 
-    def encrypt_data(self, data: bytes, session_key: bytes) -> tuple[bytes, bytes, bytes]:
+    def encrypt_data(self, data: bytes, session_key: bytes, associated_data: bytes = None) -> tuple[bytes, bytes, bytes]:
         """
         Encrypts data using AES-256-GCM.
 
         Args:
             data (bytes): The plaintext data to encrypt.
             session_key (bytes): The symmetric session key (32 bytes for AES-256).
+            associated_data (bytes): Optional data authenticated (but not encrypted) with the ciphertext.
 
         Returns:
             tuple: (ciphertext, nonce, tag)
@@ -80,11 +82,14 @@ class HybridCrypto:
         nonce = os.urandom(12)  # GCM recommended nonce size
         cipher = Cipher(algorithms.AES(session_key), modes.GCM(nonce), backend=default_backend())
         encryptor = cipher.encryptor()
+        if associated_data:
+            encryptor.authenticate_additional_data(associated_data)
         ciphertext = encryptor.update(data) + encryptor.finalize()
         tag = encryptor.tag
         return ciphertext, nonce, tag
 
-    def decrypt_data(self, ciphertext: bytes, nonce: bytes, tag: bytes, session_key: bytes) -> bytes:
+    def decrypt_data(self, ciphertext: bytes, nonce: bytes, tag: bytes, session_key: bytes,
+                     associated_data: bytes = None) -> bytes:
         """
         Decrypts data using AES-256-GCM.
 
@@ -93,6 +98,7 @@ class HybridCrypto:
             nonce (bytes): The nonce used during encryption.
             tag (bytes): The authentication tag.
             session_key (bytes): The symmetric session key (32 bytes for AES-256).
+            associated_data (bytes): The associated data given to encrypt_data, if any.
 
         Returns:
             bytes: The decrypted plaintext data.
@@ -102,9 +108,44 @@ class HybridCrypto:
 
         cipher = Cipher(algorithms.AES(session_key), modes.GCM(nonce, tag), backend=default_backend())
         decryptor = cipher.decryptor()
+        if associated_data:
+            decryptor.authenticate_additional_data(associated_data)
         plaintext = decryptor.update(ciphertext) + decryptor.finalize()
         return plaintext
 
+    def compress_and_encrypt(self, data: bytes, session_key: bytes, compression: str = "none",
+                             level: int = None) -> tuple[bytes, bytes, bytes, str]:
+        """
+        Compresses data (see src.compression) and encrypts the result using AES-256-GCM.
+        The codec name is bound to the ciphertext as associated data.
+
+        Args:
+            data (bytes): The plaintext data to encrypt.
+            session_key (bytes): The symmetric session key (32 bytes for AES-256).
+            compression (str): "none" (default), "zlib", "lzma" or "auto" (skips incompressible data).
+            level (int): Codec compression level (zlib 0-9, lzma preset 0-9).
+
+        Returns:
+            tuple: (ciphertext, nonce, tag, codec) where codec is the codec actually applied;
+                   it must be passed to decrypt_and_decompress.
+        """
+        payload, codec = compress(data, compression, level)
+        ciphertext, nonce, tag = self.encrypt_data(payload, session_key, self._compression_aad(codec))
+        return ciphertext, nonce, tag, codec
+
+    def decrypt_and_decompress(self, ciphertext: bytes, nonce: bytes, tag: bytes, session_key: bytes,
+                               codec: str, max_size: int = None) -> bytes:
+        """
+        Decrypts data produced by compress_and_encrypt and decompresses it.
+        `max_size` optionally bounds the decompressed size.
+        """
+        payload = self.decrypt_data(ciphertext, nonce, tag, session_key, self._compression_aad(codec))
+        return decompress(payload, codec, max_size)
+
+    @staticmethod
+    def _compression_aad(codec: str) -> bytes:
+        return b"compression:" + codec.encode("ascii")
+
     def sign_data(self, data: bytes, signing_key: bytes) -> bytes:
         """
         Signs data using Dilithium.
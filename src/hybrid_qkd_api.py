@@ -1,16 +1,23 @@
 """This module provides a hybrid Quantum Key Distribution (QKD) API for secure communication."""
 
 from src.hybrid_crypto import HybridCrypto
+import functools
 import os
 
-_hybrid_crypto_instance = HybridCrypto()
+@functools.lru_cache(maxsize=None)
+def _hybrid_crypto() -> HybridCrypto:
+    """
+    Returns the shared HybridCrypto instance, created on first use so importing this
+    module (e.g. for the compression helpers) does not set up the PQC and QKD primitives.
+    """
+    return HybridCrypto()
 
 def simulate_qkd_key_exchange():
     """
     Simulates a QKD key exchange and returns the QKD-derived shared key
     and a boolean indicating if eavesdropping was detected.
     """
-    qkd_shared_key_str, eavesdropping_detected = _hybrid_crypto_instance.qkd_simulator.run_bb84()
+    qkd_shared_key_str, eavesdropping_detected = _hybrid_crypto().qkd_simulator.run_bb84()
     return qkd_shared_key_str, eavesdropping_detected
 
 def perform_hybrid_key_exchange():
@@ -19,7 +26,7 @@ def perform_hybrid_key_exchange():
     Returns the QKD-derived key, Kyber ciphertext, Kyber encapsulated secret,
     and Kyber public key. Returns None for keys if eavesdropping is detected.
     """
-    return _hybrid_crypto_instance.hybrid_key_exchange()
+    return _hybrid_crypto().hybrid_key_exchange()
 
 def encrypt_data_hybrid(data: bytes, session_key: bytes) -> tuple[bytes, bytes, bytes]:
     """
@@ -30,7 +37,7 @@ def encrypt_data_hybrid(data: bytes, session_key: bytes) -> tuple[bytes, bytes,
     Returns:
         tuple: (ciphertext, nonce, tag)
     """
-    return _hybrid_crypto_instance.encrypt_data(data, session_key)
+    return _hybrid_crypto().encrypt_data(data, session_key)
 
 def decrypt_data_hybrid(ciphertext: bytes, nonce: bytes, tag: bytes, session_key: bytes) -> bytes:
     """
@@ -43,7 +50,37 @@ def decrypt_data_hybrid(ciphertext: bytes, nonce: bytes, tag: bytes, session_key
     Returns:
         bytes: The decrypted plaintext data.
     """
-    return _hybrid_crypto_instance.decrypt_data(ciphertext, nonce, tag, session_key)
+    return _hybrid_crypto().decrypt_data(ciphertext, nonce, tag, session_key)
+
+def compress_and_encrypt_hybrid(data: bytes, session_key: bytes, compression: str = "none",
+                                level: int = None) -> tuple[bytes, bytes, bytes, str]:
+    """
+    Compresses data and encrypts it using the hybrid encryption scheme (AES-256-GCM).
+    Args:
+        data (bytes): The plaintext data to encrypt.
+        session_key (bytes): The symmetric session key (32 bytes for AES-256).
+        compression (str): "none" (default), "zlib", "lzma" or "auto".
+        level (int): Codec compression level.
+    Returns:
+        tuple: (ciphertext, nonce, tag, codec)
+    """
+    return _hybrid_crypto().compress_and_encrypt(data, session_key, compression, level)
+
+def decrypt_and_decompress_hybrid(ciphertext: bytes, nonce: bytes, tag: bytes, session_key: bytes,
+                                  codec: str, max_size: int = None) -> bytes:
+    """
+    Decrypts and decompresses data produced by compress_and_encrypt_hybrid.
+    Args:
+        ciphertext (bytes): The encrypted data.
+        nonce (bytes): The nonce used during encryption.
+        tag (bytes): The authentication tag.
+        session_key (bytes): The symmetric session key (32 bytes for AES-256).
+        codec (str): The codec returned by compress_and_encrypt_hybrid.
+        max_size (int): Optional bound on the decompressed size.
+    Returns:
+        bytes: The decrypted plaintext data.
+    """
+    return _hybrid_crypto().decrypt_and_decompress(ciphertext, nonce, tag, session_key, codec, max_size)
 
 def sign_data_hybrid(data: bytes, signing_key: bytes) -> bytes:
     """
@@ -54,7 +91,7 @@ def sign_data_hybrid(data: bytes, signing_key: bytes) -> bytes:
     Returns:
         bytes: The digital signature.
     """
-    return _hybrid_crypto_instance.sign_data(data, signing_key)
+    return _hybrid_crypto().sign_data(data, signing_key)
 
 def verify_data_signature_hybrid(data: bytes, signature: bytes, verification_key: bytes) -> bool:
     """
@@ -66,10 +103,10 @@ def verify_data_signature_hybrid(data: bytes, signature: bytes, verification_key
     Returns:
         bool: True if the signature is valid, False otherwise.
     """
-    return _hybrid_crypto_instance.verify_data_signature(data, signature, verification_key)
+    return _hybrid_crypto().verify_data_signature(data, signature, verification_key)
 
 def derive_session_key(shared_secret: bytes, salt: bytes, info: bytes, key_length: int) -> bytes:
     """
     Derives a strong cryptographic key using HKDF.
     """
-    return _hybrid_crypto_instance._derive_key(shared_secret, salt, info, key_length)
\ No newline at end of file
+    return _hybrid_crypto()._derive_key(shared_secret, salt, info, key_length)
\ No newline at end of file
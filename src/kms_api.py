@@ -1,61 +1,214 @@
 """This module provides the Key Management System (KMS) API for generating, storing,distributing, rotating, and revoking cryptographic keys."""
 import os
-import json
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
 import base64
+import functools
+import hashlib
+import hmac
+import multiprocessing
+import struct
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from src.pqc import Kyber, Dilithium
 from src.hybrid_crypto import HybridCrypto
+from src.kms_storage import KeyStoreLog
+from src.kms_cache import KeyMaterialCache, CachedKeyMaterial, DataKeyCache, CachedDataKey
+from src.kms_index import KeyMetadataIndex, KeyRecord
+from src.kms_usage import KeyUsageCounters
+
+# Header prepended to ciphertexts produced by encrypt_data_with_kms_key. It records the
+# key version used so decryption can pick the right version after rotations. The header
+# is also bound to the ciphertext as AES-GCM associated data.
+KEY_VERSION_MAGIC = b"QKV1"
+_KEY_VERSION_HEADER = struct.Struct(">4sI")
+
+# Version N > 1 of logical key K is stored as "K:vN". Key IDs given to the generate_*
+# methods may not contain the separator, so a new key can never take a version's ID.
+KEY_VERSION_SEPARATOR = ":v"
+
+# Envelope layout: magic, wrapped DEK length, wrapped DEK, nonce, AES-GCM ciphertext + tag.
+# A wrapped DEK is nonce (12) + tag (16) + versioned ciphertext of the DEK under the KEK.
+ENVELOPE_MAGIC = b"QEV1"
+_ENVELOPE_HEADER = struct.Struct(">4sH")
+
+# Streamed objects are encrypted chunk by chunk under a per-object DEK. Each chunk is
+# nonce (12) + AES-GCM ciphertext + tag, with its sequence number and a final-chunk
+# flag bound as associated data so chunks cannot be reordered, dropped or truncated.
+STREAM_MAGIC = b"QSC1"
+_STREAM_CHUNK_AAD = struct.Struct(">4sQ?")
+
+PBKDF2_ITERATIONS = 100000
+
+# Domain separation label for HKDF-derived subkeys.
+_DERIVATION_LABEL = b"qkms-derived-key-v1:"
+
+# Blind index tokens are HMAC-SHA256 truncated to this many bytes (128 bits).
+BLIND_INDEX_BYTES = 16
+
+
+@functools.lru_cache(maxsize=32)
+def _derive_master_key(master_password: bytes, salt: bytes, iterations: int) -> bytes:
+    """
+    Derives the key-encryption key protecting the key store. Cached per process so
+    that every KMS instance with the same password, salt and iteration count pays
+    for PBKDF2 only once.
+    """
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+        backend=default_backend()
+    )
+    return base64.urlsafe_b64encode(kdf.derive(master_password))
 
 
 class KMS:
     """
     Manages cryptographic keys for the framework.
     """
-    def __init__(self, master_password: str = "supersecretpassword"):
+    def __init__(self, master_password: str = "supersecretpassword", key_store_path: str = "./kms_key_store.json",
+                 commit_window: float = 0.002, max_batch_size: int = 256, usage_flush_interval: float = 5.0,
+                 max_key_operations: int = None, max_key_bytes: int = None):
         self.master_password = master_password.encode('utf-8')
         self.salt = b'\x8d\x9b\x1c\x0f\x1e\x0c\x1b\x0a\x1d\x0b\x1f\x0d\x1a\x0e\x19\x09' # Fixed salt for simplicity in prototype
-        self.fernet = self._derive_fernet_key()
-        self.hybrid_crypto = HybridCrypto()
-        self.key_store_path = "./kms_key_store.json"
-        self._load_key_store()
+        self.iterations = PBKDF2_ITERATIONS
+        # Key derivation, HybridCrypto and the key store are all initialized on first use,
+        # so constructing a KMS (e.g. at module import time) does no expensive work.
+        self._fernet = None
+        self._hybrid_crypto = None
+        self._key_store = None
+        self._init_lock = threading.Lock()
+        # The path is kept for compatibility; legacy whole-file stores are migrated to the record log on open.
+        self.key_store_path = key_store_path
+        self.commit_window = commit_window
+        self.max_batch_size = max_batch_size
+        self.key_cache = KeyMaterialCache()
+        self.data_key_cache = DataKeyCache()
+        self.unwrapped_data_key_cache = KeyMaterialCache()
+        self.derived_key_cache = KeyMaterialCache(max_entries=4096)
+        self._revoked_paths_cache = {}  # logical key ID -> (revoked_paths list, frozenset)
+        self._metadata_index = None
+        # Per-version usage counters; listeners on usage.threshold_listeners are told
+        # when a key version reaches max_key_operations or max_key_bytes.
+        self.usage = KeyUsageCounters(self, flush_interval=usage_flush_interval,
+                                      max_operations=max_key_operations, max_bytes=max_key_bytes)
 
     def _derive_fernet_key(self):
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=self.salt,
-            iterations=100000,
-            backend=default_backend()
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(self.master_password))
-        return Fernet(key)
-
-    def _load_key_store(self):
-        if os.path.exists(self.key_store_path):
-            with open(self.key_store_path, 'r') as f:
-                encrypted_data = f.read()
-            try:
-                decrypted_data = self.fernet.decrypt(encrypted_data.encode('utf-8')).decode('utf-8')
-                self.key_store = json.loads(decrypted_data)
-            except Exception as e:
-                print(f"Error loading key store: {e}. Initializing empty key store.")
-                self.key_store = {}
+        return Fernet(_derive_master_key(self.master_password, self.salt, self.iterations))
+
+    @property
+    def fernet(self) -> Fernet:
+        if self._fernet is None:
+            with self._init_lock:
+                if self._fernet is None:
+                    self._fernet = self._derive_fernet_key()
+        return self._fernet
+
+    @property
+    def hybrid_crypto(self) -> HybridCrypto:
+        if self._hybrid_crypto is None:
+            with self._init_lock:
+                if self._hybrid_crypto is None:
+                    self._hybrid_crypto = HybridCrypto()
+        return self._hybrid_crypto
+
+    @property
+    def key_store(self) -> KeyStoreLog:
+        """
+        The record-level key store, opened on first access.
+        """
+        if self._key_store is None:
+            fernet = self.fernet
+            with self._init_lock:
+                if self._key_store is None:
+                    self._key_store = self._load_key_store(fernet)
+        return self._key_store
+
+    def _load_key_store(self, fernet: Fernet) -> KeyStoreLog:
+        """
+        Opens the record-level key store. Only record headers are scanned here;
+        individual key records are decrypted the first time they are accessed.
+        """
+        key_store = KeyStoreLog(self.key_store_path, fernet, commit_window=self.commit_window,
+                                max_batch_size=self.max_batch_size)
+        key_store.change_listeners.append(self._on_external_key_change)
+        key_store.open()
+        return key_store
+
+    def _on_external_key_change(self, key_ids: set | None) -> None:
+        """
+        Drops cached state for keys changed by another process sharing the key store.
+        `key_ids` is None if the whole store was reloaded.
+        """
+        if key_ids is None:
+            self.key_cache.clear()
+            self.data_key_cache.clear()
+            self._metadata_index = None
+            self._revoked_paths_cache.clear()
         else:
-            self.key_store = {}
+            for key_id in key_ids:
+                self.key_cache.invalidate(key_id)
+                self.data_key_cache.invalidate(key_id)
+                if self._metadata_index is not None:
+                    key_info = self._key_store.get(key_id)
+                    if key_info is None:
+                        self._metadata_index.remove(key_id)
+                    else:
+                        self._metadata_index.upsert(KeyRecord.from_key_info(key_id, key_info))
+        self.unwrapped_data_key_cache.clear()
+        self.derived_key_cache.clear()
+
+    @property
+    def metadata_index(self) -> KeyMetadataIndex:
+        """
+        Secondary indexes over key metadata. Built on first use from the key store
+        (so opening the store stays lazy) and maintained incrementally afterwards.
+        """
+        if self._metadata_index is None:
+            index = KeyMetadataIndex()
+            for key_id in self.key_store:
+                index.upsert(KeyRecord.from_key_info(key_id, self.key_store[key_id]))
+            self._metadata_index = index
+        return self._metadata_index
+
+    def _put_key(self, key_id: str, key_info: dict) -> None:
+        """
+        Persists a key record and keeps the metadata index in sync.
+        """
+        self.key_store[key_id] = key_info
+        if self._metadata_index is not None:
+            self._metadata_index.upsert(KeyRecord.from_key_info(key_id, key_info))
 
-    def _save_key_store(self):
-        encrypted_data = self.fernet.encrypt(json.dumps(self.key_store).encode('utf-8'))
-        with open(self.key_store_path, 'w') as f:
-            f.write(encrypted_data.decode('utf-8'))
+    def flush(self) -> None:
+        """
+        Durably commits all pending key store writes (including accumulated key usage) immediately.
+        """
+        self.usage.flush()
+        if self._key_store is not None:
+            self._key_store.flush()
 
-    def generate_pqc_key_pair(self, key_id: str, algorithm: str = "Kyber") -> dict:
+    def bulk(self):
         """
-        Generates and stores a PQC key pair.
+        Returns a context manager that coalesces every key store write made by the
+        calling thread inside the block into a single durable commit on exit.
+
+        Example:
+            with kms.bulk():
+                for key_id in key_ids:
+                    kms.generate_symmetric_key(key_id)
         """
+        return self.key_store.bulk()
+
+    @staticmethod
+    def _build_pqc_key_info(algorithm: str) -> dict:
         if algorithm == "Kyber":
             pqc_instance = Kyber()
         elif algorithm == "Dilithium":
@@ -63,7 +216,7 @@ class KMS:
         else:
             raise ValueError("Unsupported PQC algorithm.")
         public_key, private_key = pqc_instance.generate_keypair()
-        self.key_store[key_id] = {
+        return {
             "type": "PQC",
             "algorithm": algorithm,
             "public_key": base64.b64encode(public_key).decode('utf-8'),
@@ -72,15 +225,12 @@ class KMS:
             "created_at": time.time(),
             "last_rotated_at": time.time()
         }
-        self._save_key_store()
-        return self.key_store[key_id]
 
-    def generate_symmetric_key(self, key_id: str) -> dict:
-        """
-        Generates and stores a symmetric key.
-        """
-        symmetric_key = os.urandom(32) # AES-256 key
-        self.key_store[key_id] = {
+    @staticmethod
+    def _build_symmetric_key_info(symmetric_key: bytes = None) -> dict:
+        if symmetric_key is None:
+            symmetric_key = os.urandom(32) # AES-256 key
+        return {
             "type": "Symmetric",
             "algorithm": "AES-256",
             "key": base64.b64encode(symmetric_key).decode('utf-8'),
@@ -88,46 +238,233 @@ class KMS:
             "created_at": time.time(),
             "last_rotated_at": time.time()
         }
-        self._save_key_store()
+
+    def _check_new_key_id(self, key_id: str) -> None:
+        """
+        Raises ValueError unless `key_id` can name a new logical key.
+        """
+        if not key_id:
+            raise ValueError("Key ID must not be empty.")
+        if ":" in key_id:
+            raise ValueError(f"Invalid key ID '{key_id}': ':' is reserved for version IDs.")
+        if self.get_key(key_id) is not None:
+            raise ValueError(f"Key with ID '{key_id}' already exists.")
+
+    def _store_new_key(self, key_id: str, key_info: dict) -> dict:
+        """
+        Stores a freshly generated key as version 1 of a new logical key.
+        Existing keys are never overwritten.
+        """
+        with self.bulk():
+            self._check_new_key_id(key_id)
+            key_info["logical_key_id"] = key_id
+            key_info["version"] = 1
+            key_info["versions"] = [key_id]
+            self.key_cache.invalidate(key_id)
+            self._put_key(key_id, key_info)
         return self.key_store[key_id]
 
+    def generate_pqc_key_pair(self, key_id: str, algorithm: str = "Kyber") -> dict:
+        """
+        Generates and stores a PQC key pair.
+        """
+        return self._store_new_key(key_id, self._build_pqc_key_info(algorithm))
+
+    def generate_symmetric_key(self, key_id: str) -> dict:
+        """
+        Generates and stores a symmetric key.
+        """
+        return self._store_new_key(key_id, self._build_symmetric_key_info())
+
+    def generate_keys_bulk(self, specs: list[dict], max_workers: int = None) -> list[str]:
+        """
+        Generates many keys at once and persists them in a single durable commit.
+
+        PQC key pairs are generated in parallel across a process pool; symmetric keys
+        are sliced from one bulk random buffer. All specs are validated before any key
+        is generated, so an invalid spec leaves the store unchanged.
+
+        Args:
+            specs (list[dict]): One dict per key with "key_id", "type" ("PQC" or
+                "Symmetric") and, for PQC keys, "algorithm" (default "Kyber").
+            max_workers (int): Size of the keygen process pool (default: CPU count).
+
+        Returns:
+            list[str]: The generated key IDs, in the order of `specs`.
+        """
+        key_ids = [spec.get("key_id") for spec in specs]
+        if not all(key_ids):
+            raise ValueError("Every key spec needs a key_id.")
+        if len(set(key_ids)) != len(key_ids):
+            raise ValueError("Duplicate key_id in bulk key specs.")
+        for key_id in key_ids:
+            self._check_new_key_id(key_id)
+        pqc_specs, symmetric_ids = [], []
+        for spec in specs:
+            key_type = spec.get("type", "Symmetric")
+            if key_type == "PQC":
+                algorithm = spec.get("algorithm", "Kyber")
+                if algorithm not in ("Kyber", "Dilithium"):
+                    raise ValueError("Unsupported PQC algorithm.")
+                pqc_specs.append((spec["key_id"], algorithm))
+            elif key_type == "Symmetric":
+                symmetric_ids.append(spec["key_id"])
+            else:
+                raise ValueError(f"Unsupported key type '{key_type}'.")
+
+        generated = {}
+        random_buffer = os.urandom(32 * len(symmetric_ids))
+        for i, key_id in enumerate(symmetric_ids):
+            generated[key_id] = self._build_symmetric_key_info(random_buffer[32 * i:32 * (i + 1)])
+
+        algorithms = [algorithm for _, algorithm in pqc_specs]
+        if len(pqc_specs) > 1:
+            # Spawned workers: forking would copy the key store's committer thread state.
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                chunksize = max(1, len(algorithms) // ((max_workers or os.cpu_count() or 1) * 4))
+                pqc_infos = list(executor.map(KMS._build_pqc_key_info, algorithms, chunksize=chunksize))
+        else:
+            pqc_infos = [self._build_pqc_key_info(algorithm) for algorithm in algorithms]
+        for (key_id, _), key_info in zip(pqc_specs, pqc_infos):
+            generated[key_id] = key_info
+
+        with self.bulk():
+            for key_id in key_ids:
+                self._store_new_key(key_id, generated[key_id])
+        return key_ids
+
     def get_key(self, key_id: str) -> dict | None:
         """
         Retrieves a key by its ID.
         """
         return self.key_store.get(key_id)
 
-    def rotate_key(self, key_id: str) -> str:
+    def _get_root_key(self, key_id: str) -> dict | None:
         """
-        Rotates an existing key. The old key is marked as inactive, and a new key is generated.
-        Returns the ID of the new key.
+        Returns the root record (version 1) of the logical key that `key_id` belongs to.
+        Keys stored before versioning was introduced are treated as single-version chains.
         """
-        old_key = self.get_key(key_id)
-        if not old_key:
-            raise ValueError(f"Key with ID '{key_id}' not found for rotation.")
+        key_info = self.get_key(key_id)
+        if not key_info:
+            return None
+        logical_key_id = key_info.get("logical_key_id", key_id)
+        return key_info if logical_key_id == key_id else self.get_key(logical_key_id)
 
-        old_key["status"] = "inactive"
-        new_key_id = f"{key_id}_rotated_{int(time.time())}"
+    def get_key_versions(self, key_id: str) -> list[str]:
+        """
+        Returns the IDs of all versions of a logical key, oldest first.
+        `key_id` may be the logical key ID or the ID of any of its versions.
+        """
+        root = self._get_root_key(key_id)
+        if not root:
+            raise ValueError(f"Key with ID '{key_id}' not found.")
+        return list(root.get("versions", [root.get("logical_key_id", key_id)]))
 
-        if old_key["type"] == "PQC":
-            self.generate_pqc_key_pair(new_key_id, old_key["algorithm"])
-        elif old_key["type"] == "Symmetric":
-            self.generate_symmetric_key(new_key_id)
-        else:
-            raise ValueError("Unsupported key type for rotation.")
+    def get_current_key_id(self, key_id: str) -> str:
+        """
+        Resolves a logical key ID (or any of its version IDs) to the current version in O(1).
+        """
+        return self.get_key_versions(key_id)[-1]
 
-        self._save_key_store()
+    def find_keys(self, status: str = None, key_type: str = None, algorithm: str = None,
+                  rotated_before: float = None, limit: int = None) -> list[dict]:
+        """
+        Returns metadata (no key material) for keys matching all given criteria,
+        least recently rotated first. Answered from the secondary indexes.
+        """
+        records = self.metadata_index.query(status=status, key_type=key_type, algorithm=algorithm,
+                                            rotated_before=rotated_before, limit=limit)
+        return [record.to_dict() for record in records]
+
+    def get_keys_due_for_rotation(self, max_age_seconds: float, key_type: str = None, algorithm: str = None,
+                                  limit: int = None) -> list[str]:
+        """
+        Returns the IDs of active keys that have not been rotated for `max_age_seconds`.
+        """
+        records = self.metadata_index.query(status="active", key_type=key_type, algorithm=algorithm,
+                                            rotated_before=time.time() - max_age_seconds, limit=limit)
+        return [record.key_id for record in records]
+
+    def rotate_key(self, key_id: str) -> str:
+        """
+        Rotates an existing key by appending a new version to its version chain.
+        The previous current version is marked as inactive: it is no longer used for
+        encryption or signing but can still decrypt and verify existing data.
+        `key_id` may be the logical key ID or any version ID. Returns the ID of the new version.
+        """
+        # The chain is read and extended inside one write transaction, so concurrent
+        # rotations (from other threads or processes) cannot both create the same version.
+        # The new version, the old version's status and the chain update land in one commit.
+        with self.bulk():
+            root = self._get_root_key(key_id)
+            if not root:
+                raise ValueError(f"Key with ID '{key_id}' not found for rotation.")
+
+            # Stored records are shared with concurrent readers: update copies, never in place.
+            root = dict(root)
+            logical_key_id = root.get("logical_key_id", key_id)
+            versions = list(root.get("versions", [logical_key_id]))
+            current_key_id = versions[-1]
+            current_key = root if current_key_id == logical_key_id else dict(self.get_key(current_key_id))
+            if current_key["status"] == "revoked":
+                raise ValueError(f"Cannot rotate key '{logical_key_id}': its current version '{current_key_id}' is revoked.")
+            new_version = len(versions) + 1
+            new_key_id = f"{logical_key_id}{KEY_VERSION_SEPARATOR}{new_version}"
+            if self.get_key(new_key_id) is not None:
+                # Only possible for keys created before ':' was reserved; never overwrite them.
+                raise ValueError(f"Cannot rotate key '{logical_key_id}': a key with ID '{new_key_id}' already exists.")
+
+            if current_key["type"] == "PQC":
+                new_key = self._build_pqc_key_info(current_key["algorithm"])
+            elif current_key["type"] == "Symmetric":
+                new_key = self._build_symmetric_key_info()
+            else:
+                raise ValueError("Unsupported key type for rotation.")
+            new_key["logical_key_id"] = logical_key_id
+            new_key["version"] = new_version
+
+            self._put_key(new_key_id, new_key)
+            if current_key["status"] == "active":
+                current_key["status"] = "inactive"
+                self._put_key(current_key_id, current_key)
+            root["versions"] = versions + [new_key_id]
+            root["logical_key_id"] = logical_key_id
+            root.setdefault("version", 1)
+            self._put_key(logical_key_id, root)
+        self.key_cache.invalidate(current_key_id)
+        # New envelopes get a DEK wrapped under the new version; existing DEKs stay valid.
+        self.data_key_cache.invalidate(current_key_id)
         return new_key_id
 
-    def revoke_key(self, key_id: str) -> None:
+    def revoke_key(self, key_id: str, version: int = None) -> None:
         """
-        Revokes a key by marking it as revoked.
+        Revokes a key by marking it as revoked. Revoking a logical key ID revokes
+        every version; revoking a version ID revokes only that version. Pass `version`
+        to revoke a single version by number, e.g. version 1, whose record is also the
+        logical key's.
         """
-        key = self.get_key(key_id)
-        if not key:
-            raise ValueError(f"Key with ID '{key_id}' not found for revocation.")
-        key["status"] = "revoked"
-        self._save_key_store()
+        with self.bulk():
+            key = self.get_key(key_id)
+            if not key:
+                raise ValueError(f"Key with ID '{key_id}' not found for revocation.")
+            if version is not None:
+                versions = self.get_key_versions(key_id)
+                if not 1 <= version <= len(versions):
+                    raise ValueError(f"Key '{key_id}' has no version {version}.")
+                version_ids = [versions[version - 1]]
+            elif key.get("logical_key_id", key_id) == key_id:
+                version_ids = key.get("versions", [key_id])
+            else:
+                version_ids = [key_id]
+            for version_id in version_ids:
+                version = dict(self.get_key(version_id))
+                version["status"] = "revoked"
+                self._put_key(version_id, version)
+        for version_id in version_ids:
+            self.key_cache.invalidate(version_id)
+            self.data_key_cache.invalidate(version_id)
+        self.unwrapped_data_key_cache.clear()
+        self.derived_key_cache.clear()
 
     def perform_hybrid_key_exchange_with_kms(self, recipient_public_key: bytes) -> tuple[bytes, bytes, bytes]:
         """
@@ -152,49 +489,480 @@ class KMS:
         # (which would be sent to the recipient for decapsulation).
         return shared_secret, ciphertext, kms_pk
 
-    def encrypt_data_with_kms_key(self, key_id: str, data: bytes) -> tuple[bytes, bytes, bytes]:
+    def _load_key_material(self, key_id: str, key_type: str, allow_inactive: bool = False) -> CachedKeyMaterial:
         """
-        Encrypts data using a symmetric key managed by the KMS.
+        Returns decoded material for an active key of the given type. Superseded
+        (inactive) versions are accepted when `allow_inactive` is set; revoked keys never are.
+        On a cache miss the key is validated, decoded once and cached.
         """
+        # Picks up revocations and rotations made by other processes (throttled).
+        self.key_store.refresh()
+        entry = self.key_cache.get(key_id)
+        if entry is not None and entry.key_type == key_type:
+            return entry
+
+        allowed_statuses = ("active", "inactive") if allow_inactive else ("active",)
         key_info = self.get_key(key_id)
-        if not key_info or key_info["type"] != "Symmetric" or key_info["status"] != "active":
-            raise ValueError(f"Invalid or inactive symmetric key with ID '{key_id}'.")
+        if not key_info or key_info["type"] != key_type or key_info["status"] not in allowed_statuses:
+            label = "symmetric" if key_type == "Symmetric" else key_type
+            raise ValueError(f"Invalid or inactive {label} key with ID '{key_id}'.")
+
+        if key_type == "Symmetric":
+            material = bytearray(base64.b64decode(key_info["key"]))
+            entry = CachedKeyMaterial(key_type, key_info["algorithm"], material=material,
+                                      primitive=AESGCM(bytes(material)))
+        else:
+            entry = CachedKeyMaterial(key_type, key_info["algorithm"],
+                                      material=bytearray(base64.b64decode(key_info["private_key"])),
+                                      public_key=base64.b64decode(key_info["public_key"]))
+        return self.key_cache.put(key_id, entry)
+
+    def _get_symmetric_cipher(self, key_id: str, allow_inactive: bool = False) -> AESGCM:
+        while True:
+            aesgcm = self._load_key_material(key_id, "Symmetric", allow_inactive).primitive
+            if aesgcm is not None: # None only if the entry was invalidated concurrently
+                return aesgcm
+
+    def _get_signing_key(self, key_id: str) -> bytes:
+        while True:
+            entry = self._load_key_material(key_id, "PQC")
+            material = entry.material
+            if material is None:
+                continue
+            signing_key = bytes(material)
+            if entry.material is material: # the buffer was not wiped while being copied
+                return signing_key
+
+    def _resolve_current_version(self, key_id: str) -> tuple[str, int]:
+        root = self._get_root_key(key_id)
+        if not root:
+            raise ValueError(f"Invalid or inactive key with ID '{key_id}'.")
+        versions = root.get("versions", [key_id])
+        return versions[-1], len(versions)
+
+    @staticmethod
+    def ciphertext_key_version(ciphertext: bytes) -> int | None:
+        """
+        Returns the key version recorded in a ciphertext header, or None for legacy
+        ciphertexts produced before key versioning.
+        """
+        if ciphertext[:len(KEY_VERSION_MAGIC)] != KEY_VERSION_MAGIC or len(ciphertext) < _KEY_VERSION_HEADER.size:
+            return None
+        return _KEY_VERSION_HEADER.unpack_from(ciphertext)[1]
 
-        symmetric_key = base64.b64decode(key_info["key"])
-        return self.hybrid_crypto.encrypt_data(data, symmetric_key)
+    def encrypt_data_with_kms_key(self, key_id: str, data: bytes) -> tuple[bytes, bytes, bytes]:
+        """
+        Encrypts data using the current version of a symmetric key managed by the KMS.
+        The returned ciphertext starts with a header naming the key version used.
+        """
+        version_key_id, version = self._resolve_current_version(key_id)
+        aesgcm = self._get_symmetric_cipher(version_key_id)
+        header = _KEY_VERSION_HEADER.pack(KEY_VERSION_MAGIC, version)
+        nonce = os.urandom(12)  # GCM recommended nonce size
+        sealed = aesgcm.encrypt(nonce, data, header)
+        self.usage.record(version_key_id, "encrypt", len(data))
+        return header + sealed[:-16], nonce, sealed[-16:]
 
     def decrypt_data_with_kms_key(self, key_id: str, ciphertext: bytes, nonce: bytes, tag: bytes) -> bytes:
         """
-        Decrypts data using a symmetric key managed by the KMS.
+        Decrypts data using a symmetric key managed by the KMS. The key version is
+        taken from the ciphertext header, so data encrypted before a rotation still
+        decrypts without re-encryption. Ciphertexts without a header use `key_id` directly.
         """
-        key_info = self.get_key(key_id)
-        if not key_info or key_info["type"] != "Symmetric" or key_info["status"] != "active":
-            raise ValueError(f"Invalid or inactive symmetric key with ID '{key_id}'.")
+        version = self.ciphertext_key_version(ciphertext)
+        if version is not None:
+            versions = self.get_key_versions(key_id) if self.get_key(key_id) else []
+            if not 1 <= version <= len(versions):
+                raise ValueError(f"Invalid or inactive symmetric key with ID '{key_id}'.")
+            aesgcm = self._get_symmetric_cipher(versions[version - 1], allow_inactive=True)
+            header = ciphertext[:_KEY_VERSION_HEADER.size]
+            plaintext = aesgcm.decrypt(nonce, ciphertext[_KEY_VERSION_HEADER.size:] + tag, header)
+            self.usage.record(versions[version - 1], "decrypt", len(plaintext))
+            return plaintext
+
+        aesgcm = self._get_symmetric_cipher(key_id, allow_inactive=True)
+        plaintext = aesgcm.decrypt(nonce, ciphertext + tag, None)
+        self.usage.record(key_id, "decrypt", len(plaintext))
+        return plaintext
+
+    # --- Envelope encryption ---
+
+    def generate_data_key(self, key_id: str) -> tuple[bytes, bytes]:
+        """
+        Generates a data-encryption key (DEK) for envelope encryption.
 
-        symmetric_key = base64.b64decode(key_info["key"])
-        return self.hybrid_crypto.decrypt_data(ciphertext, nonce, tag, symmetric_key)
+        Returns:
+            tuple: (plaintext_dek, wrapped_dek) where wrapped_dek is the DEK encrypted under
+                   the current version of the key-encryption key (KEK) `key_id`.
+        """
+        data_key = os.urandom(32)
+        return data_key, self._wrap_data_key(key_id, data_key)
 
-    def sign_data_with_kms_key(self, key_id: str, data: bytes) -> bytes:
+    def _wrap_data_key(self, key_id: str, data_key: bytes) -> bytes:
+        ciphertext, nonce, tag = self.encrypt_data_with_kms_key(key_id, data_key)
+        return nonce + tag + ciphertext
+
+    def decrypt_data_key(self, key_id: str, wrapped_dek: bytes) -> bytes:
         """
-        Signs data using a PQC signing key managed by the KMS.
+        Unwraps a DEK produced by generate_data_key under the KEK `key_id`.
         """
-        key_info = self.get_key(key_id)
-        if not key_info or key_info["type"] != "PQC" or key_info["status"] != "active":
-            raise ValueError(f"Invalid or inactive PQC key with ID '{key_id}'.")
+        return self.decrypt_data_with_kms_key(key_id, wrapped_dek[28:], wrapped_dek[:12], wrapped_dek[12:28])
+
+    def rewrap_data_key(self, key_id: str, wrapped_dek: bytes) -> bytes:
+        """
+        Re-wraps a DEK under the current KEK version. After a rotation this is the
+        only per-object work needed; the data encrypted under the DEK is untouched.
+        """
+        return self._wrap_data_key(key_id, self.decrypt_data_key(key_id, wrapped_dek))
+
+    def encrypt_envelope(self, key_id: str, data: bytes) -> bytes:
+        """
+        Encrypts data under a DEK wrapped by the KEK `key_id` and returns a
+        self-describing envelope. DEKs are cached and reused within the message,
+        byte and age limits of `data_key_cache`.
+        """
+        version_key_id, _ = self._resolve_current_version(key_id)
+        data_key = self.data_key_cache.acquire(version_key_id, len(data))
+        aesgcm = data_key.material.primitive if data_key is not None else None
+        if aesgcm is None:
+            plaintext_key, wrapped_dek = self.generate_data_key(key_id)
+            aesgcm = AESGCM(plaintext_key)
+            data_key = CachedDataKey(wrapped_dek, CachedKeyMaterial("DataKey", "AES-256",
+                                                                    material=bytearray(plaintext_key),
+                                                                    primitive=aesgcm))
+            self.data_key_cache.store(version_key_id, data_key, len(data))
+        nonce = os.urandom(12)
+        header = _ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, len(data_key.wrapped_key)) + data_key.wrapped_key
+        return header + nonce + aesgcm.encrypt(nonce, data, ENVELOPE_MAGIC)
+
+    def _split_envelope(self, envelope: bytes) -> tuple[bytes, int]:
+        magic, wrapped_length = _ENVELOPE_HEADER.unpack_from(envelope)
+        if magic != ENVELOPE_MAGIC:
+            raise ValueError("Invalid envelope format.")
+        header_end = _ENVELOPE_HEADER.size + wrapped_length
+        return envelope[_ENVELOPE_HEADER.size:header_end], header_end
+
+    def _get_data_key_cipher(self, key_id: str, wrapped_dek: bytes) -> AESGCM:
+        cache_key = f"{key_id}:{hashlib.sha256(wrapped_dek).hexdigest()}"
+        entry = self.unwrapped_data_key_cache.get(cache_key)
+        aesgcm = entry.primitive if entry is not None else None
+        if aesgcm is None:
+            data_key = self.decrypt_data_key(key_id, wrapped_dek)
+            aesgcm = AESGCM(data_key)
+            self.unwrapped_data_key_cache.put(cache_key, CachedKeyMaterial("DataKey", "AES-256",
+                                                                           material=bytearray(data_key),
+                                                                           primitive=aesgcm))
+        return aesgcm
+
+    def decrypt_envelope(self, key_id: str, envelope: bytes) -> bytes:
+        """
+        Decrypts an envelope produced by encrypt_envelope. Only the small wrapped DEK
+        is decrypted with the KEK, and unwrapped DEKs are cached.
+        """
+        wrapped_dek, header_end = self._split_envelope(envelope)
+        aesgcm = self._get_data_key_cipher(key_id, wrapped_dek)
+        nonce = envelope[header_end:header_end + 12]
+        return aesgcm.decrypt(nonce, envelope[header_end + 12:], ENVELOPE_MAGIC)
 
-        private_key = base64.b64decode(key_info["private_key"])
-        return self.hybrid_crypto.sign_data(data, private_key)
+    def rewrap_envelope(self, key_id: str, envelope: bytes) -> bytes:
+        """
+        Returns the envelope with its DEK re-wrapped under the current KEK version.
+        The encrypted payload is copied unchanged.
+        """
+        wrapped_dek, header_end = self._split_envelope(envelope)
+        new_wrapped_dek = self.rewrap_data_key(key_id, wrapped_dek)
+        return (_ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, len(new_wrapped_dek)) + new_wrapped_dek
+                + envelope[header_end:])
+
+    # --- Streaming encryption ---
+
+    def encrypt_stream(self, key_id: str, chunks):
+        """
+        Encrypts an iterable of plaintext chunks under a fresh DEK wrapped by the KEK `key_id`.
+
+        Returns:
+            tuple: (wrapped_dek, encrypted_chunks) where encrypted_chunks is a generator that
+                   encrypts lazily, holding at most one plaintext chunk in memory.
+        """
+        data_key, wrapped_dek = self.generate_data_key(key_id)
+        aesgcm = AESGCM(data_key)
+
+        def encrypted_chunks():
+            seq, previous = 0, None
+            for chunk in chunks:
+                if previous is not None:
+                    yield self._encrypt_stream_chunk(aesgcm, previous, seq, False)
+                    seq += 1
+                previous = chunk
+            # An empty stream still gets one (empty) final chunk so truncation is detectable.
+            yield self._encrypt_stream_chunk(aesgcm, previous or b"", seq, True)
+
+        return wrapped_dek, encrypted_chunks()
+
+    @staticmethod
+    def _encrypt_stream_chunk(aesgcm: AESGCM, chunk: bytes, seq: int, final: bool) -> bytes:
+        nonce = os.urandom(12)
+        return nonce + aesgcm.encrypt(nonce, chunk, _STREAM_CHUNK_AAD.pack(STREAM_MAGIC, seq, final))
+
+    def decrypt_stream(self, key_id: str, wrapped_dek: bytes, encrypted_chunks):
+        """
+        Generator yielding the plaintext chunks of a stream produced by encrypt_stream.
+        Raises ValueError if chunks are missing, reordered or the stream is truncated.
+        """
+        aesgcm = self._get_data_key_cipher(key_id, wrapped_dek)
+        seq, previous = 0, None
+        for chunk in encrypted_chunks:
+            if previous is not None:
+                yield self._decrypt_stream_chunk(aesgcm, previous, seq, False)
+                seq += 1
+            previous = chunk
+        if previous is None:
+            raise ValueError("Encrypted stream is empty or truncated.")
+        yield self._decrypt_stream_chunk(aesgcm, previous, seq, True)
+
+    @staticmethod
+    def _decrypt_stream_chunk(aesgcm: AESGCM, chunk: bytes, seq: int, final: bool) -> bytes:
+        try:
+            return aesgcm.decrypt(chunk[:12], chunk[12:], _STREAM_CHUNK_AAD.pack(STREAM_MAGIC, seq, final))
+        except InvalidTag:
+            raise ValueError(f"Encrypted stream chunk {seq} failed authentication "
+                             "(corrupted, reordered or truncated stream).")
+
+    # --- Derived keys ---
+
+    @staticmethod
+    def _normalize_derivation_path(path) -> tuple[str, ...]:
+        segments = tuple(path.split("/")) if isinstance(path, str) else tuple(path)
+        if not segments or any(not segment or "/" in segment for segment in segments):
+            raise ValueError(f"Invalid derivation path '{path}'.")
+        return segments
+
+    def _revoked_paths(self, logical_key_id: str, root: dict) -> frozenset:
+        revoked = root.get("revoked_paths")
+        if not revoked:
+            return frozenset()
+        cached = self._revoked_paths_cache.get(logical_key_id)
+        # Records are replaced copy-on-write, so an unchanged list object means an unchanged set.
+        if cached is None or cached[0] is not revoked:
+            cached = (revoked, frozenset(revoked))
+            self._revoked_paths_cache[logical_key_id] = cached
+        return cached[1]
+
+    def _check_derivation_path(self, root_key_id: str, segments: tuple[str, ...]) -> dict:
+        root = self._get_root_key(root_key_id)
+        if not root or root["type"] != "Symmetric":
+            raise ValueError(f"Invalid or inactive symmetric key with ID '{root_key_id}'.")
+        revoked = self._revoked_paths(root.get("logical_key_id", root_key_id), root)
+        if revoked:
+            for depth in range(1, len(segments) + 1):
+                if "/".join(segments[:depth]) in revoked:
+                    raise ValueError(f"Derived key path '{'/'.join(segments[:depth])}' has been revoked.")
+        return root
+
+    def _get_derived_key(self, version_key_id: str, segments: tuple[str, ...],
+                         allow_inactive: bool = False) -> CachedKeyMaterial:
+        """
+        Derives the subkey for `segments` one path segment at a time
+        (k_i = HKDF(k_{i-1}, info=segment)), starting from the deepest cached ancestor.
+        Every node on the path is cached, so sibling objects share the parent derivations.
+        """
+        cache_prefix = version_key_id + "\x00"
+        leaf = self.derived_key_cache.get(cache_prefix + "/".join(segments))
+        if leaf is not None and leaf.primitive is not None:
+            return leaf
+
+        depth, parent = len(segments) - 1, None
+        while depth > 0:
+            parent = self.derived_key_cache.get(cache_prefix + "/".join(segments[:depth]))
+            parent_material = parent.material if parent is not None else None
+            if parent_material is not None:
+                parent_key = bytes(parent_material)
+                break
+            depth -= 1
+        if depth == 0:
+            while True:
+                root_material = self._load_key_material(version_key_id, "Symmetric", allow_inactive).material
+                if root_material is not None:  # None only if the entry was invalidated concurrently
+                    parent_key = bytes(root_material)
+                    break
+
+        for depth in range(depth + 1, len(segments) + 1):
+            hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                        info=_DERIVATION_LABEL + segments[depth - 1].encode('utf-8'), backend=default_backend())
+            parent_key = hkdf.derive(parent_key)
+            is_leaf = depth == len(segments)
+            entry = CachedKeyMaterial("Derived", "AES-256", material=bytearray(parent_key),
+                                      primitive=AESGCM(parent_key) if is_leaf else None)
+            self.derived_key_cache.put(cache_prefix + "/".join(segments[:depth]), entry)
+        return entry
+
+    def derive_key(self, root_key_id: str, path) -> bytes:
+        """
+        Deterministically derives a subkey from the current version of a stored root key.
+        `path` is a "tenant/collection/object/..." string or a sequence of segments.
+        Derived keys are never stored; the same root version and path always yield the same key.
+        """
+        segments = self._normalize_derivation_path(path)
+        self._check_derivation_path(root_key_id, segments)
+        version_key_id, _ = self._resolve_current_version(root_key_id)
+        while True:
+            material = self._get_derived_key(version_key_id, segments).material
+            if material is not None:
+                return bytes(material)
+
+    def encrypt_with_derived_key(self, root_key_id: str, path, data: bytes) -> tuple[bytes, bytes, bytes]:
+        """
+        Encrypts data under the key derived for `path` from the current root key version.
+        The ciphertext header records the root key version, as for encrypt_data_with_kms_key.
+        """
+        segments = self._normalize_derivation_path(path)
+        self._check_derivation_path(root_key_id, segments)
+        version_key_id, version = self._resolve_current_version(root_key_id)
+        header = _KEY_VERSION_HEADER.pack(KEY_VERSION_MAGIC, version)
+        while True:
+            aesgcm = self._get_derived_key(version_key_id, segments).primitive
+            if aesgcm is not None:
+                break
+        nonce = os.urandom(12)
+        sealed = aesgcm.encrypt(nonce, data, header)
+        self.usage.record(version_key_id, "encrypt", len(data))
+        return header + sealed[:-16], nonce, sealed[-16:]
+
+    def decrypt_with_derived_key(self, root_key_id: str, path, ciphertext: bytes, nonce: bytes, tag: bytes) -> bytes:
+        """
+        Decrypts data produced by encrypt_with_derived_key for the same root key and path.
+        """
+        segments = self._normalize_derivation_path(path)
+        self._check_derivation_path(root_key_id, segments)
+        version = self.ciphertext_key_version(ciphertext)
+        versions = self.get_key_versions(root_key_id)
+        if version is None or not 1 <= version <= len(versions):
+            raise ValueError("Invalid derived-key ciphertext header.")
+        while True:
+            aesgcm = self._get_derived_key(versions[version - 1], segments, allow_inactive=True).primitive
+            if aesgcm is not None:
+                break
+        header = ciphertext[:_KEY_VERSION_HEADER.size]
+        plaintext = aesgcm.decrypt(nonce, ciphertext[_KEY_VERSION_HEADER.size:] + tag, header)
+        self.usage.record(versions[version - 1], "decrypt", len(plaintext))
+        return plaintext
+
+    def revoke_derived_path(self, root_key_id: str, path) -> None:
+        """
+        Revokes every key derived under `path` (the path itself and its whole subtree).
+        This is a metadata update on the root key record; no derived key is stored.
+        """
+        prefix = "/".join(self._normalize_derivation_path(path))
+        with self.bulk():
+            root = self._get_root_key(root_key_id)
+            if not root:
+                raise ValueError(f"Key with ID '{root_key_id}' not found.")
+            root = dict(root)
+            revoked = list(root.get("revoked_paths", []))
+            if prefix in revoked:
+                return
+            root["revoked_paths"] = revoked + [prefix]
+            self._put_key(root.get("logical_key_id", root_key_id), root)
+        self.derived_key_cache.clear()
+
+    def get_revoked_derived_paths(self, root_key_id: str) -> list[str]:
+        """
+        Returns the derivation path prefixes revoked under a root key.
+        """
+        root = self._get_root_key(root_key_id)
+        if not root:
+            raise ValueError(f"Key with ID '{root_key_id}' not found.")
+        return list(root.get("revoked_paths", []))
+
+    # --- Blind indexes ---
+
+    @staticmethod
+    def _blind_index_segments(field: str) -> tuple[str, ...]:
+        if not field or ":" in field or "/" in field:
+            raise ValueError(f"Invalid blind index field '{field}'.")
+        return ("blind-index", field)
+
+    def _blind_index_token(self, version_key_id: str, version: int, field: str, message: bytes,
+                           allow_inactive: bool = False) -> str:
+        while True:
+            material = self._get_derived_key(version_key_id, self._blind_index_segments(field), allow_inactive).material
+            if material is not None:
+                key = bytes(material)
+                break
+        digest = hmac.new(key, message, hashlib.sha256).digest()[:BLIND_INDEX_BYTES]
+        self.usage.record(version_key_id, "blind_index", len(message))
+        return f"{field}:{version}:{digest.hex()}"
+
+    @staticmethod
+    def _blind_index_message(value, scope: str) -> bytes:
+        value = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+        return scope.encode('utf-8') + b"\x00" + value
+
+    def compute_blind_index(self, key_id: str, field: str, value, scope: str = "") -> str:
+        """
+        Returns the blind index token of a plaintext field value: a truncated HMAC keyed
+        with a subkey derived (per field) from the current version of a symmetric key.
+        Equal values give equal tokens, so tokens can be stored and matched by equality
+        without revealing the value. `scope` (e.g. the owning user ID) is included in the
+        MAC so equal values in different scopes cannot be correlated. Tokens have the form
+        "field:version:hex".
+        """
+        self._check_derivation_path(key_id, self._blind_index_segments(field))
+        version_key_id, version = self._resolve_current_version(key_id)
+        return self._blind_index_token(version_key_id, version, field, self._blind_index_message(value, scope))
+
+    def blind_index_candidates(self, key_id: str, field: str, value, scope: str = "") -> list[str]:
+        """
+        Returns the tokens `value` may have been stored under: one per non-revoked version
+        of the key, so records indexed before a rotation stay searchable until the old
+        version is revoked.
+        """
+        self._check_derivation_path(key_id, self._blind_index_segments(field))
+        message = self._blind_index_message(value, scope)
+        tokens = []
+        for version, version_key_id in enumerate(self.get_key_versions(key_id), start=1):
+            if self.get_key(version_key_id)["status"] == "revoked":
+                continue
+            tokens.append(self._blind_index_token(version_key_id, version, field, message, allow_inactive=True))
+        return tokens
+
+    def sign_data_with_kms_key(self, key_id: str, data: bytes) -> bytes:
+        """
+        Signs data using the current version of a PQC signing key managed by the KMS.
+        """
+        version_key_id, _ = self._resolve_current_version(key_id)
+        signature = self.hybrid_crypto.sign_data(data, self._get_signing_key(version_key_id))
+        self.usage.record(version_key_id, "sign", len(data))
+        return signature
 
     def verify_data_with_kms_key(self, key_id: str, data: bytes, signature: bytes) -> bool:
         """
-        Verifies data using a PQC verification key managed by the KMS.
+        Verifies data using a PQC verification key managed by the KMS. The current
+        version is tried first, then older non-revoked versions.
+        """
+        versions = self.get_key_versions(key_id) if self.get_key(key_id) else [key_id]
+        for position, version_key_id in enumerate(reversed(versions)):
+            is_current = position == 0
+            if not is_current and self.get_key(version_key_id)["status"] == "revoked":
+                continue
+            public_key = self._load_key_material(version_key_id, "PQC", allow_inactive=not is_current).public_key
+            if self.hybrid_crypto.verify_data_signature(data, signature, public_key):
+                self.usage.record(version_key_id, "verify", len(data))
+                return True
+        return False
+
+    def get_key_usage(self, key_id: str) -> dict:
+        """
+        Returns usage statistics for a key version: total operations and bytes, and a
+        breakdown per operation (encrypt, decrypt, sign, verify). A logical key ID
+        reports the usage of its current version.
         """
         key_info = self.get_key(key_id)
-        if not key_info or key_info["type"] != "PQC" or key_info["status"] != "active":
-            raise ValueError(f"Invalid or inactive PQC key with ID '{key_id}'.")
-
-        public_key = base64.b64decode(key_info["public_key"])
-        return self.hybrid_crypto.verify_data_signature(data, signature, public_key)
+        if key_info is None:
+            raise ValueError(f"Key with ID '{key_id}' not found.")
+        if key_info.get("logical_key_id", key_id) == key_id:
+            key_id = self.get_current_key_id(key_id)
+        return self.usage.get_usage(key_id)
 if __name__ == "__main__":
     print("Running KMS Example:")
     kms = KMS(master_password="mysecurepassword")
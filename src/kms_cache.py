@@ -0,0 +1,190 @@
+"""
+This module provides an in-memory cache of decoded KMS key material.
+Entries hold the raw key bytes together with prepared primitive objects (such as an
+AESGCM instance) so hot encrypt/decrypt/sign/verify paths do no base64 decoding or
+key-store lookups. Entries are bounded by size and age, and evicted key buffers are
+overwritten with zeros.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def zeroize(buffer: bytearray) -> None:
+    """
+    Overwrites a mutable key buffer with zeros in place.
+    """
+    for i in range(len(buffer)):
+        buffer[i] = 0
+
+
+class CachedKeyMaterial:
+    """
+    Decoded material for a single active key.
+
+    Note: primitives from the `cryptography` library keep their own internal copy of
+    the key, so zeroizing `material` is a best-effort measure for the Python-side buffer.
+    """
+    __slots__ = ("key_type", "algorithm", "material", "public_key", "primitive", "expires_at")
+
+    def __init__(self, key_type: str, algorithm: str, material: bytearray | None = None,
+                 public_key: bytes | None = None, primitive: object = None, expires_at: float = 0.0):
+        self.key_type = key_type
+        self.algorithm = algorithm
+        self.material = material
+        self.public_key = public_key
+        self.primitive = primitive
+        self.expires_at = expires_at
+
+    def wipe(self) -> None:
+        """
+        Zeroizes the secret buffer and drops references to derived objects.
+        """
+        # Detach first so readers that copy the buffer can detect a concurrent wipe.
+        material, self.material = self.material, None
+        self.primitive = None
+        if material is not None:
+            zeroize(material)
+
+
+class KeyMaterialCache:
+    """
+    A thread-safe LRU cache of CachedKeyMaterial entries with a TTL.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key_id: str) -> CachedKeyMaterial | None:
+        """
+        Returns the cached entry for a key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key_id)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key_id]
+                entry.wipe()
+                return None
+            self._entries.move_to_end(key_id)
+            return entry
+
+    def put(self, key_id: str, entry: CachedKeyMaterial) -> CachedKeyMaterial:
+        """
+        Stores an entry, evicting (and wiping) the least recently used entries if needed.
+        """
+        entry.expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            previous = self._entries.pop(key_id, None)
+            if previous is not None and previous is not entry:
+                previous.wipe()
+            self._entries[key_id] = entry
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.wipe()
+        return entry
+
+    def invalidate(self, key_id: str) -> None:
+        """
+        Removes and wipes the entry for a key immediately.
+        """
+        with self._lock:
+            entry = self._entries.pop(key_id, None)
+        if entry is not None:
+            entry.wipe()
+
+    def clear(self) -> None:
+        """
+        Removes and wipes all entries.
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.wipe()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class CachedDataKey:
+    """
+    A plaintext data-encryption key (DEK) reused for envelope encryption, together
+    with its wrapped form and usage counters.
+    """
+    __slots__ = ("wrapped_key", "material", "created_at", "messages", "bytes_encrypted")
+
+    def __init__(self, wrapped_key: bytes, material: CachedKeyMaterial):
+        self.wrapped_key = wrapped_key
+        self.material = material
+        self.created_at = time.monotonic()
+        self.messages = 0
+        self.bytes_encrypted = 0
+
+
+class DataKeyCache:
+    """
+    Holds at most one reusable DEK per key-encryption key. A DEK is retired (and
+    wiped) once it has encrypted `max_messages` messages or `max_bytes` bytes, or is
+    older than `max_age` seconds, which bounds how much data any single DEK protects.
+    """
+
+    def __init__(self, max_messages: int = 10000, max_bytes: int = 1 << 30, max_age: float = 300.0):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._data_keys = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key_id: str, size: int) -> CachedDataKey | None:
+        """
+        Returns the cached DEK for `key_id` and charges one message of `size` bytes
+        to it, or returns None if there is no DEK with enough budget left.
+        """
+        with self._lock:
+            data_key = self._data_keys.get(key_id)
+            if data_key is None:
+                return None
+            if (data_key.messages + 1 > self.max_messages
+                    or data_key.bytes_encrypted + size > self.max_bytes
+                    or time.monotonic() - data_key.created_at > self.max_age
+                    or data_key.material.primitive is None):
+                del self._data_keys[key_id]
+                data_key.material.wipe()
+                return None
+            data_key.messages += 1
+            data_key.bytes_encrypted += size
+            return data_key
+
+    def store(self, key_id: str, data_key: CachedDataKey, size: int) -> None:
+        """
+        Caches a new DEK for `key_id`, charging the message that created it.
+        """
+        data_key.messages = 1
+        data_key.bytes_encrypted = size
+        with self._lock:
+            previous = self._data_keys.pop(key_id, None)
+            self._data_keys[key_id] = data_key
+        if previous is not None:
+            previous.material.wipe()
+
+    def invalidate(self, key_id: str) -> None:
+        """
+        Retires and wipes the DEK cached for `key_id`.
+        """
+        with self._lock:
+            data_key = self._data_keys.pop(key_id, None)
+        if data_key is not None:
+            data_key.material.wipe()
+
+    def clear(self) -> None:
+        with self._lock:
+            data_keys = list(self._data_keys.values())
+            self._data_keys.clear()
+        for data_key in data_keys:
+            data_key.material.wipe()
@@ -0,0 +1,156 @@
+"""
+This module provides compact key metadata records and secondary indexes for the KMS.
+Key material stays in the encrypted key store; the index only holds the metadata needed
+to answer queries such as "all active Kyber keys not rotated in 30 days" without
+scanning (or decrypting) every key.
+"""
+import bisect
+import sys
+import threading
+
+
+class KeyRecord:
+    """
+    Compact, slot-based metadata for a single key. Holds no key material.
+    """
+    __slots__ = ("key_id", "key_type", "algorithm", "status", "created_at", "last_rotated_at")
+
+    def __init__(self, key_id: str, key_type: str, algorithm: str, status: str,
+                 created_at: float, last_rotated_at: float):
+        self.key_id = key_id
+        # Interning keeps one shared string object per distinct type/algorithm/status.
+        self.key_type = sys.intern(key_type)
+        self.algorithm = sys.intern(algorithm)
+        self.status = sys.intern(status)
+        self.created_at = created_at
+        self.last_rotated_at = last_rotated_at
+
+    @classmethod
+    def from_key_info(cls, key_id: str, key_info: dict) -> "KeyRecord":
+        """
+        Builds a record from a key store entry.
+        """
+        return cls(key_id, key_info["type"], key_info["algorithm"], key_info["status"],
+                   key_info["created_at"], key_info.get("last_rotated_at", key_info["created_at"]))
+
+    def to_dict(self) -> dict:
+        return {
+            "key_id": self.key_id,
+            "type": self.key_type,
+            "algorithm": self.algorithm,
+            "status": self.status,
+            "created_at": self.created_at,
+            "last_rotated_at": self.last_rotated_at,
+        }
+
+
+class KeyMetadataIndex:
+    """
+    Secondary indexes over KeyRecords: by status, by (type, algorithm) and a sorted
+    list on last_rotated_at. An update finds its position in O(log n), but inserting
+    into or deleting from the sorted list shifts its tail, so it costs O(n) in the
+    worst case (a memmove of pointers, fast in practice for key-store sizes; rotated
+    keys move to the end, where the shift is shortest). Queries cost O(log n + k),
+    plus O(k log k) for sorting when the narrowest set index is walked, where k is
+    the number of candidates in the narrowest index.
+    """
+
+    def __init__(self):
+        self._records = {}  # key_id -> KeyRecord
+        self._by_status = {}  # status -> set of key_ids
+        self._by_type = {}  # (key_type, algorithm) -> set of key_ids
+        self._by_rotation = []  # sorted list of (last_rotated_at, key_id)
+        self._lock = threading.RLock()
+
+    def upsert(self, record: KeyRecord) -> None:
+        """
+        Adds a record or replaces the existing record with the same key_id.
+        """
+        with self._lock:
+            self._remove(record.key_id)
+            self._records[record.key_id] = record
+            self._by_status.setdefault(record.status, set()).add(record.key_id)
+            self._by_type.setdefault((record.key_type, record.algorithm), set()).add(record.key_id)
+            bisect.insort(self._by_rotation, (record.last_rotated_at, record.key_id))
+
+    def remove(self, key_id: str) -> None:
+        with self._lock:
+            self._remove(key_id)
+
+    def _remove(self, key_id: str) -> None:
+        record = self._records.pop(key_id, None)
+        if record is None:
+            return
+        self._by_status[record.status].discard(key_id)
+        self._by_type[(record.key_type, record.algorithm)].discard(key_id)
+        entry = (record.last_rotated_at, key_id)
+        position = bisect.bisect_left(self._by_rotation, entry)
+        if position < len(self._by_rotation) and self._by_rotation[position] == entry:
+            del self._by_rotation[position]
+
+    def get(self, key_id: str) -> KeyRecord | None:
+        with self._lock:
+            return self._records.get(key_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def query(self, status: str | None = None, key_type: str | None = None, algorithm: str | None = None,
+              rotated_before: float | None = None, rotated_after: float | None = None,
+              limit: int | None = None) -> list[KeyRecord]:
+        """
+        Returns records matching all given criteria, oldest rotation first.
+
+        Args:
+            status (str): Only keys with this status (e.g. "active").
+            key_type (str): Only keys of this type ("PQC" or "Symmetric").
+            algorithm (str): Only keys using this algorithm (e.g. "Kyber").
+            rotated_before (float): Only keys last rotated before this timestamp.
+            rotated_after (float): Only keys last rotated at or after this timestamp.
+            limit (int): Maximum number of records to return.
+        """
+        with self._lock:
+            low = 0 if rotated_after is None else bisect.bisect_left(self._by_rotation, (rotated_after, ""))
+            high = len(self._by_rotation)
+            if rotated_before is not None:
+                high = bisect.bisect_left(self._by_rotation, (rotated_before, ""))
+
+            sets = []
+            if status is not None:
+                sets.append(self._by_status.get(status, set()))
+            if key_type is not None or algorithm is not None:
+                sets.append(self._type_candidates(key_type, algorithm))
+
+            results = []
+            smallest = min(sets, key=len) if sets else None
+            if smallest is not None and len(smallest) < high - low:
+                # The narrowest set index is smaller than the time range: walk the set.
+                candidates = [self._records[key_id] for key_id in smallest]
+                candidates = [r for r in candidates if self._matches(r, sets, rotated_before, rotated_after)]
+                candidates.sort(key=lambda r: (r.last_rotated_at, r.key_id))
+                return candidates[:limit] if limit is not None else candidates
+
+            for _, key_id in self._by_rotation[low:high]:
+                if all(key_id in s for s in sets):
+                    results.append(self._records[key_id])
+                    if limit is not None and len(results) >= limit:
+                        break
+            return results
+
+    def _type_candidates(self, key_type: str | None, algorithm: str | None) -> set:
+        if key_type is not None and algorithm is not None:
+            return self._by_type.get((key_type, algorithm), set())
+        matched = set()
+        for (indexed_type, indexed_algorithm), key_ids in self._by_type.items():
+            if key_type in (None, indexed_type) and algorithm in (None, indexed_algorithm):
+                matched |= key_ids
+        return matched
+
+    @staticmethod
+    def _matches(record: KeyRecord, sets: list, rotated_before: float | None, rotated_after: float | None) -> bool:
+        if rotated_before is not None and record.last_rotated_at >= rotated_before:
+            return False
+        if rotated_after is not None and record.last_rotated_at < rotated_after:
+            return False
+        return all(record.key_id in s for s in sets)
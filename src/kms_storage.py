@@ -0,0 +1,575 @@
+"""
+This module provides a record-level encrypted storage engine for the KMS key store.
+Every key record is encrypted individually with Fernet and appended to a log file, so
+a write costs O(1) in the size of the store and records are only decrypted when they
+are first accessed. Superseded records are reclaimed by (background) compaction.
+Writes are group-committed: records appended within a short window are written and
+fsync'd together, and every writer in the group waits on the same commit future.
+
+Reads never block each other: decoded records are served from an in-memory cache
+without locking, and cache misses read the file with positional reads. Commits take
+an inter-process file lock, so several worker processes can share one key store.
+"""
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections.abc import MutableMapping
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from cryptography.fernet import Fernet
+
+from src.kms_locks import InterProcessLock, ReadWriteLock, pread
+
+# File header identifying the log format. Legacy stores are a single Fernet token.
+LOG_MAGIC = b"QKMSLOG1\n"
+# Record header: payload length, key id length, CRC32 of (key id + payload).
+_RECORD_HEADER = struct.Struct(">IHI")
+
+
+class KeyStoreLog(MutableMapping):
+    """
+    An append-only log of individually encrypted key records.
+
+    The log behaves like a dict of key_id -> record dict. Opening the log only scans the
+    record headers to build an offset index; record payloads are decrypted on first access
+    and kept in memory afterwards. A record is valid only if it was written completely and
+    its checksum matches, so a torn write at the tail is discarded on the next open.
+
+    Appended records are visible to readers immediately but become durable in groups:
+    a committer thread writes everything queued within `commit_window` seconds (or as
+    soon as `max_batch_size` records are queued) with a single fsync.
+
+    Other processes may append to (or compact) the same log. Every commit first picks
+    up their records under the file lock, and readers pick them up at most
+    `sync_interval` seconds late. Callables in `change_listeners` are called with the
+    set of key IDs changed by other processes (or None if the whole log was replaced).
+    """
+
+    def __init__(self, path: str, fernet: Fernet, compaction_threshold: float = 0.5,
+                 min_compaction_bytes: int = 1024 * 1024, background_compaction: bool = True,
+                 commit_window: float = 0.002, max_batch_size: int = 256, sync_interval: float = 1.0):
+        self.path = path
+        self.fernet = fernet
+        self.compaction_threshold = compaction_threshold
+        self.min_compaction_bytes = min_compaction_bytes
+        self.background_compaction = background_compaction
+        self.commit_window = commit_window
+        self.max_batch_size = max_batch_size
+        self.sync_interval = sync_interval
+        self.change_listeners = []
+        # Lock ordering: _compaction_lock -> _file_lock -> _io_lock -> _lock -> _file_rw (write).
+        # Readers only ever hold _file_rw for reading, and hold nothing else while they do.
+        self._lock = threading.RLock()
+        self._io_lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._file_lock = InterProcessLock(path + ".lock")
+        self._file_rw = ReadWriteLock()  # guards swapping the reader/writer file handles
+        self._commit_cond = threading.Condition(self._lock)
+        self._pending = []  # (key_id, encoded record, is_tombstone) queued for the next group commit
+        self._pending_keys = {}  # key_id -> True (live) / False (deleted) for queued records
+        self._pending_future = Future()
+        self._committer = None
+        self._bulk_state = threading.local()
+        self._index = {}  # key_id -> (offset, length) of the latest committed record
+        self._cache = {}  # key_id -> decrypted record dict (only current, live records)
+        self._end = 0  # end of the last complete record known to be in the file
+        self._dead_bytes = 0
+        self._last_sync = 0.0
+        self._reader = None
+        self._writer = None
+        self._compaction_thread = None
+        self._opened = False
+
+    # --- Opening and scanning ---
+
+    def open(self) -> None:
+        """
+        Opens the log, migrating a legacy whole-file Fernet store if one is found.
+        Only record headers are read; no record is decrypted.
+        """
+        with self._lock:
+            if self._opened:
+                return
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, 'rb') as f:
+                    head = f.read(len(LOG_MAGIC))
+                if head != LOG_MAGIC:
+                    self._migrate_legacy_store()
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                self._write_new_log(self.path, [])
+            self._reader = open(self.path, 'rb')
+            self._index.clear()
+            self._dead_bytes = 0
+            self._end = self._scan(len(LOG_MAGIC))
+            if self._end < os.path.getsize(self.path):
+                # Discard a partially written record left behind by a crash.
+                with open(self.path, 'r+b') as f:
+                    f.truncate(self._end)
+            self._writer = open(self.path, 'ab')
+            self._last_sync = time.monotonic()
+            self._opened = True
+
+    def _ensure_open(self) -> None:
+        if not self._opened:
+            with self._lock:
+                self.open()
+
+    def _scan(self, start: int, changed: set | None = None) -> int:
+        """
+        Reads record headers from `start` and updates the offset index.
+        Returns the offset just past the last complete, valid record.
+        """
+        offset = start
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                payload_len, key_len, crc = _RECORD_HEADER.unpack(header)
+                body = f.read(key_len + payload_len)
+                if len(body) < key_len + payload_len or zlib.crc32(body) != crc:
+                    break
+                key_id = body[:key_len].decode('utf-8')
+                record_len = _RECORD_HEADER.size + key_len + payload_len
+                self._apply_index_entry(key_id, offset, record_len, payload_len == 0)
+                if changed is not None:
+                    changed.add(key_id)
+                offset += record_len
+        return offset
+
+    def _apply_index_entry(self, key_id: str, offset: int, record_len: int, is_tombstone: bool) -> None:
+        previous = self._index.pop(key_id, None)
+        if previous is not None:
+            self._dead_bytes += previous[1]
+        if key_id not in self._pending_keys:
+            # A queued local write is newer than anything in the file; keep its cached record.
+            self._cache.pop(key_id, None)
+        if is_tombstone:
+            self._dead_bytes += record_len
+        else:
+            self._index[key_id] = (offset, record_len)
+
+    def _migrate_legacy_store(self) -> None:
+        """
+        Converts a legacy store (one Fernet token over the whole JSON dict) into a log.
+        """
+        with open(self.path, 'r') as f:
+            encrypted_data = f.read()
+        try:
+            legacy_store = json.loads(self.fernet.decrypt(encrypted_data.encode('utf-8')).decode('utf-8'))
+        except Exception as e:
+            print(f"Error loading key store: {e}. Initializing empty key store.")
+            os.replace(self.path, self.path + ".bak")
+            return
+        records = [self._encode_record(key_id, record) for key_id, record in legacy_store.items()]
+        self._write_new_log(self.path, records)
+
+    @staticmethod
+    def _write_new_log(path: str, records: list) -> None:
+        """
+        Atomically writes a complete log (header plus encoded records) to `path`.
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(LOG_MAGIC)
+            for record in records:
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # --- Synchronizing with other processes ---
+
+    def _sync_locked(self, truncate_torn_tail: bool = False) -> set | None:
+        """
+        Picks up records written to the log by other processes since the last sync.
+        Returns the changed key IDs, or None if the log was replaced (compacted) by
+        another process and had to be reloaded. Must be called with _io_lock and _lock
+        held; `truncate_torn_tail` additionally requires the file lock.
+        """
+        self._last_sync = time.monotonic()
+        try:
+            on_disk = os.stat(self.path)
+        except FileNotFoundError:
+            return set()
+        if on_disk.st_ino != os.fstat(self._reader.fileno()).st_ino:
+            self._reload_locked()
+            return None
+        changed = set()
+        if on_disk.st_size > self._end:
+            self._end = self._scan(self._end, changed)
+            if truncate_torn_tail and self._end < on_disk.st_size:
+                # Only possible if a writer died mid-commit: we hold the file lock.
+                with open(self.path, 'r+b') as f:
+                    f.truncate(self._end)
+        return changed
+
+    def _reload_locked(self) -> None:
+        with self._file_rw.write():
+            self._reader.close()
+            self._writer.close()
+            self._reader = open(self.path, 'rb')
+            self._writer = open(self.path, 'ab')
+            self._index = {}
+            self._cache = {key_id: record for key_id, record in self._cache.items() if key_id in self._pending_keys}
+            self._dead_bytes = 0
+            self._end = self._scan(len(LOG_MAGIC))
+
+    def _notify_changes(self, changed: set | None) -> None:
+        if changed is not None and not changed:
+            return
+        for listener in list(self.change_listeners):
+            try:
+                listener(changed)
+            except Exception as e:
+                print(f"Error in key store change listener: {e}")
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Picks up records written by other processes. Unless `force` is set this does
+        nothing if the last sync was less than `sync_interval` seconds ago.
+        """
+        if not self._opened or (not force and time.monotonic() - self._last_sync < self.sync_interval):
+            return
+        with self._io_lock, self._lock:
+            if not self._opened:
+                return
+            changed = self._sync_locked()
+        self._notify_changes(changed)
+
+    # --- Record encoding ---
+
+    def _encode_record(self, key_id: str, record: dict | None) -> bytes:
+        key_bytes = key_id.encode('utf-8')
+        payload = b"" if record is None else self.fernet.encrypt(json.dumps(record).encode('utf-8'))
+        body = key_bytes + payload
+        return _RECORD_HEADER.pack(len(payload), len(key_bytes), zlib.crc32(body)) + body
+
+    def _read_record(self, key_id: str):
+        """
+        Returns (entry, record) for the committed record of `key_id`, or (None, None) if
+        there is none. The index lookup and the read happen in one read section, so a
+        compaction cannot swap the file in between; the key embedded in the record is
+        checked as well, and (entry, None) is returned on a mismatch so the caller retries.
+        """
+        key_bytes = key_id.encode('utf-8')
+        with self._file_rw.read():
+            entry = self._index.get(key_id)
+            if entry is None:
+                return None, None
+            raw = pread(self._reader, entry[1], entry[0])
+        payload_len, key_len, _ = _RECORD_HEADER.unpack_from(raw)
+        if raw[_RECORD_HEADER.size:_RECORD_HEADER.size + key_len] != key_bytes:
+            return entry, None
+        payload = raw[_RECORD_HEADER.size + key_len:]
+        return entry, json.loads(self.fernet.decrypt(payload).decode('utf-8'))
+
+    # --- Writing ---
+
+    def _append(self, key_id: str, record: dict | None) -> Future:
+        """
+        Queues a record for the next group commit and returns the commit future.
+        Must be called with the lock held.
+        """
+        encoded = self._encode_record(key_id, record)
+        self._pending_keys[key_id] = record is not None
+        if record is not None:
+            self._cache[key_id] = record
+        else:
+            self._cache.pop(key_id, None)
+        self._pending.append((key_id, encoded, record is None))
+        future = self._pending_future
+        if self._committer is None or not self._committer.is_alive():
+            self._committer = threading.Thread(target=self._commit_loop, daemon=True)
+            self._committer.start()
+        if len(self._pending) == 1 or len(self._pending) >= self.max_batch_size:
+            self._commit_cond.notify_all()
+        return future
+
+    def _commit_loop(self) -> None:
+        while True:
+            with self._lock:
+                while not self._pending and self._opened:
+                    self._commit_cond.wait()
+                if not self._opened:
+                    return
+                # Give concurrent writers a short window to join this commit.
+                if len(self._pending) < self.max_batch_size:
+                    self._commit_cond.wait(self.commit_window)
+            self._flush_pending()
+
+    def _flush_pending(self) -> None:
+        """
+        Writes all queued records with a single fsync and resolves their shared future.
+        """
+        if not self._pending:
+            return
+        with self._file_lock, self._io_lock:
+            changed = self._write_pending_locked()
+        self._notify_changes(changed)
+
+    def _write_pending_locked(self) -> set | None:
+        """
+        Commits the queued records after the records of other processes. Must be called
+        with the file lock and _io_lock held, but not _lock: the batch is taken under
+        _lock, then written and fsync'd without it, so other threads can keep reading
+        and queueing records meanwhile. Returns the externally changed keys.
+        """
+        with self._lock:
+            changed = self._sync_locked(truncate_torn_tail=True)
+            if not self._pending:
+                return changed
+            batch, future = self._pending, self._pending_future
+            self._pending, self._pending_future = [], Future()
+        try:
+            self._writer.write(b"".join(encoded for _, encoded, _ in batch))
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+        except OSError as e:
+            with self._lock:
+                self._release_pending_keys(batch, committed=False)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            for key_id, encoded, is_tombstone in batch:
+                self._apply_index_entry(key_id, self._end, len(encoded), is_tombstone)
+                self._end += len(encoded)
+            self._release_pending_keys(batch, committed=True)
+        future.set_result(len(batch))
+        return changed
+
+    def _release_pending_keys(self, batch: list, committed: bool) -> None:
+        """
+        Forgets the queued state of the keys in a written (or failed) batch, except for
+        keys queued again since the batch was taken. Must be called with the lock held.
+        """
+        requeued = {key_id for key_id, _, _ in self._pending}
+        for key_id, _, _ in batch:
+            if key_id in requeued:
+                continue
+            self._pending_keys.pop(key_id, None)
+            if not committed:
+                self._cache.pop(key_id, None)
+
+    def _wait_for_commit(self, future: Future) -> None:
+        if getattr(self._bulk_state, "depth", 0) == 0:
+            future.result()
+
+    def flush(self) -> None:
+        """
+        Commits all queued records now instead of waiting for the commit window.
+        """
+        self._ensure_open()
+        self._flush_pending()
+
+    @contextmanager
+    def bulk(self):
+        """
+        Runs the block as one write transaction. The file lock is held for the whole
+        block, so read-modify-write sequences inside it are serialized against other
+        threads and processes, and all writes made by this thread are committed
+        together when the outermost block exits.
+        """
+        depth = getattr(self._bulk_state, "depth", 0)
+        if depth == 0:
+            self._ensure_open()
+            self._file_lock.acquire()
+            try:
+                with self._io_lock, self._lock:
+                    changed = self._sync_locked()
+                self._notify_changes(changed)
+            except BaseException:
+                self._file_lock.release()
+                raise
+        self._bulk_state.depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._bulk_state.depth -= 1
+            if self._bulk_state.depth == 0:
+                try:
+                    self.flush()
+                finally:
+                    self._file_lock.release()
+
+    # --- Mapping interface ---
+
+    def __getitem__(self, key_id: str) -> dict:
+        self._ensure_open()
+        self.refresh()
+        # Lock-free fast path: single dict lookups are atomic, and the cache only ever
+        # holds the current record of a live key.
+        while True:
+            record = self._cache.get(key_id)
+            if record is not None:
+                return record
+            if self._pending_keys.get(key_id) is False:
+                raise KeyError(key_id)
+            # Decrypt outside the lock so concurrent cache misses proceed in parallel.
+            entry, record = self._read_record(key_id)
+            if entry is None:
+                raise KeyError(key_id)
+            with self._lock:
+                if key_id in self._cache:
+                    return self._cache[key_id]
+                if record is not None and self._index.get(key_id) == entry:
+                    if key_id not in self._pending_keys:
+                        self._cache[key_id] = record
+                    return record
+            # The log was compacted or the key rewritten while reading: look it up again.
+
+    def __setitem__(self, key_id: str, record: dict) -> None:
+        with self._lock:
+            self._ensure_open()
+            future = self._append(key_id, record)
+        self._wait_for_commit(future)
+        self._maybe_schedule_compaction()
+
+    def __delitem__(self, key_id: str) -> None:
+        with self._lock:
+            self._ensure_open()
+            if not self._pending_keys.get(key_id, key_id in self._index):
+                raise KeyError(key_id)
+            future = self._append(key_id, None)
+        self._wait_for_commit(future)
+        self._maybe_schedule_compaction()
+
+    def __contains__(self, key_id: object) -> bool:
+        self._ensure_open()
+        self.refresh()
+        with self._lock:
+            if key_id in self._pending_keys:
+                return self._pending_keys[key_id]
+            return key_id in self._index
+
+    def _live_keys(self) -> list:
+        with self._lock:
+            keys = [key_id for key_id in self._index if self._pending_keys.get(key_id, True)]
+            keys.extend(key_id for key_id, live in self._pending_keys.items() if live and key_id not in self._index)
+            return keys
+
+    def __iter__(self):
+        self._ensure_open()
+        self.refresh()
+        return iter(self._live_keys())
+
+    def __len__(self) -> int:
+        self._ensure_open()
+        self.refresh()
+        return len(self._live_keys())
+
+    # --- Compaction ---
+
+    def _maybe_schedule_compaction(self) -> None:
+        if self._dead_bytes < self.min_compaction_bytes:
+            return
+        if self._dead_bytes / max(self._end, 1) < self.compaction_threshold:
+            return
+        if not self.background_compaction:
+            self.compact()
+            return
+        if self._compaction_thread is None or not self._compaction_thread.is_alive():
+            self._compaction_thread = threading.Thread(target=self.compact, daemon=True)
+            self._compaction_thread.start()
+
+    def compact(self) -> None:
+        """
+        Rewrites the log keeping only the latest record for each live key.
+
+        Live records are copied as raw encrypted bytes (nothing is decrypted). The bulk
+        copy runs without holding the lock; records appended meanwhile are copied in a
+        short second phase under the lock before the new log atomically replaces the old.
+        """
+        with self._compaction_lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        self._ensure_open()
+        with self._file_lock, self._io_lock:
+            changed = self._write_pending_locked()
+            with self._lock:
+                snapshot = sorted(self._index.values())
+                snapshot_end = self._end
+                snapshot_inode = os.fstat(self._reader.fileno()).st_ino
+        self._notify_changes(changed)
+        tmp_path = self.path + ".compact"
+        new_index = {}
+        changed = set()
+        try:
+            with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                dst.write(LOG_MAGIC)
+                position = len(LOG_MAGIC)
+                for offset, record_len in snapshot:
+                    src.seek(offset)
+                    raw = src.read(record_len)
+                    key_len = _RECORD_HEADER.unpack_from(raw)[1]
+                    key_id = raw[_RECORD_HEADER.size:_RECORD_HEADER.size + key_len].decode('utf-8')
+                    dst.write(raw)
+                    new_index[key_id] = (position, record_len)
+                    position += record_len
+                with self._file_lock, self._io_lock:
+                    # Carry over records appended (by this or other processes) while the
+                    # snapshot was being copied.
+                    changed = self._write_pending_locked()
+                    with self._lock:
+                        if os.fstat(self._reader.fileno()).st_ino != snapshot_inode:
+                            # Another process compacted the log in the meantime.
+                            dst.close()
+                            os.remove(tmp_path)
+                            return
+                        src.seek(snapshot_end)
+                        tail = src.read(self._end - snapshot_end)
+                        live_keys = set(self._index)
+                        new_index = {key_id: entry for key_id, entry in new_index.items()
+                                     if key_id in live_keys and self._index[key_id][0] < snapshot_end}
+                        tail_offset = 0
+                        while tail_offset < len(tail):
+                            payload_len, key_len, _ = _RECORD_HEADER.unpack_from(tail, tail_offset)
+                            record_len = _RECORD_HEADER.size + key_len + payload_len
+                            key_start = tail_offset + _RECORD_HEADER.size
+                            key_id = tail[key_start:key_start + key_len].decode('utf-8')
+                            if self._index.get(key_id) == (snapshot_end + tail_offset, record_len):
+                                dst.write(tail[tail_offset:tail_offset + record_len])
+                                new_index[key_id] = (position, record_len)
+                                position += record_len
+                            tail_offset += record_len
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                        with self._file_rw.write():
+                            self._reader.close()
+                            self._writer.close()
+                            os.replace(tmp_path, self.path)
+                            self._reader = open(self.path, 'rb')
+                            self._writer = open(self.path, 'ab')
+                            # Swapped together with the file, so readers never pair them up wrongly.
+                            self._index = new_index
+                        self._end = position
+                        self._dead_bytes = 0
+        finally:
+            # Records of other processes picked up in the second phase are reported too.
+            self._notify_changes(changed)
+
+    def close(self) -> None:
+        """
+        Commits queued records, waits for any running compaction and closes the log files.
+        """
+        thread = self._compaction_thread
+        if thread is not None and thread.is_alive():
+            thread.join()
+        if self._opened:
+            self._flush_pending()
+        with self._lock, self._file_rw.write():
+            self._commit_cond.notify_all()
+            if self._reader:
+                self._reader.close()
+            if self._writer:
+                self._writer.close()
+            self._reader = None
+            self._writer = None
+            self._opened = False
+            self._cache.clear()
@@ -0,0 +1,209 @@
+"""
+This module provides per-key usage counters for the KMS (operation counts and bytes
+processed per operation type). Counters are accumulated in per-thread shards, so
+recording usage on the encrypt/decrypt/sign/verify hot paths takes no lock. A
+background thread periodically adds the accumulated deltas to the key records in the
+key store and reports keys that have crossed their usage thresholds.
+"""
+import threading
+import time
+import weakref
+
+
+class _UsageShard:
+    """
+    Cumulative counters written only by the thread that owns the shard.
+    counts maps (key_id, operation) -> [operations, bytes]. The flusher only reads
+    them and remembers what it has already flushed, so no update is ever lost.
+    """
+    __slots__ = ("counts", "flushed", "thread")
+
+    def __init__(self, thread: threading.Thread):
+        self.counts = {}
+        self.flushed = {}  # (key_id, operation) -> (operations, bytes) already flushed
+        self.thread = weakref.ref(thread)
+
+    def is_orphaned(self) -> bool:
+        """
+        True once the owning thread has exited and every count has been flushed.
+        """
+        thread = self.thread()
+        if thread is not None and thread.is_alive():
+            return False
+        return all(self.flushed.get(counter_key) == (counters[0], counters[1])
+                   for counter_key, counters in self.counts.items())
+
+
+class KeyUsageCounters:
+    """
+    Accumulates key usage in per-thread shards and flushes it to the key store.
+
+    Args:
+        kms: The KMS whose key store receives the flushed usage.
+        flush_interval (float): Seconds between background flushes.
+        max_operations (int): Operations per key version after which listeners are notified.
+        max_bytes (int): Bytes per key version after which listeners are notified.
+    """
+
+    def __init__(self, kms, flush_interval: float = 5.0, max_operations: int = None, max_bytes: int = None):
+        self.kms = kms
+        self.flush_interval = flush_interval
+        self.max_operations = max_operations
+        self.max_bytes = max_bytes
+        self.threshold_listeners = []
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._triggered = set()
+        self._flusher = None
+        self._stop = threading.Event()
+
+    def record(self, key_id: str, operation: str, nbytes: int) -> None:
+        """
+        Records one operation on `key_id` processing `nbytes` bytes. Lock-free except
+        for the first call on each thread, which registers the thread's shard.
+        """
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._register_shard()
+        counters = shard.counts.get((key_id, operation))
+        if counters is None:
+            counters = shard.counts[(key_id, operation)] = [0, 0]
+        counters[0] += 1
+        counters[1] += nbytes
+        if self._flusher is None:
+            self._start_flusher()
+
+    def _register_shard(self) -> _UsageShard:
+        shard = _UsageShard(threading.current_thread())
+        with self._shards_lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+
+    def _start_flusher(self) -> None:
+        with self._shards_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="KeyUsageFlusher")
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing key usage counters: {e}")
+
+    def stop(self) -> None:
+        """
+        Stops the background flusher after a final flush.
+        """
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def _collect_deltas(self) -> dict:
+        """
+        Returns unflushed usage per key: key_id -> {operation: [operations, bytes]},
+        together with the shard positions to mark as flushed once it is persisted.
+        """
+        with self._shards_lock:
+            shards = list(self._shards)
+        deltas, positions = {}, []
+        for shard in shards:
+            for counter_key, counters in list(shard.counts.items()):
+                operations, nbytes = counters[0], counters[1]
+                flushed_operations, flushed_bytes = shard.flushed.get(counter_key, (0, 0))
+                if operations == flushed_operations:
+                    continue
+                key_id, operation = counter_key
+                delta = deltas.setdefault(key_id, {}).setdefault(operation, [0, 0])
+                delta[0] += operations - flushed_operations
+                delta[1] += nbytes - flushed_bytes
+                positions.append((shard, counter_key, (operations, nbytes)))
+        return deltas, positions
+
+    @staticmethod
+    def _merge_usage(usage: dict | None, delta: dict) -> dict:
+        usage = {"operations": 0, "bytes": 0, "by_operation": {}} if usage is None else {
+            "operations": usage["operations"], "bytes": usage["bytes"], "by_operation": dict(usage["by_operation"])}
+        for operation, (operations, nbytes) in delta.items():
+            usage["operations"] += operations
+            usage["bytes"] += nbytes
+            previous = usage["by_operation"].get(operation, {"operations": 0, "bytes": 0})
+            usage["by_operation"][operation] = {"operations": previous["operations"] + operations,
+                                                "bytes": previous["bytes"] + nbytes}
+        usage["updated_at"] = time.time()
+        return usage
+
+    def flush(self) -> int:
+        """
+        Adds all unflushed usage to the key records in one key store transaction.
+        Returns the number of keys updated.
+        """
+        with self._flush_lock:
+            deltas, positions = self._collect_deltas()
+            if not deltas:
+                return 0
+            crossed = []
+            with self.kms.bulk():
+                for key_id, delta in deltas.items():
+                    key_info = self.kms.get_key(key_id)
+                    if key_info is None:
+                        continue
+                    key_info = dict(key_info)
+                    key_info["usage"] = self._merge_usage(key_info.get("usage"), delta)
+                    self.kms._put_key(key_id, key_info)
+                    if self._over_threshold(key_info["usage"]) and key_id not in self._triggered:
+                        self._triggered.add(key_id)
+                        crossed.append((key_id, key_info["usage"]))
+            for shard, counter_key, position in positions:
+                shard.flushed[counter_key] = position
+            self._reap_shards()
+        for key_id, usage in crossed:
+            for listener in list(self.threshold_listeners):
+                try:
+                    listener(key_id, usage)
+                except Exception as e:
+                    print(f"Error in key usage threshold listener: {e}")
+        return len(deltas)
+
+    def _reap_shards(self) -> None:
+        """
+        Drops the shards of exited threads once their counts are persisted, so
+        short-lived threads do not leave shards behind for every later flush to scan.
+        """
+        with self._shards_lock:
+            self._shards = [shard for shard in self._shards if not shard.is_orphaned()]
+
+    def _over_threshold(self, usage: dict) -> bool:
+        return ((self.max_operations is not None and usage["operations"] >= self.max_operations)
+                or (self.max_bytes is not None and usage["bytes"] >= self.max_bytes))
+
+    def get_usage(self, key_id: str) -> dict:
+        """
+        Returns the usage of a key: the flushed totals from the key store plus the
+        usage still accumulated in memory.
+        """
+        key_info = self.kms.get_key(key_id)
+        if key_info is None:
+            raise ValueError(f"Key with ID '{key_id}' not found.")
+        pending = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # Every recorded operation type counts (encrypt, decrypt, sign, verify, blind_index, ...).
+            for (counted_key_id, operation), counters in list(shard.counts.items()):
+                if counted_key_id != key_id:
+                    continue
+                operations, nbytes = counters[0], counters[1]
+                flushed_operations, flushed_bytes = shard.flushed.get((key_id, operation), (0, 0))
+                delta = pending.setdefault(operation, [0, 0])
+                delta[0] += operations - flushed_operations
+                delta[1] += nbytes - flushed_bytes
+        usage = self._merge_usage(key_info.get("usage"), pending)
+        usage.pop("updated_at")
+        return usage
@@ -88,6 +88,36 @@ def receive_message(recipient_id: str, data_id: str) -> None:
     print(f"Decrypted message: {decrypted_message.decode('utf-8')}")
 
 
+def list_inbox(recipient_id: str, cursor: str = None, limit: int = 50) -> dict:
+    """Lists the messages sent to a recipient, oldest first, one page at a time.
+
+    Messages are found through the metadata index on recipient_username, so building
+    an inbox does not scan other users' messages.
+
+    Args:
+        recipient_id (str): The username of the recipient.
+        cursor (str): The next_cursor of the previous page, if any.
+        limit (int): The maximum number of messages per page.
+
+    Returns:
+        dict: {"messages": [...], "next_cursor": str or None}, where each message has
+              data_id, sender_username, created_at and original_message_length.
+    """
+    recipient_user = get_user_by_username(recipient_id)
+    if not recipient_user:
+        raise ValueError(f"Recipient user '{recipient_id}' not found.")
+
+    page = data_manager.query_by_metadata({"recipient_username": recipient_id}, cursor=cursor, limit=limit,
+                                          data_type="secure_message")
+    messages = [{
+        "data_id": item["data_id"],
+        "sender_username": item["encryption_metadata"].get("sender_username"),
+        "created_at": item["created_at"],
+        "original_message_length": item["encryption_metadata"].get("original_message_length"),
+    } for item in page["items"]]
+    return {"messages": messages, "next_cursor": page["next_cursor"]}
+
+
 def main():
     """Main function to parse arguments and run the secure messaging application."""
     parser = argparse.ArgumentParser(
@@ -0,0 +1,356 @@
+"""
+This module provides the storage backends behind DataManager and auth.
+
+PostgresBackend (the default) uses the pooled PostgreSQL connections from
+src.database. SQLiteBackend stores the same schema in an embedded SQLite database,
+for single-node edge deployments, CI and local benchmarking without external
+services. Both hand out DB-API connections whose cursors take `%s` placeholders, so
+the data-access code is shared between them.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2.extras import execute_values
+from src.config import Config
+from src.database import db_connection, drop_encrypted_data_partitions_before, ensure_encrypted_data_partitions
+
+
+class PostgresBackend:
+    """
+    PostgreSQL through the process-wide connection pool.
+    """
+    name = "postgresql"
+    errors = psycopg2.Error
+    supports_copy = True  # binary COPY FROM STDIN
+
+    def connection(self):
+        return db_connection()
+
+    def execute_values(self, cur, query, rows, page_size=100, fetch=False):
+        return execute_values(cur, query, rows, page_size=page_size, fetch=fetch)
+
+    def init_schema(self):
+        from src.database import init_db
+        init_db()
+
+    def ensure_partitions(self, months_ahead: int = None) -> list:
+        return ensure_encrypted_data_partitions(months_ahead)
+
+    def blind_index_condition(self, tokens: list) -> tuple[str, list]:
+        """
+        Returns an SQL condition (and its parameters) matching rows whose blind_indexes
+        contain any of `tokens`; it is served by the GIN index on blind_indexes.
+        """
+        return "blind_indexes && %s::text[]", [list(tokens)]
+
+    def metadata_condition(self, filters: dict) -> tuple[str, list]:
+        """
+        Returns an SQL condition (and its parameters) matching rows whose
+        encryption_metadata contains `filters`; it is served by the jsonb_path_ops GIN index.
+        """
+        return "encryption_metadata @> %s::jsonb", [json.dumps(filters)]
+
+    def metadata_field(self, key: str) -> tuple[str, list]:
+        """
+        Returns an SQL expression (and its parameters) for the top-level `key` of
+        encryption_metadata as text.
+        """
+        return "encryption_metadata->>%s", [key]
+
+    def expire_encrypted_data(self, cutoff: datetime.datetime, detach_only: bool = False) -> dict:
+        """
+        Drops (or detaches) the monthly partitions that only hold rows created before
+        `cutoff`. Rows in the partition that contains `cutoff` are kept until it expires.
+        """
+        removed = drop_encrypted_data_partitions_before(cutoff, detach_only)
+        return {"partitions": removed, "deleted_rows": 0}
+
+
+# ISO-8601 UTC timestamps with millisecond precision. Stored as text, they sort
+# chronologically, which keyset pagination on (created_at, data_id) relies on.
+_SQLITE_NOW = "strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')"
+# Random (version 4) UUID, so inserts can rely on a server-side default like uuid_generate_v4().
+_SQLITE_UUID4 = ("lower(hex(randomblob(4)) || '-' || hex(randomblob(2)) || '-4' || substr(hex(randomblob(2)), 2) || '-' || "
+                 "substr('89ab', 1 + (abs(random()) % 4), 1) || substr(hex(randomblob(2)), 2) || '-' || hex(randomblob(6)))")
+
+# The schema of database.init_db, in SQLite types. JSONB and TIMESTAMPTZ columns are
+# decoded by the converters registered below.
+SQLITE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    role VARCHAR(50) NOT NULL DEFAULT 'user'
+);
+
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    display_name VARCHAR(100) NOT NULL,
+    profile_picture_url VARCHAR(255),
+    preferences JSONB,
+    created_at TIMESTAMPTZ DEFAULT ({_SQLITE_NOW}),
+    updated_at TIMESTAMPTZ DEFAULT ({_SQLITE_NOW})
+);
+
+CREATE TABLE IF NOT EXISTS encrypted_data_store (
+    data_id TEXT PRIMARY KEY DEFAULT ({_SQLITE_UUID4}),
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    data_type VARCHAR(50) NOT NULL,
+    encrypted_content BLOB NOT NULL,
+    encryption_metadata JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT ({_SQLITE_NOW}),
+    updated_at TIMESTAMPTZ DEFAULT ({_SQLITE_NOW}),
+    blind_indexes JSONB
+);
+
+CREATE TABLE IF NOT EXISTS encrypted_data_chunks (
+    data_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    chunk BLOB NOT NULL,
+    PRIMARY KEY (data_id, seq)
+);
+
+CREATE INDEX IF NOT EXISTS idx_encrypted_data_user_created
+    ON encrypted_data_store (user_id, created_at, data_id, data_type);
+CREATE INDEX IF NOT EXISTS idx_encrypted_data_user_type_created
+    ON encrypted_data_store (user_id, data_type, created_at, data_id);
+"""
+
+sqlite3.register_converter("JSONB", json.loads)
+sqlite3.register_converter("TIMESTAMPTZ", lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+
+def _to_sqlite_param(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return f"{value:%Y-%m-%dT%H:%M:%S}.{value.microsecond // 1000:03d}+00:00"
+    if isinstance(value, memoryview):
+        return bytes(value)
+    if isinstance(value, list):
+        return json.dumps(value)  # arrays (e.g. blind_indexes) are stored as JSON
+    return value
+
+
+class _SQLiteCursor:
+    """
+    Wraps a sqlite3 cursor to accept PostgreSQL-style `%s` placeholders and parameters.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.itersize = 2000  # accepted for compatibility; sqlite3 cursors already step lazily
+
+    @staticmethod
+    def _translate(query):
+        return query.replace("%s", "?").replace("CURRENT_TIMESTAMP", _SQLITE_NOW)
+
+    def execute(self, query, params=()):
+        self._cursor.execute(self._translate(query), [_to_sqlite_param(p) for p in params])
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(self._translate(query), ([_to_sqlite_param(p) for p in row] for row in rows))
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(self.itersize if size is None else size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class _SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+        self.closed = False
+
+    def cursor(self, name=None):
+        # Named (server-side) cursors have no SQLite equivalent; plain cursors already stream.
+        return _SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+
+class SQLiteBackend:
+    """
+    An embedded SQLite database with the same schema as init_db.
+
+    Each thread gets its own connection (sqlite3 connections must not be shared across
+    threads). Databases run in WAL mode, so readers do not block the writer, with
+    synchronous=NORMAL. sqlite3 keeps the compiled form of recently used statements per
+    connection, so the fixed SQL of the data layer is prepared once per thread.
+    """
+    name = "sqlite"
+    errors = sqlite3.Error
+    supports_copy = False
+
+    def __init__(self, path: str, busy_timeout: float = 5.0, cached_statements: int = 256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.init_schema()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                               cached_statements=self.cached_statements, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _thread_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _SQLiteConnection(self._connect())
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Yields this thread's connection. Uncommitted work is rolled back on exit, as when
+        a pooled PostgreSQL connection is returned.
+        """
+        conn = self._thread_connection()
+        try:
+            yield conn
+        finally:
+            if conn._conn.in_transaction:
+                conn.rollback()
+
+    def execute_values(self, cur, query, rows, page_size=100, fetch=False):
+        """
+        Runs a psycopg2-style `VALUES %s` statement once per row (within the caller's
+        transaction) and returns the RETURNING rows if `fetch` is set.
+        """
+        results = []
+        for row in rows:
+            cur.execute(query.replace("VALUES %s", "VALUES (" + ", ".join(["%s"] * len(row)) + ")"), row)
+            if fetch:
+                results.extend(cur.fetchall())
+        return results if fetch else None
+
+    def init_schema(self):
+        with self.connection() as conn:
+            conn._conn.executescript(SQLITE_SCHEMA)
+            # Databases created before blind indexes were introduced lack the column.
+            columns = {row[1] for row in conn._conn.execute("PRAGMA table_info(encrypted_data_store)")}
+            if "blind_indexes" not in columns:
+                conn._conn.execute("ALTER TABLE encrypted_data_store ADD COLUMN blind_indexes JSONB")
+                conn.commit()
+
+    def ensure_partitions(self, months_ahead: int = None) -> list:
+        # SQLite has no table partitioning; expiry deletes rows instead.
+        return []
+
+    def blind_index_condition(self, tokens: list) -> tuple[str, list]:
+        """
+        Returns an SQL condition (and its parameters) matching rows whose blind_indexes
+        contain any of `tokens`. SQLite has no array index; the condition is evaluated
+        on the rows selected by the other (indexed) conditions, such as user_id.
+        """
+        placeholders = ", ".join(["%s"] * len(tokens))
+        return (f"EXISTS (SELECT 1 FROM json_each(encrypted_data_store.blind_indexes) WHERE value IN ({placeholders}))",
+                list(tokens))
+
+    def metadata_condition(self, filters: dict) -> tuple[str, list]:
+        """
+        Returns an SQL condition (and its parameters) matching rows whose
+        encryption_metadata has the given top-level values. Nested objects and arrays
+        must match exactly (PostgreSQL's @> also matches subsets of them).
+        """
+        conditions, params = [], []
+        for key, value in filters.items():
+            path = '$."' + key.replace('"', '\\"') + '"'
+            if value is None:
+                conditions.append("json_type(encryption_metadata, %s) = 'null'")
+                params.append(path)
+            elif isinstance(value, (dict, list)):
+                conditions.append("json(json_extract(encryption_metadata, %s)) = json(%s)")
+                params += [path, json.dumps(value)]
+            else:
+                conditions.append("json_extract(encryption_metadata, %s) = %s")
+                params += [path, int(value) if isinstance(value, bool) else value]
+        return " AND ".join(conditions), params
+
+    def metadata_field(self, key: str) -> tuple[str, list]:
+        """
+        Returns an SQL expression (and its parameters) for the top-level `key` of
+        encryption_metadata.
+        """
+        return "json_extract(encryption_metadata, %s)", ['$."' + key.replace('"', '\\"') + '"']
+
+    def expire_encrypted_data(self, cutoff: datetime.datetime, detach_only: bool = False) -> dict:
+        """
+        Deletes the rows (and chunks) created before `cutoff`. `detach_only` has no
+        meaning without partitions and is ignored.
+        """
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM encrypted_data_chunks WHERE data_id IN "
+                        "(SELECT data_id FROM encrypted_data_store WHERE created_at < %s)", (cutoff,))
+            cur.execute("DELETE FROM encrypted_data_store WHERE created_at < %s", (cutoff,))
+            deleted = cur.rowcount
+            conn.commit()
+            cur.close()
+        return {"partitions": [], "deleted_rows": deleted}
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the process-wide storage backend selected by Config.STORAGE_BACKEND
+    ("postgresql" or "sqlite"; SQLite databases are stored at Config.SQLITE_PATH).
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if Config.STORAGE_BACKEND == "sqlite":
+                _backend = SQLiteBackend(Config.SQLITE_PATH)
+            elif Config.STORAGE_BACKEND == "postgresql":
+                _backend = PostgresBackend()
+            else:
+                raise ValueError(f"Unknown storage backend '{Config.STORAGE_BACKEND}'.")
+        return _backend
+
+
+def set_backend(backend) -> None:
+    """
+    Replaces the process-wide storage backend (e.g. an SQLiteBackend in tests).
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -1,5 +1,12 @@
 import unittest
+import json
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+from flask import send_file
 from src.api_server import app # Assuming 'app' is the Flask/FastAPI app instance
+from src.kms_api import KMS
 
 class TestAPIServer(unittest.TestCase):
     def setUp(self):
@@ -14,7 +21,93 @@ class TestAPIServer(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         # self.assertIn(b'Welcome', response.data) # Example assertion for content
 
+    @patch('src.api_server.kms')
+    def test_generate_bulk_streams_key_ids(self, mock_kms):
+        mock_kms.generate_keys_bulk.return_value = ['tenant_a', 'tenant_b']
+        specs = [{'key_id': 'tenant_a', 'type': 'Symmetric'}, {'key_id': 'tenant_b', 'type': 'PQC'}]
+        response = self.app.post('/api/kms/generate_bulk', json={'keys': specs})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+        self.assertEqual(lines, [{'key_id': 'tenant_a'}, {'key_id': 'tenant_b'}])
+        mock_kms.generate_keys_bulk.assert_called_once_with(specs)
+
+    def test_generate_bulk_requires_keys(self):
+        response = self.app.post('/api/kms/generate_bulk', json={})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('src.api_server.data_manager')
+    @patch('src.api_server.kms')
+    def test_stream_upload_and_download(self, mock_kms, mock_data_manager):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            kms = KMS(key_store_path=os.path.join(temp_dir, "kms_key_store.json"))
+            kms.generate_symmetric_key('blob_key')
+            mock_kms.encrypt_stream.side_effect = kms.encrypt_stream
+            mock_kms.decrypt_stream.side_effect = kms.decrypt_stream
+            stored = {}
+
+            def store_encrypted_chunks(user_id, data_type, chunks, encryption_metadata):
+                stored['chunks'] = list(chunks)
+                stored['metadata'] = encryption_metadata
+                return 'data-1'
+            mock_data_manager.store_encrypted_chunks.side_effect = store_encrypted_chunks
+
+            payload = os.urandom(2500)
+            with patch('src.api_server.STREAM_CHUNK_SIZE', 1000):
+                response = self.app.post('/api/data/stream?user_id=1&data_type=file&kms_key_id=blob_key',
+                                         data=payload, content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(stored['chunks']), 3)
+            self.assertEqual(stored['metadata']['format'], 'stream')
+
+            mock_data_manager.retrieve_encrypted_data.return_value = {'encryption_metadata': stored['metadata']}
+            mock_data_manager.iter_encrypted_chunks.return_value = iter(stored['chunks'])
+            response = self.app.get('/api/data/data-1/stream')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/octet-stream')
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(response.data, payload)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @patch('src.api_server.data_manager')
+    def test_list_user_data_is_paginated(self, mock_data_manager):
+        mock_data_manager.list_encrypted_data_page.return_value = {
+            'items': [{'data_id': 'd1', 'data_type': 'file', 'created_at': None}], 'next_cursor': 'abc'}
+        response = self.app.get('/api/data/user/7?limit=1&cursor=xyz&data_type=file')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['next_cursor'], 'abc')
+        self.assertEqual(len(response.get_json()['data_list']), 1)
+        mock_data_manager.list_encrypted_data_page.assert_called_once_with(7, 'file', limit=1, cursor='xyz')
+
+        mock_data_manager.list_encrypted_data_page.side_effect = ValueError("Invalid pagination cursor.")
+        self.assertEqual(self.app.get('/api/data/user/7?cursor=bad').status_code, 400)
+        self.assertEqual(self.app.get('/api/data/user/7?limit=0').status_code, 400)
+
     # Add more test methods for other API endpoints and functionalities
+    @patch('src.api_server.data_manager')
+    def test_encrypted_content_is_served_raw(self, mock_data_manager):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            blob_path = os.path.join(temp_dir, "blob")
+            with open(blob_path, "wb") as f:
+                f.write(b"spilled ciphertext")
+            mock_data_manager.locate_encrypted_content.side_effect = {
+                'inline': (b"inline ciphertext", None), 'spilled': (None, blob_path), 'missing': None}.get
+
+            response = self.app.get('/api/data/inline/content')
+            self.assertEqual(response.data, b"inline ciphertext")
+            self.assertEqual(response.mimetype, 'application/octet-stream')
+            with patch('src.api_server.send_file', wraps=send_file) as mock_send_file:
+                response = self.app.get('/api/data/spilled/content')
+                self.assertEqual(response.data, b"spilled ciphertext")
+                response.close()
+            self.assertEqual(mock_send_file.call_args[0][0], blob_path)
+            self.assertEqual(self.app.get('/api/data/missing/content').status_code, 404)
+        finally:
+            shutil.rmtree(temp_dir)
+
     # def test_some_other_endpoint(self):
     #     response = self.app.post('/api/data', json={'key': 'value'})
     #     self.assertEqual(response.status_code, 200)
@@ -0,0 +1,246 @@
+import unittest
+import asyncio
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from contextlib import asynccontextmanager
+from unittest.mock import patch
+from src.async_data_manager import AsyncDataManager
+from src.auth import user_cache
+from src.data_manager import DataManager, profile_cache
+from src.kms_api import KMS
+from src.blob_store import BlobStore
+from src.storage_backends import SQLITE_SCHEMA, SQLiteBackend, _to_sqlite_param
+
+# A SQLite stand-in for an asyncpg pool, so the async layer can be tested without a
+# PostgreSQL server. Queries run in worker threads via asyncio.to_thread; asyncpg's
+# $n placeholders are rewritten to SQLite's positional ? placeholders. The schema and
+# parameter conversion are those of the synchronous SQLiteBackend.
+class SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    @staticmethod
+    def _translate(query, args=()):
+        positions = [int(n) - 1 for n in re.findall(r"\$(\d+)", query)]
+        return re.sub(r"\$\d+", "?", query), [_to_sqlite_param(args[i]) for i in positions]
+
+    @staticmethod
+    def _convert(records):
+        return [[_to_sqlite_param(value) for value in record] for record in records]
+
+    def _run(self, query, args, fetch):
+        cur = self._conn.execute(*self._translate(query, args))
+        return cur.fetchall() if fetch else None
+
+    async def execute(self, query, *args):
+        await asyncio.to_thread(self._run, query, args, False)
+
+    async def executemany(self, query, records):
+        await asyncio.to_thread(self._conn.executemany, re.sub(r"\$\d+", "?", query), self._convert(records))
+
+    async def fetch(self, query, *args):
+        return await asyncio.to_thread(self._run, query, args, True)
+
+    async def fetchrow(self, query, *args):
+        rows = await self.fetch(query, *args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, query, *args):
+        row = await self.fetchrow(query, *args)
+        return row[0] if row else None
+
+    async def copy_records_to_table(self, table, records, columns):
+        placeholders = ", ".join("?" for _ in columns)
+        await asyncio.to_thread(self._conn.executemany,
+                                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                                self._convert(records))
+
+    @asynccontextmanager
+    async def transaction(self):
+        await self.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            await self.execute("ROLLBACK")
+            raise
+        await self.execute("COMMIT")
+
+    async def cursor(self, query, *args, prefetch=50):
+        cur = await asyncio.to_thread(self._conn.execute, *self._translate(query, args))
+        while True:
+            rows = await asyncio.to_thread(cur.fetchmany, prefetch)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+
+class SQLitePool:
+    def __init__(self, path):
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.executescript(SQLITE_SCHEMA)
+        self._conn = SQLiteConnection(conn)
+        self._lock = asyncio.Lock()
+        self._raw = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._lock:
+            yield self._conn
+
+    async def close(self):
+        self._raw.close()
+
+
+@patch('src.async_data_manager.hash_password', side_effect=lambda password: "hashed:" + password)
+@patch('src.async_data_manager.check_password', side_effect=lambda password, hashed: hashed == "hashed:" + password)
+class TestAsyncDataManager(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.data = AsyncDataManager(SQLitePool(os.path.join(self.temp_dir, "test.db")), errors=(sqlite3.Error,))
+        user_cache.clear()
+        profile_cache.clear()
+
+    async def asyncTearDown(self):
+        await self.data.close()
+        shutil.rmtree(self.temp_dir)
+        user_cache.clear()
+        profile_cache.clear()
+
+    async def test_create_and_authenticate_user(self, mock_check, mock_hash):
+        user_id = await self.data.create_user("alice", "s3cret")
+        self.assertIsNotNone(user_id)
+        self.assertEqual((await self.data.authenticate_user("alice", "s3cret"))["id"], user_id)
+        self.assertIsNone(await self.data.authenticate_user("alice", "wrong"))
+        self.assertIsNone(await self.data.create_user("alice", "again"))  # duplicate username
+
+        profile = await self.data.get_user_profile(user_id)
+        self.assertEqual(profile["display_name"], "alice")
+        self.assertTrue(await self.data.update_user_profile(user_id, preferences={"theme": "dark"}))
+        self.assertEqual((await self.data.get_user_profile(user_id))["preferences"], {"theme": "dark"})
+        self.assertTrue(await self.data.delete_user_profile(user_id))
+        self.assertIsNone(await self.data.get_user_profile(user_id))
+
+    async def test_user_lookups_are_cached(self, mock_check, mock_hash):
+        user_id = await self.data.create_user("bob", "pw")
+        with patch.object(self.data, "_load_user_by_username", wraps=self.data._load_user_by_username) as load:
+            self.assertEqual((await self.data.get_user_by_username("bob"))["id"], user_id)
+            self.assertEqual((await self.data.get_user_by_username("bob"))["id"], user_id)
+            self.assertIsNone(await self.data.get_user_by_username("nobody"))
+        self.assertEqual(load.call_count, 2)
+
+        with patch.object(self.data, "_load_user_profile", wraps=self.data._load_user_profile) as load:
+            self.assertEqual((await self.data.get_user_profile(user_id))["display_name"], "bob")
+            self.assertEqual((await self.data.get_user_profile(user_id))["display_name"], "bob")
+            self.assertEqual(load.call_count, 1)
+            # Writes invalidate the shared entry.
+            await self.data.update_user_profile(user_id, display_name="Bob")
+            self.assertEqual((await self.data.get_user_profile(user_id))["display_name"], "Bob")
+        self.assertEqual(load.call_count, 2)
+
+    async def test_store_retrieve_and_delete_encrypted_data(self, mock_check, mock_hash):
+        data_id = await self.data.store_encrypted_data(1, "message", b"\x01\x02", {"alg": "A"})
+        data = await self.data.retrieve_encrypted_data(data_id)
+        self.assertEqual(data["encrypted_content"], b"\x01\x02")
+        self.assertEqual(data["encryption_metadata"], {"alg": "A"})
+        self.assertTrue(await self.data.delete_encrypted_data(data_id))
+        self.assertIsNone(await self.data.retrieve_encrypted_data(data_id))
+
+    async def test_large_payloads_spill_to_blob_store(self, mock_check, mock_hash):
+        self.data.blob_store = BlobStore(os.path.join(self.temp_dir, "blobs"))
+        self.data.blob_threshold = 16
+        payload = bytes(range(64))
+        data_id = await self.data.store_encrypted_data(1, "file", payload, {"alg": "A"})
+        data = await self.data.retrieve_encrypted_data(data_id)
+        self.assertEqual(data["encrypted_content"], payload)
+        self.assertEqual(data["encryption_metadata"]["storage"], "blob")
+        self.assertTrue(self.data.blob_store.exists(data["encryption_metadata"]["blob_digest"]))
+
+        batch_ids = await self.data.store_encrypted_data_many([(1, "file", payload, {}), (1, "file", b"small", {})])
+        copied_ids = await self.data.copy_encrypted_data([(1, "file", payload, {})])
+        for data_id, expected, storage in zip(batch_ids + copied_ids, [payload, b"small", payload], ["blob", None, "blob"]):
+            data = await self.data.retrieve_encrypted_data(data_id)
+            self.assertEqual(data["encryption_metadata"].get("storage"), storage)
+            self.assertEqual(data["encrypted_content"], expected)
+
+    async def test_searchable_fields_are_blind_indexed(self, mock_check, mock_hash):
+        kms = KMS(key_store_path=os.path.join(self.temp_dir, "kms_key_store.json"))
+        kms.generate_symmetric_key("blind_index_key")
+        self.data.kms = kms
+        fields = {"email": "carol@example.com"}
+        single = await self.data.store_encrypted_data(1, "contact", b"c1", {}, fields)
+        batch = await self.data.store_encrypted_data_many([(1, "contact", b"c2", {}, fields), (1, "contact", b"c3", {})])
+        copied = await self.data.copy_encrypted_data([(1, "note", b"n1", {}, fields)])
+
+        # The tokens are the ones the synchronous layer writes and searches for.
+        backend = SQLiteBackend(os.path.join(self.temp_dir, "test.db"))
+        found = DataManager(backend=backend, kms=kms).find_encrypted_data(1, "email", "carol@example.com")
+        backend.close()
+        self.assertEqual(sorted(item["data_id"] for item in found), sorted([single, batch[0], copied[0]]))
+
+        self.data.kms = None
+        with self.assertRaises(ValueError):
+            await self.data.store_encrypted_data(1, "contact", b"c4", {}, fields)
+
+    async def test_bulk_inserts_and_pagination(self, mock_check, mock_hash):
+        first_ids = await self.data.store_encrypted_data_many([(1, "message", b"m", {}) for _ in range(3)])
+        copied_ids = await self.data.copy_encrypted_data(((1, "file", b"f", {}) for _ in range(4)), chunk_size=3)
+        self.assertEqual(len(first_ids), 3)
+        self.assertEqual(len(copied_ids), 4)
+
+        seen, cursor = [], None
+        while True:
+            page = await self.data.list_encrypted_data_page(1, limit=3, cursor=cursor)
+            seen += [item["data_id"] for item in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), sorted(first_ids + copied_ids))
+        self.assertEqual(len(await self.data.list_encrypted_data_by_user(1, data_type="file")), 4)
+
+    async def test_query_by_metadata(self, mock_check, mock_hash):
+        # SQL conditions come from the backend matching the pool's database.
+        self.data.backend = SQLiteBackend(os.path.join(self.temp_dir, "test.db"))
+        ids = await self.data.store_encrypted_data_many(
+            [(1, "message", b"m%d" % i, {"recipient_username": "bob", "urgent": i == 1}) for i in range(4)]
+            + [(2, "message", b"x", {"recipient_username": "bob"}), (1, "file", b"f", {"recipient_username": "carol"})])
+
+        seen, cursor = [], None
+        while True:
+            page = await self.data.query_by_metadata({"recipient_username": "bob"}, cursor=cursor, limit=2, user_id=1)
+            seen += [item["data_id"] for item in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), sorted(ids[:4]))
+
+        page = await self.data.query_by_metadata({"urgent": True}, include_content=True)
+        self.assertEqual([(item["data_id"], item["encrypted_content"]) for item in page["items"]], [(ids[1], b"m1")])
+        self.assertEqual(page["items"][0]["encryption_metadata"], {"recipient_username": "bob", "urgent": True})
+        self.assertEqual(len((await self.data.query_by_metadata({"recipient_username": "bob"}))["items"]), 5)
+        self.assertEqual((await self.data.query_by_metadata({"recipient_username": "bob"}, data_type="file"))["items"], [])
+        with self.assertRaises(ValueError):
+            await self.data.query_by_metadata({})
+        self.data.backend.close()
+
+    async def test_chunked_storage(self, mock_check, mock_hash):
+        async def chunks():
+            for i in range(5):
+                yield bytes([i]) * 10
+
+        data_id = await self.data.store_encrypted_chunks(1, "file", chunks(), {"format": "stream"}, page_size=2)
+        self.assertEqual((await self.data.retrieve_encrypted_data(data_id))["encryption_metadata"]["chunk_count"], 5)
+        self.assertEqual([chunk async for chunk in self.data.iter_encrypted_chunks(data_id, fetch_size=2)],
+                         [bytes([i]) * 10 for i in range(5)])
+
+    async def test_concurrent_requests(self, mock_check, mock_hash):
+        data_ids = await asyncio.gather(*(self.data.store_encrypted_data(1, "message", bytes([i]), {})
+                                          for i in range(50)))
+        self.assertEqual(len(set(data_ids)), 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,9 +3,10 @@ import datetime
 from unittest.mock import patch, MagicMock
 import jwt
 
-from src.auth import hash_password, check_password, create_user, get_user_by_username, authenticate_user, generate_token, decode_token, verify_token, create_default_admin
+from src.auth import user_cache, hash_password, check_password, create_user, get_user_by_username, authenticate_user, generate_token, decode_token, verify_token, create_default_admin
 from src.config import Config
 from src.database import get_db_connection, init_db
+from src.data_manager import profile_cache
 
 class TestAuth(unittest.TestCase):
     @classmethod
@@ -23,6 +24,9 @@ class TestAuth(unittest.TestCase):
         cur.close()
         conn.close()
         init_db()
+        # Rows are dropped behind the caches' back, so start each test with empty caches.
+        user_cache.clear()
+        profile_cache.clear()
 
     def tearDown(self):
         # Clean up database after each test
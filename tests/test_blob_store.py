@@ -0,0 +1,59 @@
+import unittest
+import hashlib
+import os
+import shutil
+import tempfile
+from src.blob_store import BlobStore
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = BlobStore(os.path.join(self.temp_dir, "blobs"))
+        self.data = os.urandom(300 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_put_is_content_addressed_and_sharded(self):
+        digest = self.store.put(self.data)
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.store.path(digest),
+                         os.path.join(self.temp_dir, "blobs", digest[:2], digest[2:4], digest))
+        self.assertEqual(self.store.put(self.data), digest)
+        self.assertEqual(self.store.size(digest), len(self.data))
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, "blobs", "tmp")), [])
+        self.assertEqual(list(self.store.iter_digests()), [digest])
+        with self.assertRaises(ValueError):
+            self.store.path("../../etc/passwd")
+
+    def test_reads(self):
+        digest, size = self.store.put_stream(self.data[i:i + 4096] for i in range(0, len(self.data), 4096))
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(self.store.read(digest), self.data)
+        with self.store.open_mmap(digest) as view:
+            self.assertEqual(view[:16].tobytes(), self.data[:16])
+        chunks = list(self.store.iter_chunks(digest, chunk_size=100 * 1024))
+        self.assertEqual([len(chunk) for chunk in chunks], [100 * 1024] * 3)
+        self.assertEqual(b"".join(chunks), self.data)
+        self.assertTrue(self.store.verify(digest))
+
+    def test_sendfile(self):
+        digest = self.store.put(self.data)
+        out_path = os.path.join(self.temp_dir, "out")
+        with open(out_path, "wb") as out:
+            self.assertEqual(self.store.sendfile(digest, out.fileno(), offset=10, count=1000), 1000)
+        with open(out_path, "rb") as f:
+            self.assertEqual(f.read(), self.data[10:1010])
+
+    def test_delete_and_verify(self):
+        digest = self.store.put(self.data)
+        with open(self.store.path(digest), "r+b") as f:
+            f.write(b"corrupted")
+        self.assertFalse(self.store.verify(digest))
+        self.assertTrue(self.store.delete(digest))
+        self.assertFalse(self.store.delete(digest))
+        self.assertFalse(self.store.exists(digest))
+        self.assertFalse(self.store.verify(digest))
+
+if __name__ == '__main__':
+    unittest.main()
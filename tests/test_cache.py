@@ -0,0 +1,142 @@
+import unittest
+import asyncio
+import datetime
+import threading
+import time
+from unittest.mock import MagicMock
+from src.cache import ReadThroughCache, InMemoryCacheBackend, RedisCacheBackend
+
+class TestReadThroughCache(unittest.TestCase):
+    def test_hits_after_first_load(self):
+        cache = ReadThroughCache("test")
+        loader = MagicMock(return_value={"id": 1})
+        self.assertEqual(cache.get("alice", loader), {"id": 1})
+        self.assertEqual(cache.get("alice", loader), {"id": 1})
+        loader.assert_called_once()
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_negative_results_use_negative_ttl(self):
+        cache = ReadThroughCache("test", ttl=60, negative_ttl=0.01)
+        loader = MagicMock(return_value=None)
+        self.assertIsNone(cache.get("ghost", loader))
+        self.assertIsNone(cache.get("ghost", loader))
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(cache.get_stats()["negative_hits"], 1)
+        time.sleep(0.02)
+        cache.get("ghost", loader)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_loader_errors_are_not_cached(self):
+        cache = ReadThroughCache("test")
+        loader = MagicMock(side_effect=[RuntimeError("db down"), {"id": 1}])
+        with self.assertRaises(RuntimeError):
+            cache.get("alice", loader)
+        self.assertEqual(cache.get("alice", loader), {"id": 1})
+
+    def test_invalidate(self):
+        cache = ReadThroughCache("test")
+        cache.get("alice", lambda: {"role": "user"})
+        cache.invalidate("alice")
+        self.assertEqual(cache.get("alice", lambda: {"role": "admin"}), {"role": "admin"})
+
+    def test_concurrent_misses_are_coalesced(self):
+        cache = ReadThroughCache("test")
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"id": 1}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("alice", loader))) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while cache.get_stats()["coalesced"] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"id": 1}] * 5)
+
+    def test_invalidation_during_load_is_not_overwritten(self):
+        cache = ReadThroughCache("test")
+
+        def loader():
+            cache.invalidate("alice")  # e.g. a concurrent update committed mid-load
+            return {"version": 1}
+
+        self.assertEqual(cache.get("alice", loader), {"version": 1})
+        self.assertEqual(cache.get("alice", lambda: {"version": 2}), {"version": 2})
+
+    def test_invalidation_while_storing_is_not_overwritten(self):
+        backend = InMemoryCacheBackend()
+        cache = ReadThroughCache("test", backend=backend)
+        real_set = backend.set
+        invalidations = []
+
+        def set_racing_invalidation(key, entry, ttl):
+            # An update commits after the loader returned but before its value is stored.
+            invalidation = threading.Thread(target=cache.invalidate, args=("alice",))
+            invalidation.start()
+            invalidation.join(0.2)
+            invalidations.append(invalidation)
+            real_set(key, entry, ttl)
+
+        backend.set = set_racing_invalidation
+        self.assertEqual(cache.get("alice", lambda: {"version": 1}), {"version": 1})
+        invalidations[0].join()
+        self.assertIsNone(backend.get(cache._key("alice")))
+        backend.set = real_set
+        self.assertEqual(cache.get("alice", lambda: {"version": 2}), {"version": 2})
+
+    def test_get_async_coalesces_concurrent_misses(self):
+        cache = ReadThroughCache("test")
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"id": 1}
+
+        async def lookups():
+            return await asyncio.gather(*(cache.get_async("alice", loader) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(lookups()), [{"id": 1}] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get("alice", MagicMock()), {"id": 1})
+        self.assertEqual(cache.get_stats()["coalesced"], 4)
+
+class TestCacheBackends(unittest.TestCase):
+    def test_in_memory_backend_is_bounded(self):
+        backend = InMemoryCacheBackend(max_entries=2)
+        for key in ("a", "b", "c"):
+            backend.set(key, {"value": key}, 60)
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(backend.get("c"), {"value": "c"})
+
+    def test_redis_backend_round_trips_json(self):
+        store = {}
+        client = MagicMock()
+        client.set.side_effect = lambda key, value, px: store.__setitem__(key, value)
+        client.get.side_effect = store.get
+        backend = RedisCacheBackend(client, prefix="p:")
+        created_at = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+
+        cache = ReadThroughCache("profiles", ttl=30, backend=backend)
+        cache.get(7, lambda: {"user_id": 7, "created_at": created_at})
+        client.set.assert_called_once()
+        self.assertEqual(client.set.call_args[0][0], "p:profiles:7")
+        self.assertEqual(client.set.call_args[1]["px"], 30000)
+        self.assertEqual(cache.get(7, MagicMock()), {"user_id": 7, "created_at": created_at})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 from unittest.mock import patch, mock_open
-from src.cli_app import encrypt_file, decrypt_file, main
+from src.cli_app import encrypt_file, decrypt_file, main, COMPRESSED_FILE_MAGIC
 import os
 
 class TestCLIApp(unittest.TestCase):
@@ -36,14 +36,41 @@ class TestCLIApp(unittest.TestCase):
             content = f.read()
             self.assertEqual(content, "This is a test string.")
 
+    def test_encrypt_decrypt_file_compressed(self):
+        with open(self.input_file, "w") as f:
+            f.write("This is a test string. " * 100)
+        encrypt_file(self.input_file, self.encrypted_file, compression="auto")
+        with open(self.encrypted_file, "rb") as f:
+            content = f.read()
+        self.assertTrue(content.startswith(COMPRESSED_FILE_MAGIC))
+        self.assertLess(len(content), 2300)
+
+        decrypt_file(self.encrypted_file, self.decrypted_file)
+        with open(self.decrypted_file, "r") as f:
+            self.assertEqual(f.read(), "This is a test string. " * 100)
+
+    def test_decrypt_rejects_corrupt_header(self):
+        for content in [COMPRESSED_FILE_MAGIC, COMPRESSED_FILE_MAGIC + b"\xff" + b"\x00" * 40, b"short"]:
+            with open(self.encrypted_file, "wb") as f:
+                f.write(content)
+            with self.assertRaises(ValueError):
+                decrypt_file(self.encrypted_file, self.decrypted_file)
+        with patch('sys.argv', ['cli_app', 'decrypt', self.encrypted_file, self.decrypted_file]), \
+                patch('sys.stderr'):
+            with self.assertRaises(SystemExit) as raised:
+                main()
+        self.assertEqual(raised.exception.code, 2)
+
     @patch('argparse.ArgumentParser.parse_args')
     @patch('src.cli_app.encrypt_file')
     def test_main_encrypt(self, mock_encrypt_file, mock_parse_args):
         mock_parse_args.return_value.action = 'encrypt'
         mock_parse_args.return_value.input = self.input_file
         mock_parse_args.return_value.output = self.encrypted_file
+        mock_parse_args.return_value.compression = 'zlib'
+        mock_parse_args.return_value.level = 9
         main()
-        mock_encrypt_file.assert_called_once_with(self.input_file, self.encrypted_file)
+        mock_encrypt_file.assert_called_once_with(self.input_file, self.encrypted_file, 'zlib', 9)
 
     @patch('argparse.ArgumentParser.parse_args')
     @patch('src.cli_app.decrypt_file')
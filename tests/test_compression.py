@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import unittest
+from cryptography.exceptions import InvalidTag
+from src.compression import compress, decompress, MIN_COMPRESS_SIZE
+from src.hybrid_crypto import HybridCrypto
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.text = b"account_id,balance,currency\n" + b"1042,99.50,EUR\n" * 500
+
+    def test_round_trip(self):
+        for codec in ("none", "zlib", "lzma"):
+            for level in (None, 1, 9):
+                payload, used = compress(self.text, codec, level)
+                self.assertEqual(used, codec)
+                self.assertEqual(decompress(payload, used), self.text)
+        payload, used = compress(self.text, "zlib")
+        self.assertLess(len(payload), len(self.text) // 10)
+
+    def test_auto_skips_small_and_incompressible(self):
+        self.assertEqual(compress(self.text, "auto")[1], "zlib")
+        self.assertEqual(compress(b"x" * (MIN_COMPRESS_SIZE - 1), "auto"), (b"x" * (MIN_COMPRESS_SIZE - 1), "none"))
+        random_data = os.urandom(4096)
+        self.assertEqual(compress(random_data, "auto"), (random_data, "none"))
+        # An explicit codec also falls back when the result would grow.
+        self.assertEqual(compress(random_data, "lzma"), (random_data, "none"))
+
+    def test_invalid_codec(self):
+        with self.assertRaises(ValueError):
+            compress(self.text, "brotli")
+        with self.assertRaises(ValueError):
+            decompress(self.text, "brotli")
+
+    def test_max_size(self):
+        for codec in ("zlib", "lzma"):
+            payload, _ = compress(self.text, codec)
+            self.assertEqual(decompress(payload, codec, max_size=len(self.text)), self.text)
+            with self.assertRaises(ValueError):
+                decompress(payload, codec, max_size=len(self.text) - 1)
+
+    def test_hybrid_compress_and_encrypt(self):
+        hybrid_crypto = HybridCrypto()
+        session_key = os.urandom(32)
+        ciphertext, nonce, tag, codec = hybrid_crypto.compress_and_encrypt(self.text, session_key, "lzma", 9)
+        self.assertEqual(codec, "lzma")
+        self.assertLess(len(ciphertext), len(self.text))
+        self.assertEqual(hybrid_crypto.decrypt_and_decompress(ciphertext, nonce, tag, session_key, codec), self.text)
+        # The codec is authenticated: a tampered codec fails decryption.
+        with self.assertRaises(InvalidTag):
+            hybrid_crypto.decrypt_and_decompress(ciphertext, nonce, tag, session_key, "none")
+
+    def test_importing_data_manager_does_not_build_hybrid_crypto(self):
+        # Run in a fresh interpreter: other tests may already have used the shared instance.
+        code = ("import src.data_manager, src.hybrid_qkd_api as api; "
+                "assert api._hybrid_crypto.cache_info().currsize == 0")
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+if __name__ == '__main__':
+    unittest.main()
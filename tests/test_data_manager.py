@@ -3,13 +3,16 @@ import os
 import sys
 import psycopg2
 import json
+import datetime
+import struct
+import uuid
 from unittest.mock import patch, MagicMock
 
 # Add the project root to the sys.path to allow absolute imports
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
-from src.data_manager import DataManager
+from src.data_manager import DataManager, profile_cache
 from src.database import init_db, get_db_connection
 from src.config import Config
 
@@ -78,6 +81,7 @@ class TestDataManager(unittest.TestCase):
         conn.commit()
         cur.close()
         conn.close()
+        profile_cache.clear()
 
     def _create_test_user(self, username="testuser", password="password", role="user"):
         conn = get_db_connection()
@@ -186,5 +190,132 @@ class TestDataManager(unittest.TestCase):
         self.assertEqual(len(user2_data), 1)
         self.assertEqual(user2_data[0]["data_type"], "message")
 
+    def test_list_encrypted_data_page(self):
+        user_id = self._create_test_user()
+        data_ids = self.data_manager.store_encrypted_data_many(
+            [(user_id, "message", b"m", {}) for _ in range(5)])
+
+        first = self.data_manager.list_encrypted_data_page(user_id, limit=2)
+        second = self.data_manager.list_encrypted_data_page(user_id, limit=2, cursor=first["next_cursor"])
+        third = self.data_manager.list_encrypted_data_page(user_id, limit=2, cursor=second["next_cursor"])
+        self.assertIsNone(third["next_cursor"])
+        paged_ids = [item["data_id"] for page in (first, second, third) for item in page["items"]]
+        self.assertEqual(sorted(paged_ids), sorted(data_ids))
+
+        with self.assertRaises(ValueError):
+            self.data_manager.list_encrypted_data_page(user_id, cursor="not-a-cursor")
+
+    def test_store_encrypted_data_many(self):
+        user_id = self._create_test_user()
+        rows = [(user_id, "message", f"msg{i}".encode(), {"alg": "A", "n": i}) for i in range(5)]
+
+        data_ids = self.data_manager.store_encrypted_data_many(rows, page_size=2)
+        self.assertEqual(len(data_ids), 5)
+        for i, data_id in enumerate(data_ids):
+            retrieved_data = self.data_manager.retrieve_encrypted_data(data_id)
+            self.assertEqual(bytes(retrieved_data["encrypted_content"]), f"msg{i}".encode())
+            self.assertEqual(retrieved_data["encryption_metadata"], {"alg": "A", "n": i})
+
+    def test_copy_encrypted_data(self):
+        user_id = self._create_test_user()
+        rows = ((user_id, "file", bytes([i]) * 10, {"alg": "B", "n": i}) for i in range(5))
+
+        data_ids = self.data_manager.copy_encrypted_data(rows, chunk_size=2)
+        self.assertEqual(len(data_ids), 5)
+        retrieved_data = self.data_manager.retrieve_encrypted_data(data_ids[3])
+        self.assertEqual(retrieved_data["user_id"], user_id)
+        self.assertEqual(bytes(retrieved_data["encrypted_content"]), bytes([3]) * 10)
+        self.assertEqual(retrieved_data["encryption_metadata"], {"alg": "B", "n": 3})
+
+    def test_store_and_iterate_encrypted_chunks(self):
+        user_id = self._create_test_user()
+        chunks = (bytes([i]) * 100 for i in range(5))
+
+        data_id = self.data_manager.store_encrypted_chunks(user_id, "file", chunks, {"format": "stream"}, page_size=2)
+        self.assertIsNotNone(data_id)
+        retrieved_data = self.data_manager.retrieve_encrypted_data(data_id)
+        self.assertEqual(retrieved_data["encryption_metadata"],
+                         {"format": "stream", "storage": "chunked", "chunk_count": 5})
+        self.assertEqual(list(self.data_manager.iter_encrypted_chunks(data_id)),
+                         [bytes([i]) * 100 for i in range(5)])
+
+        self.assertTrue(self.data_manager.delete_encrypted_data(data_id))
+        self.assertEqual(list(self.data_manager.iter_encrypted_chunks(data_id)), [])
+
+class TestPageCursor(unittest.TestCase):
+    def test_cursor_round_trip(self):
+        created_at = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+        data_id = str(uuid.uuid4())
+        cursor = DataManager._encode_page_cursor(created_at, data_id)
+        self.assertEqual(DataManager._decode_page_cursor(cursor), (created_at, data_id))
+
+    def test_invalid_cursor_is_rejected(self):
+        for cursor in ("not-a-cursor", "bnVsbA==", DataManager._encode_page_cursor(datetime.datetime.now(), "x")):
+            with self.assertRaises(ValueError):
+                DataManager._decode_page_cursor(cursor)
+
+class TestProfileCache(unittest.TestCase):
+    def setUp(self):
+        profile_cache.clear()
+
+    @patch('src.storage_backends.db_connection')
+    def test_profile_reads_are_cached_until_updated(self, mock_db_connection):
+        cur = mock_db_connection.return_value.__enter__.return_value.cursor.return_value
+        cur.fetchone.return_value = (1, "Alice", None, None, None, None)
+        data_manager = DataManager()
+
+        self.assertEqual(data_manager.get_user_profile(1)["display_name"], "Alice")
+        self.assertEqual(data_manager.get_user_profile(1)["display_name"], "Alice")
+        self.assertEqual(cur.fetchone.call_count, 1)
+
+        cur.rowcount = 1
+        self.assertTrue(data_manager.update_user_profile(1, display_name="Alicia"))
+        cur.fetchone.return_value = (1, "Alicia", None, None, None, None)
+        self.assertEqual(data_manager.get_user_profile(1)["display_name"], "Alicia")
+
+class TestCopyEncoding(unittest.TestCase):
+    def _decode(self, buf):
+        data = buf.read()
+        self.assertTrue(data.startswith(b"PGCOPY\n\xff\r\n\x00"))
+        offset, rows = 19, []
+        while True:
+            (field_count,) = struct.unpack_from("!h", data, offset)
+            offset += 2
+            if field_count == -1:
+                break
+            fields = []
+            for _ in range(field_count):
+                (length,) = struct.unpack_from("!i", data, offset)
+                fields.append(data[offset + 4:offset + 4 + length])
+                offset += 4 + length
+            rows.append(fields)
+        self.assertEqual(offset, len(data))
+        return rows
+
+    def test_encode_copy_binary(self):
+        data_id = uuid.uuid4()
+        buf = DataManager._encode_copy_binary([data_id], [(7, "message", b"\x00\x01", {"alg": "A"})])
+        (fields,) = self._decode(buf)
+        self.assertEqual(fields[0], data_id.bytes)
+        self.assertEqual(struct.unpack("!i", fields[1])[0], 7)
+        self.assertEqual(fields[2], b"message")
+        self.assertEqual(fields[3], b"\x00\x01")
+        self.assertEqual(fields[4][:1], b"\x01")
+        self.assertEqual(json.loads(fields[4][1:]), {"alg": "A"})
+
+    @patch('src.storage_backends.db_connection')
+    def test_copy_is_chunked(self, mock_db_connection):
+        conn = mock_db_connection.return_value.__enter__.return_value
+        cur = conn.cursor.return_value
+        rows = ((1, "file", b"x", {}) for _ in range(5))
+
+        data_ids = DataManager().copy_encrypted_data(rows, chunk_size=2)
+
+        self.assertEqual(len(data_ids), 5)
+        self.assertEqual(cur.copy_expert.call_count, 3)
+        chunk_sizes = [len(self._decode(call[0][1])) for call in cur.copy_expert.call_args_list]
+        self.assertEqual(chunk_sizes, [2, 2, 1])
+        conn.commit.assert_called_once()
+
 if __name__ == '__main__':
     unittest.main()
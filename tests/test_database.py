@@ -1,6 +1,10 @@
 import unittest
+import threading
+import time
 import psycopg2
-from src.database import get_db_connection, init_db
+from unittest.mock import MagicMock, patch
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from src.database import get_db_connection, init_db, ConnectionPool, PoolTimeoutError, _create_encrypted_data_store
 
 class TestDatabase(unittest.TestCase):
     @classmethod
@@ -61,5 +65,85 @@ class TestDatabase(unittest.TestCase):
                                 ('duplicate_user', 'hashed_password', 'user'))
             self.conn.commit()
 
+def _mock_connection():
+    conn = MagicMock()
+    conn.closed = False
+    conn.get_transaction_status.return_value = TRANSACTION_STATUS_IDLE
+    return conn
+
+@patch('src.database.psycopg2.connect', side_effect=lambda dsn: _mock_connection())
+class TestConnectionPool(unittest.TestCase):
+    def test_connections_are_reused(self, mock_connect):
+        pool = ConnectionPool("dsn", minconn=1, maxconn=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(mock_connect.call_count, 1)
+        self.assertEqual(pool.get_stats()["checkouts"], 2)
+
+    def test_checkout_waits_for_returned_connection(self, mock_connect):
+        pool = ConnectionPool("dsn", minconn=0, maxconn=1, checkout_timeout=5)
+        conn = pool.getconn()
+        threading.Timer(0.05, pool.putconn, args=(conn,)).start()
+        self.assertIs(pool.getconn(), conn)
+        self.assertGreater(pool.get_stats()["max_wait_time"], 0)
+
+    def test_checkout_times_out_when_exhausted(self, mock_connect):
+        pool = ConnectionPool("dsn", minconn=0, maxconn=1, checkout_timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeoutError):
+            pool.getconn()
+        stats = pool.get_stats()
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["utilization"], 1.0)
+
+    def test_connection_past_max_lifetime_is_recycled(self, mock_connect):
+        pool = ConnectionPool("dsn", minconn=0, maxconn=2, max_lifetime=0.01)
+        with pool.connection() as first:
+            time.sleep(0.02)
+        with pool.connection() as second:
+            pass
+        self.assertIsNot(first, second)
+        first.close.assert_called_once()
+        self.assertEqual(pool.get_stats()["connections_closed"], 1)
+
+    def test_broken_connection_is_replaced(self, mock_connect):
+        pool = ConnectionPool("dsn", minconn=1, maxconn=1)
+        with pool.connection() as first:
+            first.closed = True
+        with pool.connection() as second:
+            pass
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.get_stats()["size"], 1)
+
+    def test_exception_rolls_back_and_returns_connection(self, mock_connect):
+        pool = ConnectionPool("dsn", minconn=0, maxconn=1)
+        with self.assertRaises(RuntimeError):
+            with pool.connection() as conn:
+                conn.get_transaction_status.return_value = TRANSACTION_STATUS_INTRANS
+                raise RuntimeError("boom")
+        conn.rollback.assert_called()
+        self.assertEqual(pool.get_stats()["idle"], 1)
+        self.assertEqual(pool.get_stats()["in_use"], 0)
+
+class TestLegacyMigration(unittest.TestCase):
+    def test_legacy_table_gets_missing_columns_before_attach(self):
+        cur = MagicMock()
+        cur.fetchone.return_value = ('r',)
+        _create_encrypted_data_store(cur)
+        statements = [call.args[0] for call in cur.execute.call_args_list]
+        add_column = next(i for i, sql in enumerate(statements)
+                          if "encrypted_data_store_legacy ADD COLUMN IF NOT EXISTS blind_indexes" in sql)
+        attach = next(i for i, sql in enumerate(statements) if "ATTACH PARTITION encrypted_data_store_legacy" in sql)
+        self.assertLess(add_column, attach)
+
+    def test_partitioned_table_is_left_alone(self):
+        cur = MagicMock()
+        cur.fetchone.return_value = ('p',)
+        _create_encrypted_data_store(cur)
+        self.assertEqual(cur.execute.call_count, 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,21 @@
 import unittest
+import shutil
+import tempfile
+from unittest.mock import patch
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from src.kms_api import KMS
 import os
 
 class TestKMSAPI(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.temp_dir, "kms_key_store.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
     def test_generate_pqc_key_pair(self):
-        kms = KMS()
+        kms = KMS(key_store_path=self.store_path)
         key_info = kms.generate_pqc_key_pair('test_kyber_key', algorithm='Kyber')
         self.assertIsNotNone(key_info)
         self.assertEqual(key_info['algorithm'], 'Kyber')
@@ -12,7 +23,7 @@ class TestKMSAPI(unittest.TestCase):
         self.assertIn('private_key', key_info)
 
     def test_encrypt_decrypt_data_with_kms_key(self):
-        kms = KMS()
+        kms = KMS(key_store_path=self.store_path)
         # Generate a symmetric key first
         sym_key_info = kms.generate_symmetric_key('test_sym_key')
         self.assertIsNotNone(sym_key_info)
@@ -26,7 +37,255 @@ class TestKMSAPI(unittest.TestCase):
         decrypted_data = kms.decrypt_data_with_kms_key('test_sym_key', ciphertext, nonce, tag)
         self.assertEqual(original_data, decrypted_data)
 
+    def test_hot_path_does_not_decode_key_material(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('hot_key')
+        kms.encrypt_data_with_kms_key('hot_key', b"warm up")
+        with patch('src.kms_api.base64.b64decode') as mock_decode:
+            ciphertext, nonce, tag = kms.encrypt_data_with_kms_key('hot_key', b"payload")
+            self.assertEqual(kms.decrypt_data_with_kms_key('hot_key', ciphertext, nonce, tag), b"payload")
+            mock_decode.assert_not_called()
+
+    def test_revoke_invalidates_cached_key(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('revoked_key')
+        kms.encrypt_data_with_kms_key('revoked_key', b"data")
+        kms.revoke_key('revoked_key')
+        with self.assertRaises(ValueError):
+            kms.encrypt_data_with_kms_key('revoked_key', b"data")
+
+    def test_find_keys_due_for_rotation(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('stale_key')
+        kms.generate_symmetric_key('fresh_key')
+        kms.revoke_key('fresh_key')
+        self.assertEqual(kms.get_keys_due_for_rotation(0), ['stale_key'])
+        self.assertEqual(kms.get_keys_due_for_rotation(3600), [])
+
+        new_key_id = kms.rotate_key('stale_key')
+        active = [key['key_id'] for key in kms.find_keys(status='active', key_type='Symmetric')]
+        self.assertEqual(active, [new_key_id])
+
+    def test_rotation_keeps_logical_key_usable(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('versioned_key')
+        old_ciphertext, old_nonce, old_tag = kms.encrypt_data_with_kms_key('versioned_key', b"before rotation")
+
+        new_key_id = kms.rotate_key('versioned_key')
+        self.assertEqual(new_key_id, 'versioned_key:v2')
+        self.assertEqual(kms.get_key('versioned_key')['status'], 'inactive')
+        self.assertEqual(kms.get_key_versions('versioned_key'), ['versioned_key', 'versioned_key:v2'])
+        self.assertEqual(kms.get_current_key_id('versioned_key'), 'versioned_key:v2')
+
+        # The logical ID keeps working and new data is encrypted under version 2.
+        ciphertext, nonce, tag = kms.encrypt_data_with_kms_key('versioned_key', b"after rotation")
+        self.assertEqual(kms.decrypt_data_with_kms_key('versioned_key', ciphertext, nonce, tag), b"after rotation")
+        # Data encrypted under version 1 still decrypts without re-encryption.
+        self.assertEqual(kms.decrypt_data_with_kms_key('versioned_key', old_ciphertext, old_nonce, old_tag),
+                         b"before rotation")
+
+        # Rotating via a version ID extends the same chain.
+        self.assertEqual(kms.rotate_key(new_key_id), 'versioned_key:v3')
+
+        kms.revoke_key('versioned_key')
+        with self.assertRaises(ValueError):
+            kms.decrypt_data_with_kms_key('versioned_key', old_ciphertext, old_nonce, old_tag)
+
+    def test_key_ids_do_not_collide_with_version_ids(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('billing')
+        # A key named like a version does not block rotation...
+        unrelated = kms.generate_symmetric_key('billing_v2')
+        self.assertEqual(kms.rotate_key('billing'), 'billing:v2')
+        self.assertEqual(kms.get_key('billing_v2')['key'], unrelated['key'])
+        self.assertEqual(kms.get_key_versions('billing'), ['billing', 'billing:v2'])
+
+        # ...and no new key can take a version's ID or replace an existing key.
+        version = kms.get_key('billing:v2')
+        with self.assertRaises(ValueError):
+            kms.generate_symmetric_key('billing:v2')
+        with self.assertRaises(ValueError):
+            kms.generate_pqc_key_pair('billing', 'Kyber')
+        with self.assertRaises(ValueError):
+            kms.generate_keys_bulk([{"key_id": "billing:v3"}])
+        with self.assertRaises(ValueError):
+            kms.generate_keys_bulk([{"key_id": "fresh"}, {"key_id": "billing"}])
+        self.assertIsNone(kms.get_key('fresh'))
+        self.assertEqual(kms.get_key('billing:v2')['key'], version['key'])
+        self.assertEqual(kms.get_key_versions('billing'), ['billing', 'billing:v2'])
+
+    def test_revoked_key_cannot_be_rotated(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('revoked')
+        kms.revoke_key('revoked')
+        with self.assertRaises(ValueError):
+            kms.rotate_key('revoked')
+        self.assertEqual(kms.get_key_versions('revoked'), ['revoked'])
+
+    def test_revoke_first_version_only(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('chain')
+        old_ciphertext, old_nonce, old_tag = kms.encrypt_data_with_kms_key('chain', b"version 1")
+        second = kms.rotate_key('chain')
+
+        kms.revoke_key('chain', version=1)
+        self.assertEqual(kms.get_key('chain')['status'], 'revoked')
+        self.assertEqual(kms.get_key(second)['status'], 'active')
+        with self.assertRaises(ValueError):
+            kms.decrypt_data_with_kms_key('chain', old_ciphertext, old_nonce, old_tag)
+        ciphertext, nonce, tag = kms.encrypt_data_with_kms_key('chain', b"version 2")
+        self.assertEqual(kms.decrypt_data_with_kms_key('chain', ciphertext, nonce, tag), b"version 2")
+        with self.assertRaises(ValueError):
+            kms.revoke_key('chain', version=3)
+
+    def test_envelope_encryption_and_rewrap(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('kek')
+
+        plaintext_dek, wrapped_dek = kms.generate_data_key('kek')
+        self.assertEqual(len(plaintext_dek), 32)
+        self.assertEqual(kms.decrypt_data_key('kek', wrapped_dek), plaintext_dek)
+
+        first = kms.encrypt_envelope('kek', b"first message")
+        second = kms.encrypt_envelope('kek', b"second message")
+        # Both messages reuse the cached DEK, so they carry the same wrapped key.
+        self.assertEqual(kms._split_envelope(first)[0], kms._split_envelope(second)[0])
+        self.assertEqual(kms.decrypt_envelope('kek', first), b"first message")
+
+        kms.rotate_key('kek')
+        third = kms.encrypt_envelope('kek', b"third message")
+        self.assertNotEqual(kms._split_envelope(first)[0], kms._split_envelope(third)[0])
+        # Rotation only requires re-wrapping the DEK; the payload is unchanged.
+        rewrapped = kms.rewrap_envelope('kek', first)
+        self.assertEqual(rewrapped[-len(b"first message") - 16:], first[-len(b"first message") - 16:])
+        self.assertEqual(kms.decrypt_envelope('kek', rewrapped), b"first message")
+        self.assertEqual(kms.decrypt_envelope('kek', second), b"second message")
+
+    def test_stream_encryption_round_trip_and_tamper_detection(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('kek')
+        chunks = [b"a" * 10, b"b" * 10, b"c" * 5]
+
+        wrapped_dek, encrypted = kms.encrypt_stream('kek', iter(chunks))
+        encrypted = list(encrypted)
+        self.assertEqual(len(encrypted), 3)
+        self.assertEqual(list(kms.decrypt_stream('kek', wrapped_dek, encrypted)), chunks)
+
+        # Reordered, truncated or empty streams are rejected.
+        with self.assertRaises(ValueError):
+            list(kms.decrypt_stream('kek', wrapped_dek, [encrypted[1], encrypted[0], encrypted[2]]))
+        with self.assertRaises(ValueError):
+            list(kms.decrypt_stream('kek', wrapped_dek, encrypted[:2]))
+        with self.assertRaises(ValueError):
+            list(kms.decrypt_stream('kek', wrapped_dek, []))
+
+        wrapped_dek, encrypted = kms.encrypt_stream('kek', [])
+        self.assertEqual(list(kms.decrypt_stream('kek', wrapped_dek, encrypted)), [b""])
+
+    def test_data_key_reuse_is_bounded(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('kek')
+        kms.data_key_cache.max_messages = 2
+        envelopes = [kms.encrypt_envelope('kek', b"message") for _ in range(3)]
+        wrapped_keys = [kms._split_envelope(envelope)[0] for envelope in envelopes]
+        self.assertEqual(wrapped_keys[0], wrapped_keys[1])
+        self.assertNotEqual(wrapped_keys[1], wrapped_keys[2])
+
+    def test_construction_is_lazy_and_key_derivation_is_cached(self):
+        with patch('src.kms_api.PBKDF2HMAC', wraps=PBKDF2HMAC) as mock_kdf:
+            kms = KMS(master_password="lazy-test-password", key_store_path=self.store_path)
+            # Nothing is derived, built or opened until the KMS is first used.
+            mock_kdf.assert_not_called()
+            self.assertIsNone(kms._key_store)
+            self.assertFalse(os.path.exists(self.store_path))
+
+            kms.generate_symmetric_key('lazy_key')
+            second = KMS(master_password="lazy-test-password", key_store_path=self.store_path)
+            self.assertIsNotNone(second.get_key('lazy_key'))
+            self.assertEqual(mock_kdf.call_count, 1)
+
+    def test_generate_keys_bulk_commits_once(self):
+        kms = KMS(key_store_path=self.store_path)
+        specs = [{"key_id": f"sym_{i}", "type": "Symmetric"} for i in range(20)]
+        specs += [{"key_id": "kyber_0", "type": "PQC", "algorithm": "Kyber"},
+                  {"key_id": "dilithium_0", "type": "PQC", "algorithm": "Dilithium"}]
+        self.assertIsNone(kms.get_key("sym_0"))  # opens (and creates) the store first
+        with patch('src.kms_storage.os.fsync', wraps=os.fsync) as mock_fsync:
+            key_ids = kms.generate_keys_bulk(specs, max_workers=2)
+        self.assertEqual(key_ids, [spec["key_id"] for spec in specs])
+        self.assertEqual(mock_fsync.call_count, 1)
+        self.assertEqual(len({kms.get_key(f"sym_{i}")["key"] for i in range(20)}), 20)
+
+        reopened = KMS(key_store_path=self.store_path)
+        self.assertEqual(reopened.get_key("dilithium_0")["algorithm"], "Dilithium")
+        signature = reopened.sign_data_with_kms_key("dilithium_0", b"tenant")
+        self.assertTrue(reopened.verify_data_with_kms_key("dilithium_0", b"tenant", signature))
+
+        with self.assertRaises(ValueError):
+            kms.generate_keys_bulk([{"key_id": "bad", "type": "PQC", "algorithm": "RSA"}])
+        self.assertIsNone(kms.get_key("bad"))
+
+    def test_derived_keys_are_deterministic_and_not_stored(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('tenant_root')
+        key_a = kms.derive_key('tenant_root', 'acme/invoices/42')
+        self.assertEqual(len(key_a), 32)
+        self.assertEqual(kms.derive_key('tenant_root', ['acme', 'invoices', '42']), key_a)
+        self.assertNotEqual(kms.derive_key('tenant_root', 'acme/invoices/43'), key_a)
+        self.assertEqual(len(kms.key_store), 1)
+
+        # A fresh instance (empty caches) derives the same key.
+        reopened = KMS(key_store_path=self.store_path)
+        self.assertEqual(reopened.derive_key('tenant_root', 'acme/invoices/42'), key_a)
+
+        ciphertext, nonce, tag = kms.encrypt_with_derived_key('tenant_root', 'acme/invoices/42', b"invoice")
+        kms.rotate_key('tenant_root')
+        self.assertNotEqual(kms.derive_key('tenant_root', 'acme/invoices/42'), key_a)
+        self.assertEqual(kms.decrypt_with_derived_key('tenant_root', 'acme/invoices/42', ciphertext, nonce, tag),
+                         b"invoice")
+        with self.assertRaises(Exception):
+            kms.decrypt_with_derived_key('tenant_root', 'acme/invoices/43', ciphertext, nonce, tag)
+        with self.assertRaises(ValueError):
+            kms.derive_key('tenant_root', 'acme//42')
+
+    def test_revoking_a_derived_subtree(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('tenant_root')
+        ciphertext, nonce, tag = kms.encrypt_with_derived_key('tenant_root', 'acme/invoices/42', b"invoice")
+        kms.derive_key('tenant_root', 'globex/invoices/1')
+
+        kms.revoke_derived_path('tenant_root', 'acme')
+        self.assertEqual(kms.get_revoked_derived_paths('tenant_root'), ['acme'])
+        with self.assertRaises(ValueError):
+            kms.decrypt_with_derived_key('tenant_root', 'acme/invoices/42', ciphertext, nonce, tag)
+        with self.assertRaises(ValueError):
+            kms.derive_key('tenant_root', 'acme/payroll/7')
+        self.assertEqual(len(kms.derive_key('tenant_root', 'globex/invoices/1')), 32)
+        self.assertEqual(len(kms.derive_key('tenant_root', 'acme-labs/invoices/1')), 32)
+
+    def test_blind_index_tokens(self):
+        kms = KMS(key_store_path=self.store_path)
+        kms.generate_symmetric_key('index_key')
+        token = kms.compute_blind_index('index_key', 'email', 'alice@example.com', scope='1')
+        self.assertTrue(token.startswith('email:1:'))
+        self.assertEqual(len(token.split(':')[2]), 32)
+        self.assertNotIn('alice', token)
+        self.assertEqual(kms.compute_blind_index('index_key', 'email', b'alice@example.com', scope='1'), token)
+        self.assertNotEqual(kms.compute_blind_index('index_key', 'email', 'alice@example.com', scope='2'), token)
+        self.assertNotEqual(kms.compute_blind_index('index_key', 'email', 'bob@example.com', scope='1'), token)
+        with self.assertRaises(ValueError):
+            kms.compute_blind_index('index_key', 'e:mail', 'alice@example.com')
 
+        # Tokens from before a rotation stay searchable until that version is revoked.
+        second_version = kms.rotate_key('index_key')
+        kms.rotate_key('index_key')
+        candidates = kms.blind_index_candidates('index_key', 'email', 'alice@example.com', scope='1')
+        self.assertEqual(len(candidates), 3)
+        self.assertEqual(candidates[0], token)
+        self.assertEqual(candidates[2], kms.compute_blind_index('index_key', 'email', 'alice@example.com', scope='1'))
+        kms.revoke_key(second_version)
+        self.assertEqual(kms.blind_index_candidates('index_key', 'email', 'alice@example.com', scope='1'),
+                         [candidates[0], candidates[2]])
 
     # Add more tests for decrypt_data, rotate_key, etc.
 
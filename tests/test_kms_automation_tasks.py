@@ -1,5 +1,8 @@
 import unittest
-from src.automation.kms_automation_tasks import automated_key_rotation, automated_key_revocation, automated_key_generation
+import shutil
+import tempfile
+from unittest.mock import patch
+from src.automation.kms_automation_tasks import automated_key_rotation, automated_key_revocation, automated_key_generation, automated_rotation_sweep
 from src.kms_api import KMS
 import os
 
@@ -53,6 +56,22 @@ class TestKMSAutomationTasks(unittest.TestCase):
         self.assertIsNotNone(revoked_key_info)
         self.assertEqual(revoked_key_info["status"], "revoked")
 
+    def test_automated_rotation_sweep(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            kms = KMS(key_store_path=os.path.join(temp_dir, "kms_key_store.json"))
+            kms.generate_symmetric_key("sweep_key")
+            kms.generate_symmetric_key("revoked_sweep_key")
+            kms.revoke_key("revoked_sweep_key")
+            with patch('src.automation.kms_automation_tasks.kms_instance', kms):
+                result = automated_rotation_sweep(0, key_type="Symmetric")
+            self.assertEqual(result["status"], "success")
+            self.assertEqual(result["rotated"], ["sweep_key"])
+            self.assertEqual(kms.get_key("sweep_key")["status"], "inactive")
+            self.assertEqual(kms.get_key("revoked_sweep_key")["status"], "revoked")
+        finally:
+            shutil.rmtree(temp_dir)
+
     # Add more tests for other KMS automation tasks
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import patch
+from src.kms_cache import KeyMaterialCache, CachedKeyMaterial, DataKeyCache, CachedDataKey, zeroize
+
+class TestKeyMaterialCache(unittest.TestCase):
+    def _entry(self, material=b"\x01" * 32):
+        return CachedKeyMaterial("Symmetric", "AES-256", material=bytearray(material), primitive=object())
+
+    def test_put_and_get(self):
+        cache = KeyMaterialCache()
+        entry = cache.put("key_a", self._entry())
+        self.assertIs(cache.get("key_a"), entry)
+        self.assertIsNone(cache.get("missing"))
+
+    def test_lru_eviction_zeroizes_material(self):
+        cache = KeyMaterialCache(max_entries=2)
+        first = self._entry()
+        buffer = first.material
+        cache.put("key_a", first)
+        cache.put("key_b", self._entry())
+        cache.get("key_a") # key_b becomes least recently used
+        cache.put("key_c", self._entry())
+        self.assertIsNotNone(cache.get("key_a"))
+        self.assertIsNone(cache.get("key_b"))
+        self.assertEqual(len(cache), 2)
+
+        cache.invalidate("key_a")
+        self.assertIsNone(cache.get("key_a"))
+        self.assertEqual(buffer, bytearray(32))
+        self.assertIsNone(first.material)
+        self.assertIsNone(first.primitive)
+
+    def test_ttl_expiry(self):
+        cache = KeyMaterialCache(ttl=10)
+        entry = self._entry()
+        buffer = entry.material
+        with patch('src.kms_cache.time.monotonic', return_value=100.0):
+            cache.put("key_a", entry)
+        with patch('src.kms_cache.time.monotonic', return_value=105.0):
+            self.assertIs(cache.get("key_a"), entry)
+        with patch('src.kms_cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get("key_a"))
+        self.assertEqual(buffer, bytearray(32))
+
+    def test_zeroize(self):
+        buffer = bytearray(b"secret")
+        zeroize(buffer)
+        self.assertEqual(buffer, bytearray(6))
+
+class TestDataKeyCache(unittest.TestCase):
+    def _data_key(self):
+        return CachedDataKey(b"wrapped", CachedKeyMaterial("DataKey", "AES-256", material=bytearray(32),
+                                                           primitive=object()))
+
+    def test_byte_limit_retires_data_key(self):
+        cache = DataKeyCache(max_bytes=100)
+        data_key = self._data_key()
+        cache.store("kek", data_key, 60)
+        self.assertIsNone(cache.acquire("kek", 50))
+        self.assertIsNone(data_key.material.primitive)
+
+    def test_age_limit_retires_data_key(self):
+        cache = DataKeyCache(max_age=10)
+        with patch('src.kms_cache.time.monotonic', return_value=100.0):
+            cache.store("kek", self._data_key(), 1)
+        with patch('src.kms_cache.time.monotonic', return_value=105.0):
+            self.assertIsNotNone(cache.acquire("kek", 1))
+        with patch('src.kms_cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.acquire("kek", 1))
+
+    def test_acquire_counts_usage(self):
+        cache = DataKeyCache()
+        cache.store("kek", self._data_key(), 10)
+        data_key = cache.acquire("kek", 5)
+        self.assertEqual(data_key.messages, 2)
+        self.assertEqual(data_key.bytes_encrypted, 15)
+        cache.invalidate("kek")
+        self.assertIsNone(cache.acquire("kek", 1))
+
+if __name__ == '__main__':
+    unittest.main()
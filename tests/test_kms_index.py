@@ -0,0 +1,45 @@
+import unittest
+from src.kms_index import KeyMetadataIndex, KeyRecord
+
+class TestKeyMetadataIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = KeyMetadataIndex()
+        self.index.upsert(KeyRecord("kyber_old", "PQC", "Kyber", "active", 100.0, 100.0))
+        self.index.upsert(KeyRecord("kyber_new", "PQC", "Kyber", "active", 900.0, 900.0))
+        self.index.upsert(KeyRecord("kyber_revoked", "PQC", "Kyber", "revoked", 50.0, 50.0))
+        self.index.upsert(KeyRecord("dilithium_old", "PQC", "Dilithium", "active", 200.0, 200.0))
+        self.index.upsert(KeyRecord("aes_old", "Symmetric", "AES-256", "active", 300.0, 300.0))
+
+    def _ids(self, records):
+        return [record.key_id for record in records]
+
+    def test_query_by_status_algorithm_and_age(self):
+        records = self.index.query(status="active", algorithm="Kyber", rotated_before=500.0)
+        self.assertEqual(self._ids(records), ["kyber_old"])
+
+    def test_query_orders_by_last_rotation(self):
+        records = self.index.query(status="active", rotated_before=1000.0)
+        self.assertEqual(self._ids(records), ["kyber_old", "dilithium_old", "aes_old", "kyber_new"])
+        self.assertEqual(self._ids(self.index.query(status="active", limit=2)), ["kyber_old", "dilithium_old"])
+
+    def test_query_by_type(self):
+        records = self.index.query(key_type="Symmetric")
+        self.assertEqual(self._ids(records), ["aes_old"])
+
+    def test_upsert_moves_record_between_indexes(self):
+        self.index.upsert(KeyRecord("kyber_old", "PQC", "Kyber", "inactive", 100.0, 100.0))
+        self.assertNotIn("kyber_old", self._ids(self.index.query(status="active")))
+        self.assertEqual(self._ids(self.index.query(status="inactive")), ["kyber_old"])
+
+        self.index.upsert(KeyRecord("aes_old", "Symmetric", "AES-256", "active", 300.0, 1000.0))
+        self.assertEqual(self._ids(self.index.query(rotated_before=500.0, status="active")),
+                         ["dilithium_old"])
+
+    def test_remove(self):
+        self.index.remove("kyber_new")
+        self.assertIsNone(self.index.get("kyber_new"))
+        self.assertEqual(len(self.index), 4)
+        self.assertNotIn("kyber_new", self._ids(self.index.query()))
+
+if __name__ == '__main__':
+    unittest.main()
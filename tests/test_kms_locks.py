@@ -0,0 +1,79 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from src.kms_locks import ReadWriteLock, InterProcessLock, pread
+
+class TestReadWriteLock(unittest.TestCase):
+    def test_readers_share_the_lock(self):
+        lock = ReadWriteLock()
+        inside = threading.Barrier(3, timeout=5)
+
+        def reader():
+            with lock.read():
+                # All three readers must be inside at the same time to pass the barrier.
+                inside.wait()
+
+        threads = [threading.Thread(target=reader) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(inside.broken)
+
+    def test_writer_excludes_readers(self):
+        lock = ReadWriteLock()
+        events = []
+        lock.acquire_write()
+
+        def reader():
+            with lock.read():
+                events.append("read")
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+        events.append("write done")
+        lock.release_write()
+        thread.join()
+        self.assertEqual(events, ["write done", "read"])
+
+class TestInterProcessLock(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "store.lock")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_separate_lock_objects_exclude_each_other(self):
+        # Two lock objects stand in for two processes: each opens its own lock file handle.
+        first, second = InterProcessLock(self.path), InterProcessLock(self.path)
+        acquired = threading.Event()
+
+        def other_process():
+            with second:
+                acquired.set()
+
+        with first:
+            with first:  # reentrant for the holding thread
+                thread = threading.Thread(target=other_process)
+                thread.start()
+                self.assertFalse(acquired.wait(0.1))
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    def test_pread_does_not_move_file_position(self):
+        data_path = os.path.join(self.temp_dir, "data")
+        with open(data_path, 'wb') as f:
+            f.write(b"0123456789")
+        with open(data_path, 'rb') as f:
+            f.seek(2)
+            self.assertEqual(pread(f, 3, 5), b"567")
+            self.assertEqual(f.tell(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
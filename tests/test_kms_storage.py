@@ -0,0 +1,305 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+from cryptography.fernet import Fernet
+from src.kms_storage import KeyStoreLog, LOG_MAGIC
+
+class TestKeyStoreLog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "kms_key_store.json")
+        self.fernet = Fernet(Fernet.generate_key())
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _open_log(self, **kwargs):
+        log = KeyStoreLog(self.path, self.fernet, **kwargs)
+        log.open()
+        return log
+
+    def test_put_get_and_reopen_lazily(self):
+        log = self._open_log()
+        log["key_a"] = {"type": "Symmetric", "status": "active"}
+        log["key_b"] = {"type": "PQC", "status": "active"}
+        log.close()
+
+        reopened = self._open_log()
+        self.assertEqual(len(reopened), 2)
+        self.assertIn("key_a", reopened)
+        # Opening only scans headers; nothing has been decrypted yet.
+        self.assertEqual(reopened._cache, {})
+        self.assertEqual(reopened["key_b"]["type"], "PQC")
+        self.assertEqual(list(reopened._cache), ["key_b"])
+        reopened.close()
+
+    def test_write_appends_single_record(self):
+        log = self._open_log()
+        log["key_a"] = {"status": "active"}
+        size_before = os.path.getsize(self.path)
+        log["key_b"] = {"status": "active"}
+        size_after = os.path.getsize(self.path)
+        # A write only appends the new record; the existing record is not rewritten.
+        with open(self.path, 'rb') as f:
+            f.seek(size_before)
+            self.assertIn(b"key_b", f.read())
+        self.assertLess(size_after - size_before, 512)
+        log.close()
+
+    def test_delete_and_update_survive_reopen(self):
+        log = self._open_log()
+        log["key_a"] = {"status": "active"}
+        log["key_a"] = {"status": "revoked"}
+        log["key_b"] = {"status": "active"}
+        del log["key_b"]
+        log.close()
+
+        reopened = self._open_log()
+        self.assertEqual(reopened["key_a"]["status"], "revoked")
+        self.assertNotIn("key_b", reopened)
+        self.assertIsNone(reopened.get("key_b"))
+        reopened.close()
+
+    def test_torn_tail_is_discarded(self):
+        log = self._open_log()
+        log["key_a"] = {"status": "active"}
+        log.close()
+        valid_size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b"\x00\x00\x01\x00\x00\x05partial")
+
+        reopened = self._open_log()
+        self.assertEqual(list(reopened), ["key_a"])
+        self.assertEqual(os.path.getsize(self.path), valid_size)
+        reopened.close()
+
+    def test_compaction_reclaims_superseded_records(self):
+        log = self._open_log(background_compaction=False, min_compaction_bytes=1 << 30)
+        for i in range(20):
+            log["key_a"] = {"status": "active", "counter": i}
+        log["key_b"] = {"status": "active"}
+        size_before = os.path.getsize(self.path)
+        log.compact()
+        self.assertLess(os.path.getsize(self.path), size_before)
+        self.assertEqual(log["key_a"]["counter"], 19)
+        log.close()
+
+        reopened = self._open_log()
+        self.assertEqual(sorted(reopened), ["key_a", "key_b"])
+        self.assertEqual(reopened["key_a"]["counter"], 19)
+        reopened.close()
+
+    def test_migrates_legacy_whole_file_store(self):
+        legacy = {"old_key": {"type": "Symmetric", "status": "active"}}
+        with open(self.path, 'w') as f:
+            f.write(self.fernet.encrypt(json.dumps(legacy).encode('utf-8')).decode('utf-8'))
+
+        log = self._open_log()
+        self.assertEqual(log["old_key"], legacy["old_key"])
+        log.close()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(len(LOG_MAGIC)), LOG_MAGIC)
+
+    def test_bulk_writes_share_one_fsync(self):
+        log = self._open_log(commit_window=1.0)
+        with patch('src.kms_storage.os.fsync', wraps=os.fsync) as mock_fsync:
+            with log.bulk():
+                for i in range(50):
+                    log[f"key_{i}"] = {"status": "active"}
+                self.assertEqual(mock_fsync.call_count, 0)
+        self.assertEqual(mock_fsync.call_count, 1)
+        log.close()
+
+        reopened = self._open_log()
+        self.assertEqual(len(reopened), 50)
+        reopened.close()
+
+    def test_concurrent_writers_are_group_committed(self):
+        log = self._open_log(commit_window=0.01)
+        writes_per_thread = 20
+
+        def writer(thread_index):
+            for i in range(writes_per_thread):
+                log[f"key_{thread_index}_{i}"] = {"status": "active"}
+
+        with patch('src.kms_storage.os.fsync', wraps=os.fsync) as mock_fsync:
+            threads = [threading.Thread(target=writer, args=(t,)) for t in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        # Every write returned only after it was durable, but far fewer fsyncs were issued.
+        self.assertLess(mock_fsync.call_count, 8 * writes_per_thread)
+        log.close()
+
+        reopened = self._open_log()
+        self.assertEqual(len(reopened), 8 * writes_per_thread)
+        reopened.close()
+    def test_logs_sharing_a_file_see_each_others_writes(self):
+        # Two logs on one path stand in for two worker processes.
+        first = self._open_log(sync_interval=0)
+        second = self._open_log(sync_interval=0)
+        changes = []
+        second.change_listeners.append(changes.append)
+        first["key_a"] = {"status": "active"}
+        second["key_b"] = {"status": "active"}
+        self.assertEqual(second["key_a"]["status"], "active")
+        self.assertEqual(changes, [{"key_a"}])
+
+        first["key_a"] = {"status": "revoked"}
+        self.assertEqual(second["key_a"]["status"], "revoked")
+        self.assertEqual(sorted(first), ["key_a", "key_b"])
+
+        first.compact()
+        second["key_c"] = {"status": "active"}
+        self.assertIsNone(changes[-1])  # the compacted log was reloaded
+        first.close()
+        second.close()
+
+        reopened = self._open_log()
+        self.assertEqual(sorted(reopened), ["key_a", "key_b", "key_c"])
+        self.assertEqual(reopened["key_a"]["status"], "revoked")
+        reopened.close()
+
+    def test_writers_are_not_blocked_by_a_commit_in_progress(self):
+        log = self._open_log(commit_window=0)
+        log["key_a"] = {"status": "active"}
+        fsync_started, release_fsync = threading.Event(), threading.Event()
+        real_fsync = os.fsync
+
+        def slow_fsync(fd):
+            fsync_started.set()
+            release_fsync.wait(5)
+            real_fsync(fd)
+
+        with patch('src.kms_storage.os.fsync', side_effect=slow_fsync):
+            writer = threading.Thread(target=log.__setitem__, args=("key_b", {"status": "active"}))
+            writer.start()
+            self.assertTrue(fsync_started.wait(5))
+            # The store lock is free while the batch is fsync'd: reads and new writes proceed.
+            self.assertTrue(log._lock.acquire(timeout=1))
+            log._lock.release()
+            self.assertIn("key_b", log)
+            self.assertEqual(log["key_b"]["status"], "active")
+            release_fsync.set()
+            writer.join()
+        self.assertEqual(sorted(log), ["key_a", "key_b"])
+        log.close()
+
+        reopened = self._open_log()
+        self.assertEqual(sorted(reopened), ["key_a", "key_b"])
+        reopened.close()
+
+    def test_compaction_reports_records_picked_up_while_copying(self):
+        first = self._open_log(sync_interval=60, background_compaction=False)
+        second = self._open_log(sync_interval=60)
+        first["key_a"] = {"status": "active"}
+        changes = []
+        first.change_listeners.append(changes.append)
+
+        real_notify = first._notify_changes
+
+        def write_from_other_process(changed):
+            # Runs between the two compaction phases, while the snapshot is being copied.
+            if not changes:
+                second["key_b"] = {"status": "active"}
+            real_notify(changed)
+        with patch.object(first, "_notify_changes", side_effect=write_from_other_process):
+            first.compact()
+        self.assertIn({"key_b"}, changes)
+        self.assertEqual(first["key_b"]["status"], "active")
+        first.close()
+        second.close()
+
+    def test_bulk_read_modify_write_is_serialized(self):
+        first = self._open_log(sync_interval=0)
+        second = self._open_log(sync_interval=0)
+        first["counter"] = {"value": 0}
+
+        def increment(log):
+            for _ in range(25):
+                with log.bulk():
+                    log["counter"] = {"value": log["counter"]["value"] + 1}
+
+        threads = [threading.Thread(target=increment, args=(log,)) for log in (first, second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(first["counter"]["value"], 50)
+        self.assertEqual(second["counter"]["value"], 50)
+        first.close()
+        second.close()
+
+    def test_read_racing_compaction_returns_the_requested_key(self):
+        log = self._open_log(background_compaction=False)
+        for i in range(10):
+            log[f"key_{i}"] = {"id": f"key_{i}", "v": 1}
+        for i in range(0, 10, 2):
+            log[f"key_{i}"] = {"id": f"key_{i}", "v": 2}
+        log._cache.clear()
+
+        # Compact right before the read section is entered, i.e. after the cache miss.
+        real_read = log._file_rw.read
+        compacted = []
+
+        def read_after_compaction():
+            if not compacted:
+                compacted.append(True)
+                log.compact()
+            return real_read()
+        with patch.object(log._file_rw, "read", side_effect=read_after_compaction):
+            self.assertEqual(log["key_7"], {"id": "key_7", "v": 1})
+        self.assertEqual(compacted, [True])
+
+        # A stale index entry pointing at another key's record is detected and retried.
+        log._cache.clear()
+        real_entry = log._index["key_7"]
+        log._index["key_7"] = log._index["key_2"]
+        real_read_record = log._read_record
+
+        def read_record_once_stale(key_id):
+            result = real_read_record(key_id)
+            log._index["key_7"] = real_entry
+            return result
+        with patch.object(log, "_read_record", side_effect=read_record_once_stale):
+            self.assertEqual(log["key_7"], {"id": "key_7", "v": 1})
+        log.close()
+
+    def test_reads_during_writes_never_see_missing_keys(self):
+        log = self._open_log()
+        for i in range(20):
+            log[f"key_{i}"] = {"status": "active", "counter": 0}
+        log.close()
+        log = self._open_log(background_compaction=False, min_compaction_bytes=0, compaction_threshold=0.3)
+        errors = []
+        stop = threading.Event()
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    for i in range(20):
+                        self.assertEqual(log[f"key_{i}"]["status"], "active")
+                except Exception as e:
+                    errors.append(e)
+                    return
+                time.sleep(0.001)
+
+        readers = [threading.Thread(target=reader) for _ in range(2)]
+        for thread in readers:
+            thread.start()
+        for counter in range(1, 30):
+            log[f"key_{counter % 20}"] = {"status": "active", "counter": counter}
+        stop.set()
+        for thread in readers:
+            thread.join()
+        self.assertEqual(errors, [])
+        log.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import MagicMock
+from src.kms_api import KMS
+
+class TestKeyUsageCounters(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.temp_dir, "kms_key_store.json")
+        self.kms = KMS(key_store_path=self.store_path, usage_flush_interval=3600, max_key_operations=100)
+        self.kms.generate_symmetric_key('sym')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_usage_is_counted_per_operation(self):
+        ciphertext, nonce, tag = self.kms.encrypt_data_with_kms_key('sym', b"x" * 10)
+        self.kms.decrypt_data_with_kms_key('sym', ciphertext, nonce, tag)
+        usage = self.kms.get_key_usage('sym')
+        self.assertEqual(usage["operations"], 2)
+        self.assertEqual(usage["bytes"], 20)
+        self.assertEqual(usage["by_operation"]["encrypt"], {"operations": 1, "bytes": 10})
+        # Nothing has been written to the key store yet.
+        self.assertNotIn("usage", self.kms.get_key('sym'))
+
+    def test_pending_usage_includes_every_operation_type(self):
+        self.kms.usage.record('sym', "blind_index", 12)
+        self.kms.encrypt_data_with_kms_key('sym', b"x" * 10)
+        pending = self.kms.get_key_usage('sym')
+        self.kms.flush()
+        self.assertEqual(pending, self.kms.get_key_usage('sym'))
+        self.assertEqual(pending["by_operation"]["blind_index"], {"operations": 1, "bytes": 12})
+        self.assertEqual(pending["operations"], 2)
+
+    def test_counts_from_many_threads_are_flushed_without_loss(self):
+        def worker():
+            for _ in range(20):
+                self.kms.encrypt_data_with_kms_key('sym', b"abcd")
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        self.kms.usage.flush()  # flush concurrently with the writers
+        for thread in threads:
+            thread.join()
+        self.kms.flush()
+        self.assertEqual(self.kms.get_key('sym')["usage"]["operations"], 80)
+
+        reopened = KMS(key_store_path=self.store_path)
+        usage = reopened.get_key_usage('sym')
+        self.assertEqual(usage["operations"], 80)
+        self.assertEqual(usage["bytes"], 320)
+
+    def test_shards_of_exited_threads_are_dropped_after_flushing(self):
+        def worker():
+            self.kms.encrypt_data_with_kms_key('sym', b"abcd")
+
+        for _ in range(5):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(self.kms.usage._shards), 5)
+        self.kms.flush()
+        self.assertEqual(self.kms.usage._shards, [])
+        self.assertEqual(self.kms.get_key_usage('sym')["operations"], 5)
+
+        # The shard of a live thread is kept.
+        self.kms.encrypt_data_with_kms_key('sym', b"abcd")
+        self.kms.flush()
+        self.assertEqual(len(self.kms.usage._shards), 1)
+        self.assertEqual(self.kms.get_key_usage('sym')["operations"], 6)
+
+    def test_threshold_notifies_listeners_once(self):
+        listener = MagicMock()
+        self.kms.usage.threshold_listeners.append(listener)
+        for _ in range(60):
+            self.kms.encrypt_data_with_kms_key('sym', b"data")
+        self.kms.flush()
+        listener.assert_not_called()
+        for _ in range(60):
+            self.kms.encrypt_data_with_kms_key('sym', b"data")
+        self.kms.flush()
+        self.kms.encrypt_data_with_kms_key('sym', b"data")
+        self.kms.flush()
+        listener.assert_called_once()
+        self.assertEqual(listener.call_args[0][0], 'sym')
+
+    def test_rotated_key_reports_usage_of_current_version(self):
+        self.kms.encrypt_data_with_kms_key('sym', b"data")
+        self.kms.rotate_key('sym')
+        self.kms.encrypt_data_with_kms_key('sym', b"new version")
+        self.assertEqual(self.kms.get_key_usage('sym'), self.kms.get_key_usage('sym:v2'))
+        self.assertEqual(self.kms.get_key_usage('sym')["bytes"], 11)
+        self.kms.flush()
+        # The superseded version keeps its own usage record.
+        self.assertEqual(self.kms.get_key('sym')["usage"]["operations"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import datetime
+import os
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+from src.automation.partition_manager import PartitionManager
+from src.data_manager import DataManager
+from src.database import _ensure_partitions, _month_start, _parse_partition_bound, drop_encrypted_data_partitions_before
+from src.storage_backends import SQLiteBackend
+
+UTC = datetime.timezone.utc
+
+class TestPartitionBounds(unittest.TestCase):
+    def test_month_start(self):
+        moment = datetime.datetime(2026, 11, 17, 13, 5, tzinfo=UTC)
+        self.assertEqual(_month_start(moment), datetime.datetime(2026, 11, 1, tzinfo=UTC))
+        self.assertEqual(_month_start(moment, 2), datetime.datetime(2027, 1, 1, tzinfo=UTC))
+        self.assertEqual(_month_start(moment, -11), datetime.datetime(2025, 12, 1, tzinfo=UTC))
+
+    def test_parse_partition_bound(self):
+        self.assertIsNone(_parse_partition_bound("MINVALUE"))
+        self.assertEqual(_parse_partition_bound("'2026-10-01 00:00:00+00'"), datetime.datetime(2026, 10, 1, tzinfo=UTC))
+
+    def test_ensure_partitions_skips_existing_ranges(self):
+        cur = MagicMock()
+        cur.fetchall.side_effect = [
+            [("encrypted_data_store_legacy", "FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00+00')"),
+             ("encrypted_data_store_p202612", "FOR VALUES FROM ('2026-12-01 00:00:00+00') TO ('2027-01-01 00:00:00+00')")],
+            [("encrypted_data_chunks_legacy", "FOR VALUES FROM (MINVALUE) TO ('2026-12-01 00:00:00+00')")],
+        ]
+        created = _ensure_partitions(cur, 3, now=datetime.datetime(2026, 10, 19, tzinfo=UTC))
+        self.assertEqual(created, ["encrypted_data_store_p202611", "encrypted_data_store_p202701",
+                                   "encrypted_data_chunks_p202612", "encrypted_data_chunks_p202701"])
+        statements = [call[0] for call in cur.execute.call_args_list if "PARTITION OF" in call[0][0]]
+        self.assertEqual(statements[0][1], (datetime.datetime(2026, 11, 1, tzinfo=UTC), datetime.datetime(2026, 12, 1, tzinfo=UTC)))
+
+    @patch('src.database.db_connection')
+    def test_drop_partitions_removes_chunk_partitions_without_row_deletes(self, mock_db_connection):
+        cur = mock_db_connection.return_value.__enter__.return_value.cursor.return_value
+        cur.fetchall.side_effect = [
+            [("encrypted_data_store_p202608", "FOR VALUES FROM ('2026-08-01 00:00:00+00') TO ('2026-09-01 00:00:00+00')"),
+             ("encrypted_data_store_p202609", "FOR VALUES FROM ('2026-09-01 00:00:00+00') TO ('2026-10-01 00:00:00+00')")],
+            [("encrypted_data_chunks_p202608", "FOR VALUES FROM ('2026-08-01 00:00:00+00') TO ('2026-09-01 00:00:00+00')"),
+             ("encrypted_data_chunks_p202609", "FOR VALUES FROM ('2026-09-01 00:00:00+00') TO ('2026-10-01 00:00:00+00')")],
+        ]
+        removed = drop_encrypted_data_partitions_before(datetime.datetime(2026, 9, 15, tzinfo=UTC))
+        self.assertEqual(removed, ["encrypted_data_store_p202608", "encrypted_data_chunks_p202608"])
+        statements = [call[0][0] for call in cur.execute.call_args_list]
+        self.assertIn("DROP TABLE encrypted_data_chunks_p202608", statements)
+        self.assertFalse(any(sql.lstrip().startswith("DELETE") for sql in statements))
+
+class TestPartitionManager(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.backend = SQLiteBackend(os.path.join(self.temp_dir, "test.db"))
+        self.data_manager = DataManager(backend=self.backend)
+        self.engine = MagicMock()
+        with self.backend.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s) RETURNING id;",
+                        ("alice", "hash", "user"))
+            self.user_id = cur.fetchone()[0]
+            conn.commit()
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_run_once_expires_old_data(self):
+        old_id = self.data_manager.store_encrypted_chunks(self.user_id, "video", [b"a", b"b"], {"format": "stream"})
+        new_id = self.data_manager.store_encrypted_data(self.user_id, "note", b"content", {})
+        with self.backend.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE encrypted_data_store SET created_at = %s WHERE data_id = %s",
+                        (datetime.datetime.now(UTC) - datetime.timedelta(days=45), old_id))
+            conn.commit()
+
+        manager = PartitionManager(self.engine, self.data_manager, retention_days=30)
+        result = manager.run_once()
+        self.assertEqual(result, {"status": "success", "created": [], "removed": [], "deleted_rows": 1,
+                                  "blobs_removed": []})
+        self.assertIsNone(self.data_manager.retrieve_encrypted_data(old_id))
+        self.assertEqual(list(self.data_manager.iter_encrypted_chunks(old_id)), [])
+        self.assertIsNotNone(self.data_manager.retrieve_encrypted_data(new_id))
+
+    def test_zero_retention_keeps_data(self):
+        data_id = self.data_manager.store_encrypted_data(self.user_id, "note", b"content", {})
+        result = PartitionManager(self.engine, self.data_manager, retention_days=0).run_once()
+        self.assertEqual(result["deleted_rows"], 0)
+        self.assertIsNotNone(self.data_manager.retrieve_encrypted_data(data_id))
+
+    def test_start_submits_runs(self):
+        manager = PartitionManager(self.engine, self.data_manager, interval=3600)
+        manager.start()
+        manager.stop()
+        self.engine.add_task.assert_called_once_with(manager.run_once)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import unittest
+import base64
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+from src.kms_api import KMS
+from src.automation.reencryption_job import ReencryptionJob
+from src.blob_store import BlobStore
+
+class TestReencryptionJob(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.kms = KMS(key_store_path=os.path.join(self.temp_dir, "kms_key_store.json"))
+        self.kms.generate_symmetric_key('data_key')
+        self.checkpoint_path = os.path.join(self.temp_dir, "checkpoint.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _make_rows(self, count):
+        rows = []
+        for i in range(count):
+            ciphertext, nonce, tag = self.kms.encrypt_data_with_kms_key('data_key', f"row {i}".encode())
+            rows.append((f"id-{i:03d}", nonce + tag + ciphertext, {"kms_key_id": "data_key"}))
+        return rows
+
+    def _mock_connections(self, rows):
+        # The read cursor streams data_ids in batches of 2; the write connection serves
+        # the content of the requested IDs.
+        read_conn = MagicMock()
+        read_cur = read_conn.cursor.return_value
+        batches = [[(row[0],) for row in rows[i:i + 2]] for i in range(0, len(rows), 2)] + [[]]
+        read_cur.fetchmany.side_effect = batches
+        write_conn = MagicMock()
+        write_cur = write_conn.cursor.return_value
+        write_cur.fetchall.side_effect = lambda: [row for row in rows if row[0] in write_cur.execute.call_args[0][1][0]]
+        return read_conn, write_conn
+
+    @patch('src.automation.reencryption_job.execute_batch')
+    @patch('src.automation.reencryption_job.get_db_connection')
+    def test_reencrypts_rows_in_batches_and_checkpoints(self, mock_get_conn, mock_execute_batch):
+        rows = self._make_rows(5)
+        self.kms.rotate_key('data_key')
+        read_conn, write_conn = self._mock_connections(rows)
+        mock_get_conn.side_effect = [read_conn, write_conn]
+
+        job = ReencryptionJob(self.kms, 'data_key', checkpoint_path=self.checkpoint_path, batch_size=2)
+        progress = job.run()
+
+        self.assertEqual(progress["status"], "completed")
+        self.assertEqual(progress["reencrypted"], 5)
+        self.assertEqual(progress["last_data_id"], "id-004")
+        # One write transaction per fetched batch.
+        self.assertEqual(mock_execute_batch.call_count, 3)
+        self.assertEqual(write_conn.commit.call_count, 3)
+        read_conn.cursor.assert_called_with(name="reencrypt_data_key")
+
+        content, metadata, data_id = mock_execute_batch.call_args_list[0][0][2][0]
+        self.assertEqual(data_id, "id-000")
+        self.assertEqual(json.loads(metadata)["key_version"], 2)
+        self.assertEqual(KMS.ciphertext_key_version(content[28:]), 2)
+        self.assertEqual(self.kms.decrypt_data_with_kms_key('data_key', content[28:], content[:12], content[12:28]),
+                         b"row 0")
+
+        with open(self.checkpoint_path) as f:
+            self.assertEqual(json.load(f)["last_data_id"], "id-004")
+
+    @patch('src.automation.reencryption_job.execute_batch')
+    @patch('src.automation.reencryption_job.get_db_connection')
+    def test_reencrypts_spilled_blobs(self, mock_get_conn, mock_execute_batch):
+        blob_store = BlobStore(os.path.join(self.temp_dir, "blobs"))
+        ciphertext, nonce, tag = self.kms.encrypt_data_with_kms_key('data_key', b"large payload")
+        old_digest = blob_store.put(nonce + tag + ciphertext)
+        rows = [("id-000", b"", {"kms_key_id": "data_key", "storage": "blob", "blob_digest": old_digest,
+                                 "blob_size": len(ciphertext) + 28})]
+        self.kms.rotate_key('data_key')
+        mock_get_conn.side_effect = self._mock_connections(rows)
+
+        job = ReencryptionJob(self.kms, 'data_key', checkpoint_path=self.checkpoint_path, blob_store=blob_store)
+        progress = job.run()
+
+        self.assertEqual(progress["reencrypted"], 1)
+        content, metadata, data_id = mock_execute_batch.call_args_list[0][0][2][0]
+        metadata = json.loads(metadata)
+        self.assertEqual(content, b"")
+        self.assertNotEqual(metadata["blob_digest"], old_digest)
+        blob = blob_store.read(metadata["blob_digest"])
+        self.assertEqual(metadata["blob_size"], len(blob))
+        self.assertEqual(KMS.ciphertext_key_version(blob[28:]), 2)
+        self.assertEqual(self.kms.decrypt_data_with_kms_key('data_key', blob[28:], blob[:12], blob[12:28]),
+                         b"large payload")
+        # The old blob stays until garbage collection confirms nothing references it.
+        self.assertTrue(blob_store.exists(old_digest))
+
+    @patch('src.automation.reencryption_job.execute_batch')
+    @patch('src.automation.reencryption_job.get_db_connection')
+    def test_resumes_from_checkpoint(self, mock_get_conn, mock_execute_batch):
+        with open(self.checkpoint_path, 'w') as f:
+            json.dump({"key_id": "data_key", "processed": 2, "reencrypted": 2, "last_data_id": "id-001"}, f)
+        rows = self._make_rows(4)[2:]
+        self.kms.rotate_key('data_key')
+        read_conn, write_conn = self._mock_connections(rows)
+        mock_get_conn.side_effect = [read_conn, write_conn]
+
+        progress = ReencryptionJob(self.kms, 'data_key', checkpoint_path=self.checkpoint_path, batch_size=2).run()
+
+        query, params = read_conn.cursor.return_value.execute.call_args[0]
+        self.assertTrue(query.startswith("SELECT data_id FROM encrypted_data_store"))
+        self.assertIn("data_id > %s", query)
+        self.assertIn("encryption_metadata @> %s::jsonb", query)
+        self.assertEqual(params, ['{"kms_key_id": "data_key"}', "id-001"])
+        self.assertEqual(progress["processed"], 4)
+        self.assertEqual(progress["reencrypted"], 4)
+
+    @patch('src.automation.reencryption_job.execute_batch')
+    @patch('src.automation.reencryption_job.get_db_connection')
+    def test_failed_rows_are_checkpointed_and_retried(self, mock_get_conn, mock_execute_batch):
+        rows = self._make_rows(3)
+        self.kms.rotate_key('data_key')
+        good_content = rows[1][1]
+        rows[1] = (rows[1][0], b"\x00" * 40, rows[1][2])  # not decryptable
+        mock_get_conn.side_effect = self._mock_connections(rows)
+
+        progress = ReencryptionJob(self.kms, 'data_key', checkpoint_path=self.checkpoint_path, batch_size=2).run()
+        self.assertEqual(progress["status"], "completed_with_failures")
+        self.assertEqual(progress["reencrypted"], 2)
+        self.assertEqual(progress["failed_data_ids"], ["id-001"])
+        self.assertEqual(progress["last_data_id"], "id-002")
+
+        # The next run retries the failed row before continuing after the checkpoint.
+        rows[1] = (rows[1][0], good_content, rows[1][2])
+        read_conn, write_conn = self._mock_connections(rows)
+        read_conn.cursor.return_value.fetchmany.side_effect = [[]]
+        mock_get_conn.side_effect = [read_conn, write_conn]
+        mock_execute_batch.reset_mock()
+        progress = ReencryptionJob(self.kms, 'data_key', checkpoint_path=self.checkpoint_path, batch_size=2).run()
+
+        self.assertEqual(progress["status"], "completed")
+        self.assertEqual(progress["reencrypted"], 3)
+        self.assertEqual(progress["failed"], 0)
+        self.assertEqual(progress["failed_data_ids"], [])
+        self.assertEqual(progress["processed"], 3)
+        self.assertEqual([update[2] for update in mock_execute_batch.call_args[0][2]], ["id-001"])
+        with open(self.checkpoint_path) as f:
+            self.assertEqual(json.load(f)["failed_data_ids"], [])
+
+    @patch('src.automation.reencryption_job.execute_batch')
+    @patch('src.automation.reencryption_job.get_db_connection')
+    def test_skips_rows_already_on_current_version(self, mock_get_conn, mock_execute_batch):
+        self.kms.rotate_key('data_key')
+        rows = self._make_rows(2)
+        read_conn, write_conn = self._mock_connections(rows)
+        mock_get_conn.side_effect = [read_conn, write_conn]
+
+        progress = ReencryptionJob(self.kms, 'data_key', checkpoint_path=self.checkpoint_path, batch_size=2).run()
+
+        self.assertEqual(progress["skipped"], 2)
+        self.assertEqual(progress["reencrypted"], 0)
+
+    @patch('src.automation.reencryption_job.execute_batch')
+    @patch('src.automation.reencryption_job.get_db_connection')
+    def test_rewraps_stream_data_key_only(self, mock_get_conn, mock_execute_batch):
+        wrapped_dek, chunks = self.kms.encrypt_stream('data_key', [b"chunk"])
+        chunks = list(chunks)
+        metadata = {"kms_key_id": "data_key", "format": "stream",
+                    "wrapped_dek": base64.b64encode(wrapped_dek).decode('utf-8')}
+        self.kms.rotate_key('data_key')
+        read_conn, write_conn = self._mock_connections([("id-000", b"", metadata)])
+        mock_get_conn.side_effect = [read_conn, write_conn]
+
+        progress = ReencryptionJob(self.kms, 'data_key', checkpoint_path=self.checkpoint_path, batch_size=2).run()
+
+        self.assertEqual(progress["reencrypted"], 1)
+        content, new_metadata, _ = mock_execute_batch.call_args_list[0][0][2][0]
+        self.assertEqual(content, b"")
+        new_wrapped_dek = base64.b64decode(json.loads(new_metadata)["wrapped_dek"])
+        self.assertEqual(KMS.ciphertext_key_version(new_wrapped_dek[28:]), 2)
+        self.assertEqual(list(self.kms.decrypt_stream('data_key', new_wrapped_dek, chunks)), [b"chunk"])
+
+    @patch('src.automation.reencryption_job.execute_batch')
+    @patch('src.automation.reencryption_job.get_db_connection')
+    def test_reports_progress_to_automation_engine(self, mock_get_conn, mock_execute_batch):
+        rows = self._make_rows(2)
+        self.kms.rotate_key('data_key')
+        read_conn, write_conn = self._mock_connections(rows)
+        mock_get_conn.side_effect = [read_conn, write_conn]
+        engine = MagicMock()
+        engine.add_task.return_value = "task_1"
+
+        job = ReencryptionJob(self.kms, 'data_key', checkpoint_path=self.checkpoint_path, batch_size=2)
+        self.assertEqual(job.submit(engine), "task_1")
+        engine.add_task.assert_called_once_with(job.run)
+        job.run()
+
+        last_progress = engine.update_task_progress.call_args[0][1]
+        self.assertEqual(last_progress["status"], "completed")
+        self.assertIn("rows_per_second", last_progress)
+
+if __name__ == '__main__':
+    unittest.main()
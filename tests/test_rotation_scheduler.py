@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import MagicMock
+from src.kms_api import KMS
+from src.automation.rotation_scheduler import RotationScheduler
+
+class TestRotationScheduler(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.kms = KMS(key_store_path=os.path.join(self.temp_dir, "kms_key_store.json"))
+        self.engine = MagicMock()
+        self.engine.add_task.side_effect = lambda function, *args: f"task_{self.engine.add_task.call_count}"
+        self.scheduler = RotationScheduler(self.kms, self.engine, default_interval=100, max_batch_size=2)
+
+    def tearDown(self):
+        self.scheduler.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def test_only_due_keys_are_submitted_in_batches(self):
+        for key_id, last_rotated_at in [("a", 0), ("b", 10), ("c", 20), ("d", 500)]:
+            self.scheduler.schedule(key_id, last_rotated_at)
+        self.assertEqual(self.scheduler.next_due_at(), 100)
+
+        task_ids = self.scheduler.tick(now=150)
+        self.assertEqual(task_ids, ["task_1", "task_2"])
+        batches = [call[0][1] for call in self.engine.add_task.call_args_list]
+        self.assertEqual(batches, [["a", "b"], ["c"]])
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.next_due_at(), 600)
+
+    def test_rescheduling_replaces_previous_due_time(self):
+        self.scheduler.schedule("a", 0)
+        self.scheduler.set_rotation_interval("a", 1000, last_rotated_at=0)
+        self.assertEqual(self.scheduler.tick(now=500), [])
+        self.assertEqual(self.scheduler.next_due_at(), 1000)
+        self.scheduler.unschedule("a")
+        self.assertIsNone(self.scheduler.next_due_at())
+
+    def test_rotate_batch_rotates_and_schedules_new_versions(self):
+        self.kms.generate_symmetric_key("sym")
+        self.kms.generate_symmetric_key("other")
+        self.assertEqual(self.scheduler.load_from_kms(), 2)
+        self.scheduler.set_rotation_interval("sym", 50)
+
+        result = self.scheduler.rotate_batch(["sym", "missing"])
+        self.assertEqual(result["rotated"], {"sym": "sym:v2"})
+        self.assertEqual(result["failed"], ["missing"])
+        self.assertEqual(self.kms.get_current_key_id("sym"), "sym:v2")
+        # The new version inherits the per-key interval; the failed key is retried later.
+        due_at = self.scheduler.next_due_at()
+        self.assertAlmostEqual(due_at, time.time() + 50, delta=5)
+
+    def test_stale_entries_are_skipped(self):
+        self.kms.generate_symmetric_key("sym")
+        self.kms.generate_symmetric_key("revoked")
+        self.scheduler.load_from_kms()
+        self.scheduler.set_rotation_interval("sym", 50)
+        # Rotated and revoked outside the scheduler after their entries were pushed.
+        self.kms.rotate_key("sym")
+        self.kms.revoke_key("revoked")
+
+        self.scheduler.tick(now=time.time() + 1000)
+        self.engine.add_task.assert_called_once_with(self.scheduler.rotate_batch, ["sym", "revoked"])
+        result = self.scheduler.rotate_batch(["sym", "revoked"])
+        self.assertEqual(result["rotated"], {})
+        self.assertEqual(result["skipped"], ["sym", "revoked"])
+        self.assertEqual(result["failed"], [])
+        self.assertEqual(self.kms.get_key_versions("sym"), ["sym", "sym:v2"])
+        # The current version takes the superseded entry's place, with its interval.
+        self.assertEqual(len(self.scheduler), 1)
+        last_rotated_at = self.kms.get_key("sym:v2")["last_rotated_at"]
+        self.assertAlmostEqual(self.scheduler.next_due_at(), last_rotated_at + 50, delta=1)
+
+    def test_usage_threshold_makes_key_due_immediately(self):
+        self.kms.usage.max_operations = 3
+        self.kms.generate_symmetric_key("busy")
+        self.scheduler.schedule("busy", time.time())
+        for _ in range(3):
+            self.kms.encrypt_data_with_kms_key("busy", b"payload")
+        self.kms.flush()
+        self.assertEqual(self.scheduler.tick(), ["task_1"])
+        self.engine.add_task.assert_called_once_with(self.scheduler.rotate_batch, ["busy"])
+
+    def test_usage_threshold_of_superseded_version_is_ignored(self):
+        self.kms.generate_symmetric_key("busy")
+        ciphertext, nonce, tag = self.kms.encrypt_data_with_kms_key("busy", b"payload")
+        self.kms.rotate_key("busy")
+        self.kms.usage.max_operations = 3
+        for _ in range(3):
+            self.kms.decrypt_data_with_kms_key("busy", ciphertext, nonce, tag)
+        self.kms.flush()
+        self.assertEqual(self.scheduler.tick(), [])
+        self.engine.add_task.assert_not_called()
+
+    def test_thread_wakes_when_a_key_comes_due(self):
+        self.scheduler.start()
+        self.scheduler.schedule("soon", time.time() - 100 + 0.05)
+        deadline = time.time() + 5
+        while not self.engine.add_task.called and time.time() < deadline:
+            time.sleep(0.01)
+        self.engine.add_task.assert_called_once_with(self.scheduler.rotate_batch, ["soon"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from src.secure_messaging_app import send_message, receive_message
+from src.secure_messaging_app import send_message, receive_message, list_inbox
 
 class TestSecureMessagingAppFunctions(unittest.TestCase):
 
@@ -54,5 +54,25 @@ class TestSecureMessagingAppFunctions(unittest.TestCase):
         mock_decrypt.assert_called_once_with(b'encrypted_message_bytes', b'\x00'*12, b'\x00'*16, b'\x00'*32)
         self.assertIn(f"Decrypted message: {message_content}", captured_output.getvalue())
 
+    @patch('src.secure_messaging_app.data_manager.query_by_metadata')
+    @patch('src.secure_messaging_app.get_user_by_username')
+    def test_list_inbox(self, mock_get_user, mock_query):
+        mock_get_user.side_effect = lambda username: {'id': 2} if username == "bob" else None
+        mock_query.return_value = {
+            "items": [{"data_id": "m1", "user_id": 1, "data_type": "secure_message", "created_at": "t1",
+                       "encryption_metadata": {"sender_username": "alice", "recipient_username": "bob",
+                                               "original_message_length": 5}}],
+            "next_cursor": "c2",
+        }
+
+        inbox = list_inbox("bob", limit=10)
+
+        mock_query.assert_called_once_with({"recipient_username": "bob"}, cursor=None, limit=10,
+                                           data_type="secure_message")
+        self.assertEqual(inbox, {"messages": [{"data_id": "m1", "sender_username": "alice", "created_at": "t1",
+                                               "original_message_length": 5}], "next_cursor": "c2"})
+        with self.assertRaises(ValueError):
+            list_inbox("mallory")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
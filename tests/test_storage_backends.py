@@ -0,0 +1,227 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from unittest.mock import patch
+from src.blob_store import BlobStore
+from src.data_manager import DataManager, profile_cache
+from src.kms_api import KMS
+from src.storage_backends import SQLiteBackend, set_backend
+import src.auth as auth
+
+class TestSQLiteBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.backend = SQLiteBackend(os.path.join(self.temp_dir, "test.db"))
+        self.data_manager = DataManager(backend=self.backend)
+        profile_cache.clear()
+        auth.user_cache.clear()
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _create_user(self, username="alice"):
+        with self.backend.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s) RETURNING id;",
+                        (username, "hash", "user"))
+            user_id = cur.fetchone()[0]
+            conn.commit()
+            return user_id
+
+    def test_uses_wal_and_one_connection_per_thread(self):
+        with self.backend.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("PRAGMA journal_mode")
+            self.assertEqual(cur.fetchone()[0], "wal")
+        connections = []
+
+        def worker():
+            with self.backend.connection() as conn:
+                connections.append(conn)
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with self.backend.connection() as conn:
+            connections.append(conn)
+        self.assertEqual(len({id(conn) for conn in connections}), 3)
+
+    def test_profiles(self):
+        user_id = self._create_user()
+        self.assertTrue(self.data_manager.create_user_profile(user_id, "Alice", preferences={"theme": "dark"}))
+        profile = self.data_manager.get_user_profile(user_id)
+        self.assertEqual(profile["display_name"], "Alice")
+        self.assertEqual(profile["preferences"], {"theme": "dark"})
+        self.assertIsNotNone(profile["created_at"].tzinfo)
+        self.assertTrue(self.data_manager.update_user_profile(user_id, display_name="Alicia"))
+        self.assertEqual(self.data_manager.get_user_profile(user_id)["display_name"], "Alicia")
+        self.assertTrue(self.data_manager.delete_user_profile(user_id))
+        self.assertIsNone(self.data_manager.get_user_profile(user_id))
+        # Constraint violations are reported like database errors on PostgreSQL.
+        self.assertFalse(self.data_manager.create_user_profile(9999, "Nobody"))
+
+    def test_encrypted_data(self):
+        user_id = self._create_user()
+        data_id = self.data_manager.store_encrypted_data(user_id, "message", b"\x00\x01", {"alg": "A"})
+        data = self.data_manager.retrieve_encrypted_data(data_id)
+        self.assertEqual(len(data_id), 36)
+        self.assertEqual(bytes(data["encrypted_content"]), b"\x00\x01")
+        self.assertEqual(data["encryption_metadata"], {"alg": "A"})
+
+        batch_ids = self.data_manager.store_encrypted_data_many([(user_id, "message", b"m", {}) for _ in range(3)])
+        copied_ids = self.data_manager.copy_encrypted_data(((user_id, "file", b"f", {}) for _ in range(3)), chunk_size=2)
+        seen, cursor = [], None
+        while True:
+            page = self.data_manager.list_encrypted_data_page(user_id, limit=2, cursor=cursor)
+            seen += [item["data_id"] for item in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), sorted([data_id] + batch_ids + copied_ids))
+        self.assertEqual(len(self.data_manager.list_encrypted_data_by_user(user_id, data_type="file")), 3)
+
+        chunked_id = self.data_manager.store_encrypted_chunks(user_id, "file", (bytes([i]) for i in range(5)),
+                                                              {"format": "stream"}, page_size=2)
+        self.assertEqual(list(self.data_manager.iter_encrypted_chunks(chunked_id)), [bytes([i]) for i in range(5)])
+        self.assertTrue(self.data_manager.delete_encrypted_data(chunked_id))
+        self.assertEqual(list(self.data_manager.iter_encrypted_chunks(chunked_id)), [])
+
+    def test_encrypt_and_store_compressed(self):
+        user_id = self._create_user()
+        session_key = os.urandom(32)
+        plaintext = b'{"event": "login", "status": "ok"}\n' * 200
+        data_id = self.data_manager.encrypt_and_store_data(user_id, "audit_log", plaintext, session_key,
+                                                           {"format": "aes-gcm"}, compression="auto")
+        record = self.data_manager.retrieve_encrypted_data(data_id)
+        self.assertEqual(record["encryption_metadata"],
+                         {"format": "aes-gcm", "compression": "zlib", "original_size": len(plaintext)})
+        self.assertLess(len(record["encrypted_content"]), len(plaintext) // 10)
+        self.assertEqual(self.data_manager.retrieve_and_decrypt_data(data_id, session_key), plaintext)
+        with self.assertRaises(ValueError):
+            self.data_manager.retrieve_and_decrypt_data(data_id, os.urandom(32))
+
+        # Compression is opt-in.
+        raw_id = self.data_manager.encrypt_and_store_data(user_id, "blob", plaintext, session_key)
+        self.assertEqual(self.data_manager.retrieve_encrypted_data(raw_id)["encryption_metadata"]["compression"], "none")
+        self.assertEqual(self.data_manager.retrieve_and_decrypt_data(raw_id, session_key), plaintext)
+
+    def test_large_payloads_spill_to_blob_store(self):
+        blob_store = BlobStore(os.path.join(self.temp_dir, "blobs"))
+        data_manager = DataManager(backend=self.backend, blob_store=blob_store, blob_threshold=1024)
+        user_id = self._create_user()
+        large, small = os.urandom(4096), os.urandom(512)
+        large_id = data_manager.store_encrypted_data(user_id, "file", large, {"alg": "A"})
+        copy_id = data_manager.store_encrypted_data(user_id, "file", large, {"alg": "A"})
+        small_id = data_manager.store_encrypted_data(user_id, "file", small, {"alg": "A"})
+
+        with self.backend.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT encrypted_content, encryption_metadata FROM encrypted_data_store WHERE data_id = %s",
+                        (large_id,))
+            content, metadata = cur.fetchone()
+        self.assertEqual(content, b"")
+        self.assertEqual(metadata["storage"], "blob")
+        self.assertEqual(metadata["blob_size"], 4096)
+        self.assertTrue(blob_store.verify(metadata["blob_digest"]))
+        self.assertEqual(data_manager.retrieve_encrypted_data(large_id)["encrypted_content"], large)
+        self.assertEqual(data_manager.retrieve_encrypted_data(small_id)["encrypted_content"], small)
+        self.assertEqual(b"".join(data_manager.iter_encrypted_content(large_id, chunk_size=1000)), large)
+        self.assertEqual(list(data_manager.iter_encrypted_content(small_id, chunk_size=400)), [small[:400], small[400:]])
+
+        # The blob is shared by identical ciphertexts and collected once its last row is gone.
+        self.assertTrue(data_manager.delete_encrypted_data(large_id))
+        self.assertEqual(data_manager.collect_blob_garbage(min_age=0), [])
+        self.assertTrue(data_manager.delete_encrypted_data(copy_id))
+        self.assertTrue(blob_store.exists(metadata["blob_digest"]))
+        self.assertEqual(data_manager.collect_blob_garbage(min_age=3600), [])
+        self.assertEqual(data_manager.collect_blob_garbage(min_age=0), [metadata["blob_digest"]])
+        self.assertFalse(blob_store.exists(metadata["blob_digest"]))
+
+        # Blobs orphaned by bulk expiry are garbage-collected.
+        orphan_id = data_manager.store_encrypted_data(user_id, "file", large, {})
+        with self.backend.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM encrypted_data_store WHERE data_id = %s", (orphan_id,))
+            conn.commit()
+        self.assertEqual(data_manager.collect_blob_garbage(min_age=3600), [])
+        self.assertEqual(data_manager.collect_blob_garbage(min_age=0), [metadata["blob_digest"]])
+
+        # The bulk insert paths spill as well.
+        batch_ids = data_manager.store_encrypted_data_many([(user_id, "file", large, {}), (user_id, "file", small, {})])
+        copied_ids = data_manager.copy_encrypted_data([(user_id, "file", small, {}), (user_id, "file", large, {})])
+        for data_id, payload, storage in zip(batch_ids + copied_ids, [large, small, small, large],
+                                             ["blob", None, None, "blob"]):
+            data = data_manager.retrieve_encrypted_data(data_id)
+            self.assertEqual(data["encryption_metadata"].get("storage"), storage)
+            self.assertEqual(data["encrypted_content"], payload)
+
+    def test_query_by_metadata(self):
+        alice, bob = self._create_user("alice"), self._create_user("bob")
+        ids = [self.data_manager.store_encrypted_data(alice, "secure_message", bytes([i]),
+                                                      {"recipient_username": "bob", "urgent": i == 1, "tags": ["a"]})
+               for i in range(3)]
+        self.data_manager.store_encrypted_data(bob, "secure_message", b"x", {"recipient_username": "alice"})
+        self.data_manager.store_encrypted_data(alice, "blob", b"y", {"recipient_username": "bob", "kms_key_id": "k1"})
+
+        # Rows created within the same millisecond are ordered by data_id.
+        first = self.data_manager.query_by_metadata({"recipient_username": "bob"}, limit=2, data_type="secure_message")
+        self.assertEqual(len(first["items"]), 2)
+        self.assertEqual(first["items"][0]["user_id"], alice)
+        self.assertNotIn("encrypted_content", first["items"][0])
+        second = self.data_manager.query_by_metadata({"recipient_username": "bob"}, cursor=first["next_cursor"], limit=2,
+                                                     data_type="secure_message", include_content=True)
+        self.assertEqual(sorted(item["data_id"] for item in first["items"] + second["items"]), sorted(ids))
+        self.assertEqual(second["items"][0]["encrypted_content"], bytes([ids.index(second["items"][0]["data_id"])]))
+        self.assertIsNone(second["next_cursor"])
+
+        self.assertEqual(len(self.data_manager.query_by_metadata({"recipient_username": "bob"})["items"]), 4)
+        self.assertEqual([item["data_id"] for item in self.data_manager.query_by_metadata({"urgent": True})["items"]], [ids[1]])
+        self.assertEqual(len(self.data_manager.query_by_metadata({"tags": ["a"], "urgent": False})["items"]), 2)
+        self.assertEqual(len(self.data_manager.query_by_metadata({"kms_key_id": "k1"}, user_id=bob)["items"]), 0)
+        with self.assertRaises(ValueError):
+            self.data_manager.query_by_metadata({})
+
+    def test_find_encrypted_data_by_blind_index(self):
+        kms = KMS(key_store_path=os.path.join(self.temp_dir, "kms_key_store.json"))
+        kms.generate_symmetric_key("blind_index_key")
+        data_manager = DataManager(backend=self.backend, kms=kms)
+        alice, bob = self._create_user("alice"), self._create_user("bob")
+        first = data_manager.store_encrypted_data(alice, "contact", b"c1", {}, {"email": "carol@example.com", "city": "Oslo"})
+        data_manager.store_encrypted_data(alice, "contact", b"c2", {}, {"email": "dave@example.com", "city": "Oslo"})
+        third = data_manager.store_encrypted_data(alice, "note", b"n1", {}, {"email": "carol@example.com"})
+        data_manager.store_encrypted_data(bob, "contact", b"c3", {}, {"email": "carol@example.com"})
+
+        found = data_manager.find_encrypted_data(alice, "email", "carol@example.com")
+        self.assertEqual(sorted(item["data_id"] for item in found), sorted([first, third]))
+        self.assertEqual({item["data_id"]: item["encrypted_content"] for item in found}[first], b"c1")
+        self.assertEqual([item["data_id"] for item in data_manager.find_encrypted_data(alice, "email", "carol@example.com", "note")], [third])
+        self.assertEqual(len(data_manager.find_encrypted_data(alice, "city", "Oslo")), 2)
+        self.assertEqual(data_manager.find_encrypted_data(alice, "city", "carol@example.com"), [])
+
+        with self.backend.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT blind_indexes FROM encrypted_data_store WHERE data_id = %s", (first,))
+            self.assertNotIn("carol", str(cur.fetchone()[0]))
+        with self.assertRaises(ValueError):
+            self.data_manager.store_encrypted_data(alice, "contact", b"c4", {}, {"email": "erin@example.com"})
+
+    @patch('src.auth.hash_password', side_effect=lambda password: "hashed:" + password)
+    @patch('src.auth.check_password', side_effect=lambda password, hashed: hashed == "hashed:" + password)
+    def test_auth_uses_configured_backend(self, mock_check, mock_hash):
+        set_backend(self.backend)
+        try:
+            user_id = auth.create_user("bob", "pw")
+            self.assertIsNotNone(user_id)
+            self.assertEqual(auth.authenticate_user("bob", "pw")["id"], user_id)
+            self.assertIsNone(auth.authenticate_user("bob", "wrong"))
+            self.assertEqual(self.data_manager.get_user_profile(user_id)["display_name"], "bob")
+        finally:
+            set_backend(None)
+
+if __name__ == '__main__':
+    unittest.main()